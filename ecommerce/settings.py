@@ -9,7 +9,9 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import os
 from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,6 +51,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack
+    'shop.metrics.MetricsMiddleware',
+    'shop.profiling.ProfilingMiddleware',
+    'shop.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -83,11 +89,140 @@ WSGI_APPLICATION = 'ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# SQLite by default. Set DB_ENGINE (e.g. postgresql) with DB_NAME, DB_USER, DB_PASSWORD, DB_HOST
+# and DB_PORT for a server database. DB_REPLICAS lists read replicas, comma separated: hosts
+# for a server database, file paths for SQLite (kept in sync by "manage.py sync_replicas").
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+DB_REPLICAS = [location for location in os.environ.get('DB_REPLICAS', '').split(',') if location]
+
+
+def database(location):
+    config = {
+        'ENGINE': 'django.db.backends.%s' % DB_ENGINE,
+        # Persistent connections, checked before reuse so a restarted server costs one retry
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+    if DB_ENGINE == 'sqlite3':
+        config.update(NAME=location, OPTIONS={
+            # WAL lets readers run alongside the writer; NORMAL sync is durable enough with WAL
+            'init_command': 'PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;PRAGMA mmap_size=268435456',
+            # Writers take the lock when their transaction starts and queue for it for up to
+            # 20s, instead of failing with "database is locked" when a read turns into a write
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        })
+    else:
+        config.update(NAME=os.environ.get('DB_NAME', 'ecommerce'), USER=os.environ.get('DB_USER', ''),
+                      PASSWORD=os.environ.get('DB_PASSWORD', ''), HOST=location,
+                      PORT=os.environ.get('DB_PORT', ''))
+    return config
+
+
 DATABASES = {
+    'default': database(BASE_DIR / 'db.sqlite3' if DB_ENGINE == 'sqlite3' else os.environ.get('DB_HOST', '')),
+}
+if DB_ENGINE == 'sqlite3':
+    # A file rather than shared-cache memory, whose table locks fail at once instead of
+    # queueing: the concurrency tests run transactions from several threads
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+for _number, _location in enumerate(DB_REPLICAS, 1):
+    # Tests read the primary through every replica alias instead of creating test replicas
+    DATABASES['replica%d' % _number] = dict(database(_location), TEST={'MIRROR': 'default'})
+
+# Writes, and reads outside safe requests, go to the primary. GET/HEAD requests read from a
+# random replica, except for clients that wrote in the last STICKY_SECONDS (see shop/routers.py).
+DATABASE_ROUTERS = ['shop.routers.PrimaryReplicaRouter']
+SHOP_DATABASE_ROUTING = {
+    'REPLICAS': ['replica%d' % number for number in range(1, len(DB_REPLICAS) + 1)],
+    'STICKY_SECONDS': 5,
+}
+
+
+# Cache
+# Local-memory (LRU) by default; set CACHE_URL=redis://host:6379/0 to share the cache between workers
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Token claim revocations (see shop/authentication.py); kept apart so payload churn never evicts them
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce-auth',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+if os.environ.get('CACHE_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CACHE_URL'],
+    }
+    CACHES['auth'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CACHE_URL'],
+        'KEY_PREFIX': 'auth',
     }
+
+# Authenticated requests trust the role and shopkeeper/customer/shop ids signed into the
+# token instead of loading the user. Revocations live in this cache alias; with several
+# worker processes it must be shared (set CACHE_URL), or a revocation reaches one worker only.
+# A local-memory alias is therefore ignored (every token is checked against the database)
+# unless ALLOW_PROCESS_LOCAL says the server is a single process, as the dev server is.
+SHOP_AUTH = {
+    'REVOCATION_CACHE': 'auth',
+    'ALLOW_PROCESS_LOCAL': DEBUG,
+}
+
+# Read-through cache for product/shop detail payloads (see shop/cache.py)
+SHOP_DETAIL_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Per-view request metrics served at /metrics (see shop/metrics.py) to signed-in staff and,
+# with SHOP_METRICS_TOKEN set, to scrapers sending "Authorization: Bearer <token>". Requests
+# slower than SLOW_REQUEST_SECONDS are logged to "shop.metrics" with their SQL.
+SHOP_METRICS = {
+    'TOKEN': os.environ.get('SHOP_METRICS_TOKEN'),
+    'SLOW_REQUEST_SECONDS': 1.0,
+}
+
+# Opt-in request profiling (see shop/profiling.py): send "X-Profile: <token>" or ?profile=<token>
+# to profile one request, or set SAMPLE_RATE to profile a random fraction. No token, no triggers.
+SHOP_PROFILING = {
+    'TOKEN': os.environ.get('SHOP_PROFILING_TOKEN'),
+    'SAMPLE_RATE': float(os.environ.get('SHOP_PROFILING_SAMPLE_RATE', 0)),
+    'MODE': 'cprofile',
+    'DIRECTORY': os.environ.get('SHOP_PROFILING_DIRECTORY', str(BASE_DIR / 'profiles')),
+}
+
+# Background jobs (see shop/jobs.py) are stored in the Job table and run by
+# "manage.py run_jobs" worker processes. With SHOP_JOBS_EAGER=1 they run in the request's
+# process right after it commits instead, for development without a worker.
+SHOP_JOBS = {
+    'EAGER': os.environ.get('SHOP_JOBS_EAGER') == '1',
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY_SECONDS': 5,
+    # Workers renew the lease of a job they are running every third of this; a job whose
+    # lease runs out anyway has lost its worker and is handed to another one
+    'LEASE_SECONDS': 600,
+}
+
+# Streaming product imports (POST /api/products/import/, see shop/bulk.py) stop with an error
+# line at a line longer than MAX_LINE_BYTES or past MAX_UPLOAD_BYTES of decompressed input
+SHOP_IMPORT = {
+    'MAX_LINE_BYTES': 1024 * 1024,
+    'MAX_UPLOAD_BYTES': 256 * 1024 * 1024,
+}
+
+# POST /api/batch/ runs up to MAX_REQUESTS API calls under PATH_PREFIX per request (see shop/batch.py)
+SHOP_BATCH = {
+    'MAX_REQUESTS': 50,
+    'PATH_PREFIX': '/api/',
 }
 
 
@@ -110,6 +245,29 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing (see shop/hashers.py). New passwords use PASSWORD_HASHER: argon2 when
+# argon2-cffi is installed, scrypt otherwise. Hashes made by any other listed hasher (e.g.
+# existing PBKDF2 ones) still verify and are upgraded on the user's next login.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER') or ('argon2' if find_spec('argon2') else 'scrypt')
+_HASHERS = {
+    'argon2': 'shop.hashers.Argon2PasswordHasher',
+    'scrypt': 'shop.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'shop.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [_HASHERS[PASSWORD_HASHER]] + [hasher for name, hasher in _HASHERS.items()
+                                                  if name != PASSWORD_HASHER] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+# At most SLOTS passwords are hashed at once per process, so sign-up bursts leave cores for
+# other requests; callers that wait longer than WAIT_SECONDS get a 503. Costs are tunable
+# here too (ARGON2_*, SCRYPT_*, PBKDF2_ITERATIONS); changing one rehashes at next login.
+SHOP_PASSWORD_HASHING = {
+    'SLOTS': int(os.environ.get('PASSWORD_HASHING_SLOTS', max(1, (os.cpu_count() or 1) // 2))),
+    'WAIT_SECONDS': 1.0,
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -139,8 +297,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'shop.authentication.ClaimsJWTAuthentication',
+    ),
+
+    # DRF's JSON renderer/parser, through orjson when it is installed (see shop/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'shop.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+
+    # List endpoints are keyset paginated; clients may ask for up to 500 rows with ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'shop.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 
 }
 
@@ -148,6 +321,9 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
+    'TOKEN_OBTAIN_SERIALIZER': 'shop.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'shop.serializers.ClaimsTokenRefreshSerializer',
+    'TOKEN_USER_CLASS': 'shop.authentication.ShopTokenUser',
   }
 
 AUTH_USER_MODEL = 'shop.User'
@@ -5,6 +5,8 @@ from drf_yasg.views import get_schema_view
 from django.contrib import admin
 from django.urls import path, include
 from drf_yasg import openapi
+from shop.metrics import metrics_view
+from shop.profiling import ProfileListView, ProfileDownloadView
 
 
 schema_view = get_schema_view(
@@ -22,6 +24,9 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('shop.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', ProfileListView.as_view(), name='profile-list'),
+    path('profiles/<str:name>', ProfileDownloadView.as_view(), name='profile-download'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('swagger.json/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Shopkeeper, Customer, Shop, Product, Review, Order, OrderItem
+from .models import User, Shopkeeper, Customer, Shop, Product, Review, Order, OrderItem, Job
 
 
 admin.site.register(User)
@@ -9,4 +9,5 @@ admin.site.register(Shop)
 admin.site.register(Product)
 admin.site.register(Review)
 admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+admin.site.register(Job)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
+        from .authentication import check_revocation_cache
+        checks.register(check_revocation_cache, checks.Tags.security)
@@ -0,0 +1,98 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .authentication import revocations
+from .cache import detail_cache
+from .models import Shop, Shopkeeper, ShopAssignment
+
+# True while apply_assignments() runs: it invalidates once for the whole batch, so the
+# per-row ShopAssignment signals stand down (see signals.py)
+batch_in_progress = ContextVar('shop_assignment_batch', default=False)
+
+
+class AssignmentConflict(Exception):
+    pass
+
+
+@contextmanager
+def assignment_batch():
+    token = batch_in_progress.set(True)
+    try:
+        yield
+    finally:
+        batch_in_progress.reset(token)
+
+
+def assignments_changed(shop_ids, shopkeeper_ids):
+    # Assignments are embedded in the shop payload, so they also move the shops' versions,
+    # and a shopkeeper's shop is in their token claims
+    if shop_ids:
+        Shop.objects.filter(pk__in=shop_ids).update(updated_at=timezone.now())
+        detail_cache.invalidate(Shop, *shop_ids)
+    if shopkeeper_ids:
+        revocations.revoke(*Shopkeeper.objects.filter(pk__in=shopkeeper_ids).values_list('user_id', flat=True))
+
+
+def apply_assignments(desired):
+    """Make each shop's shopkeepers exactly desired[shop_id] (an iterable of shopkeeper ids).
+
+    Shops and shopkeepers are validated and the current assignments read in three queries,
+    whatever the batch size; then only the difference is written, with one filtered delete
+    and one bulk_create, all in one transaction. Nothing changes unless every shop in the
+    batch can be reassigned. Returns (added, removed) counts.
+    """
+    desired = {shop_id: set(shopkeeper_ids) for shop_id, shopkeeper_ids in desired.items()}
+    requested = set().union(*desired.values()) if desired else set()
+
+    errors = {}
+    missing_shops = set(desired) - set(Shop.objects.filter(pk__in=desired).values_list('pk', flat=True))
+    if missing_shops:
+        errors['shop'] = ['Shop with ID %s does not exist' % pk for pk in sorted(missing_shops)]
+    missing = requested - set(Shopkeeper.objects.filter(pk__in=requested).values_list('pk', flat=True))
+    if missing:
+        errors['shopkeeper_ids'] = ['Shopkeeper with ID %s does not exist' % pk for pk in sorted(missing)]
+    # A shopkeeper works at one shop at most
+    shops_by_shopkeeper = defaultdict(list)
+    for shop_id, shopkeeper_ids in desired.items():
+        for shopkeeper_id in shopkeeper_ids:
+            shops_by_shopkeeper[shopkeeper_id].append(shop_id)
+    twice = sorted(pk for pk, shop_ids in shops_by_shopkeeper.items() if len(shop_ids) > 1)
+    if twice:
+        errors.setdefault('shopkeeper_ids', []).extend(
+            'Shopkeeper %s is requested for more than one shop' % pk for pk in twice)
+    if errors:
+        raise serializers.ValidationError(errors)
+
+    with transaction.atomic(), assignment_batch():
+        current = list(ShopAssignment.objects.select_for_update()
+                       .filter(Q(shop_id__in=desired) | Q(shopkeeper_id__in=requested))
+                       .values_list('pk', 'shop_id', 'shopkeeper_id'))
+        elsewhere = sorted(shopkeeper_id for _, shop_id, shopkeeper_id in current if shop_id not in desired)
+        if elsewhere:
+            raise AssignmentConflict('Shopkeepers already assigned to another shop: %s'
+                                     % ', '.join(map(str, elsewhere)))
+
+        removed = [(pk, shop_id, shopkeeper_id) for pk, shop_id, shopkeeper_id in current
+                   if shopkeeper_id not in desired[shop_id]]
+        kept = {(shop_id, shopkeeper_id) for _, shop_id, shopkeeper_id in current}
+        added = [ShopAssignment(shop_id=shop_id, shopkeeper_id=shopkeeper_id)
+                 for shop_id, shopkeeper_ids in desired.items() for shopkeeper_id in sorted(shopkeeper_ids)
+                 if (shop_id, shopkeeper_id) not in kept]
+
+        if removed:
+            ShopAssignment.objects.filter(pk__in=[pk for pk, _, _ in removed]).delete()
+        try:
+            # Moves within the batch are safe: their old rows were deleted just above
+            ShopAssignment.objects.bulk_create(added)
+        except IntegrityError:
+            # Someone assigned one of these shopkeepers concurrently
+            raise AssignmentConflict('A shopkeeper was assigned to another shop concurrently')
+        assignments_changed({shop_id for _, shop_id, _ in removed} | {a.shop_id for a in added},
+                            {pk for _, _, pk in removed} | {a.shopkeeper_id for a in added})
+    return len(added), len(removed)
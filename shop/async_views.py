@@ -0,0 +1,166 @@
+"""Async-native variants of the read-heavy endpoints (products, shops, orders).
+
+They return the same payloads, pagination and ETag/Last-Modified validators as
+their counterparts in views.py, but authenticate, query and read the cache through
+Django's async APIs (aget, aiterator, aaggregate), so under an ASGI server the
+request is not handed to the sync thread pool as a whole. Django has no async
+database driver yet, so each query still runs in a worker thread.
+
+Both variants are routed side by side: /api/products/ and /api/async/products/
+serve identical responses. To compare them under load, run the project with an
+ASGI server (e.g. ``uvicorn ecommerce.asgi:application``) and point the benchmark
+command at it.
+"""
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .authentication import AsyncJWTAuthentication
+from .cache import detail_cache
+from .conditional import ConditionalGetMixin, object_validators
+from .filters import FilterMixin, IdsFilterBackend, ProductFilterBackend, ProductSearchBackend
+from .models import Shop, Product, Order
+from .pagination import KeysetPaginationMixin
+from .queryplan import optimize_queryset
+from .readers import get_reader
+from .renderers import FastJSONRenderer
+from .serializers import ShopSerializer, ProductSerializer, OrderSerializer, sparse_serializer_class
+
+
+class AsyncAPIView(View):
+    """The subset of APIView the read endpoints need: JWT authentication, DRF
+    exceptions and JSON rendering. Handlers may return a DRF Response."""
+
+    http_method_names = ['get', 'head', 'options']
+    authentication = AsyncJWTAuthentication()
+    renderer = FastJSONRenderer()
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.request = Request(request)
+        try:
+            user_auth = await self.authentication.aauthenticate(self.request)
+            if user_auth is None:
+                raise NotAuthenticated()
+            self.request.user = user_auth[0]
+            response = await super().dispatch(self.request, *args, **kwargs)
+        except APIException as exc:
+            response = self.handle_exception(exc)
+        if isinstance(response, Response):
+            response = self.render(response.data, response.status_code)
+        return self.finalize_response(self.request, response, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        response = self.render(data, exc.status_code)
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            response['WWW-Authenticate'] = self.authentication.authenticate_header(self.request)
+        return response
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(self.renderer.render(data), status=status_code, content_type=self.renderer.media_type)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        return response
+
+
+class AsyncShopListView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, AsyncAPIView):
+
+    async def get(self, request):
+        serializer_class = sparse_serializer_class(ShopSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Shop.objects.all()), serializer_class)
+        not_modified = await self.aconditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        shops = await self.apaginate_queryset(queryset)
+        serializer = serializer_class(shops, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class AsyncShopDetailView(ConditionalGetMixin, AsyncAPIView):
+
+    async def get(self, request, pk):
+        serializer_class = sparse_serializer_class(ShopSerializer, request)
+        if serializer_class is ShopSerializer:
+            payload = await detail_cache.aget_or_build(Shop, pk, lambda: self.build_payload(pk))
+        else:
+            payload = await self.build_payload(pk, serializer_class)
+        if payload is None:
+            return Response({"error": "Shop not found"}, status=status.HTTP_404_NOT_FOUND)
+        not_modified = self.conditional_response(payload['etag'], payload['last_modified'])
+        if not_modified:
+            return not_modified
+        return Response(payload['data'])
+
+    async def build_payload(self, pk, serializer_class=ShopSerializer):
+        try:
+            shop = await optimize_queryset(Shop.objects.all(), serializer_class).aget(pk=pk)
+        except Shop.DoesNotExist:
+            return None
+        etag, last_modified = object_validators(shop, serializer_class)
+        return {'data': serializer_class(shop).data, 'etag': etag, 'last_modified': last_modified}
+
+
+class AsyncProductListView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, AsyncAPIView):
+    filter_backends = (IdsFilterBackend, ProductFilterBackend, ProductSearchBackend)
+    ordering_fields = ('id', 'name', 'price', 'stock_quantity')
+
+    async def get(self, request):
+        serializer_class = sparse_serializer_class(ProductSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Product.objects.all()), serializer_class)
+        not_modified = await self.aconditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(await self.apaginate_values(queryset, get_reader(serializer_class)))
+
+
+class AsyncProductDetailView(ConditionalGetMixin, AsyncAPIView):
+
+    async def get(self, request, pk):
+        serializer_class = sparse_serializer_class(ProductSerializer, request)
+        if serializer_class is ProductSerializer:
+            payload = await detail_cache.aget_or_build(Product, pk, lambda: self.build_payload(pk))
+        else:
+            payload = await self.build_payload(pk, serializer_class)
+        if payload is None:
+            return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+        not_modified = self.conditional_response(payload['etag'], payload['last_modified'])
+        if not_modified:
+            return not_modified
+        return Response(payload['data'])
+
+    async def build_payload(self, pk, serializer_class=ProductSerializer):
+        try:
+            product = await optimize_queryset(Product.objects.all(), serializer_class).aget(pk=pk)
+        except Product.DoesNotExist:
+            return None
+        etag, last_modified = object_validators(product, serializer_class)
+        return {'data': serializer_class(product).data, 'etag': etag, 'last_modified': last_modified}
+
+
+class AsyncOrderListView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, AsyncAPIView):
+
+    async def get(self, request):
+        serializer_class = sparse_serializer_class(OrderSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Order.objects.all()), serializer_class)
+        not_modified = await self.aconditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(await self.apaginate_values(queryset, get_reader(serializer_class)))
+
+
+class AsyncOrderDetailView(ConditionalGetMixin, AsyncAPIView):
+
+    async def get(self, request, pk):
+        serializer_class = sparse_serializer_class(OrderSerializer, request)
+        try:
+            order = await optimize_queryset(Order.objects.all(), serializer_class).aget(pk=pk)
+        except Order.DoesNotExist:
+            return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
+        not_modified = self.conditional_object(order, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(order)
+        return Response(serializer.data)
@@ -0,0 +1,213 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core import checks
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Claims embedded at token issue time. STAMP_CLAIM ties them to the user's current
+# revocation stamp; tokens without it (issued before these claims existed) are never trusted.
+STAMP_CLAIM = 'claims_stamp'
+CLAIMS = ('role', 'is_staff', 'shopkeeper_id', 'customer_id', 'shop_id')
+
+
+def get_user_claims(user):
+    # One query; run when a token is issued or when a request cannot trust its token
+    ids = get_user_model().objects.filter(pk=user.pk).values(
+        'shopkeeper__id', 'shopkeeper__shopassignment__shop_id', 'customer__id').first() or {}
+    return {
+        'role': user.role,
+        'is_staff': user.is_staff,
+        'shopkeeper_id': ids.get('shopkeeper__id'),
+        'customer_id': ids.get('customer__id'),
+        'shop_id': ids.get('shopkeeper__shopassignment__shop_id'),
+    }
+
+
+class RevocationCache:
+    """Per-user stamps that invalidate the claims of every token issued before them.
+
+    A token records the user's stamp when it is issued and is trusted only while the stamp
+    is unchanged. Revoking a user (deactivation, deletion, password or role change, new
+    shop assignment) sets a fresh stamp, so older tokens fall back to a database check until
+    they expire; the stamp only has to outlive the access token lifetime. A missing stamp
+    (evicted, expired, another process's cache) trusts nothing. Revocations are as wide as
+    the cache, so a process-local one is refused unless `allow_process_local` says there is
+    a single process.
+    """
+
+    def __init__(self, alias='default', key_prefix='shop:claims', allow_process_local=False):
+        self.alias = alias
+        self.key_prefix = key_prefix
+        self.allow_process_local = allow_process_local
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return self.allow_process_local or not isinstance(self.backend, LocMemCache)
+
+    @property
+    def timeout(self):
+        leeway = api_settings.LEEWAY
+        if isinstance(leeway, timedelta):
+            leeway = leeway.total_seconds()
+        return api_settings.ACCESS_TOKEN_LIFETIME.total_seconds() + leeway + 60
+
+    def make_key(self, user_id):
+        return '%s:%s' % (self.key_prefix, user_id)
+
+    def stamp(self, user_id):
+        return self.backend.get(self.make_key(user_id), '')
+
+    async def astamp(self, user_id):
+        return await self.backend.aget(self.make_key(user_id), '')
+
+    def issue(self, user_id):
+        # The stamp a new token records: the live one, or a fresh one if there is none. Its
+        # lifetime is extended so it outlives this token too.
+        key = self.make_key(user_id)
+        self.backend.add(key, uuid.uuid4().hex, self.timeout)
+        stamp = self.backend.get(key, '')
+        self.backend.touch(key, self.timeout)
+        return stamp
+
+    def revoke(self, *user_ids):
+        if not user_ids:
+            return
+        self.backend.set_many({self.make_key(user_id): uuid.uuid4().hex for user_id in user_ids}, self.timeout)
+        # A token issued before the change commits would read the old claims; stamp again after it
+        transaction.on_commit(lambda: self.backend.set_many(
+            {self.make_key(user_id): uuid.uuid4().hex for user_id in user_ids}, self.timeout))
+
+
+_config = getattr(settings, 'SHOP_AUTH', {})
+revocations = RevocationCache(alias=_config.get('REVOCATION_CACHE', 'default'),
+                              allow_process_local=_config.get('ALLOW_PROCESS_LOCAL', False))
+
+
+def check_revocation_cache(app_configs, **kwargs):
+    # Registered in apps.py
+    if revocations.enabled:
+        return []
+    return [checks.Warning(
+        "SHOP_AUTH['REVOCATION_CACHE'] (%r) is a local-memory cache, so token claims are not trusted "
+        "and every request loads its user." % revocations.alias,
+        hint="Point it at a shared cache (set CACHE_URL), or set SHOP_AUTH['ALLOW_PROCESS_LOCAL'] "
+             "when the server runs a single process.",
+        id='shop.W001',
+    )]
+
+
+def add_claims(token, user):
+    token[STAMP_CLAIM] = revocations.issue(user.pk) if revocations.enabled else ''
+    token.payload.update(get_user_claims(user))
+    return token
+
+
+def user_claims(user):
+    """Role ids of an authenticated user: straight from a trusted token, otherwise looked up
+    once per request (untrusted tokens, session or force-authenticated users)."""
+    claims = getattr(user, 'claims', None)
+    if claims is None:
+        claims = user.claims = get_user_claims(user)
+    return claims
+
+
+class ClaimsRefreshToken(RefreshToken):
+    # Refreshing re-reads the claims, so a refreshed access token never carries stale ids
+    @property
+    def access_token(self):
+        access = super().access_token
+        access.set_iat()
+        user_model = get_user_model()
+        try:
+            user = user_model.objects.get(**{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]})
+        except (KeyError, user_model.DoesNotExist):
+            raise TokenError('User not found')
+        if not user.is_active:
+            raise TokenError('User is inactive')
+        return add_claims(access, user)
+
+
+class ShopTokenUser(TokenUser):
+    """A user rebuilt from trusted token claims, without touching the database."""
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def claims(self):
+        return {name: self.token.get(name) for name in CLAIMS}
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the claims a token was issued with.
+
+    A token carrying the user's current revocation stamp yields a ShopTokenUser: no user
+    query, and views read the shopkeeper/customer/shop ids from user_claims(). Any other
+    token is checked against the database as usual.
+    """
+
+    def trusts(self, validated_token, stamp):
+        # An empty stamp is never a match: it is what a missing server-side stamp reads as
+        return bool(stamp) and revocations.enabled and validated_token.get(STAMP_CLAIM) == stamp
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None and self.trusts(validated_token, revocations.stamp(user_id)):
+            return ShopTokenUser(validated_token)
+        return super().get_user(validated_token)
+
+
+class AsyncJWTAuthentication(ClaimsJWTAuthentication):
+    """ClaimsJWTAuthentication for async views: token checks are CPU only, and the user
+    lookup, when the claims cannot be trusted, goes through the async ORM."""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if self.trusts(validated_token, await revocations.astamp(user_id)):
+            return ShopTokenUser(validated_token)
+
+        try:
+            user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+
+        return user
@@ -0,0 +1,137 @@
+import io
+import logging
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+
+from .cache import detail_cache
+from .parsers import loads
+from .renderers import dumps
+
+# Request headers a sub-request never takes from the batch request: it is authenticated
+# once for the whole batch, and its body and conditional headers are its own
+OUTER_ONLY_HEADERS = ('HTTP_AUTHORIZATION', 'HTTP_COOKIE', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+                      'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE', 'HTTP_CONTENT_ENCODING')
+RESPONSE_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Retry-After')
+
+logger = logging.getLogger('shop.batch')
+
+
+def get_config():
+    config = {'MAX_REQUESTS': 50, 'PATH_PREFIX': '/api/'}
+    config.update(getattr(settings, 'SHOP_BATCH', {}))
+    return config
+
+
+def resolve_view(path):
+    """The resolver match for an API path a batch may call, or None: only synchronous DRF
+    views under PATH_PREFIX that have not opted out (streaming endpoints, the batch endpoint
+    itself)."""
+    if not path.startswith(get_config()['PATH_PREFIX']):
+        return None
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is None or not issubclass(view_class, APIView) or not getattr(view_class, 'batchable', True):
+        return None
+    return match
+
+
+def sub_request(request, method, path, query, body, headers):
+    # A plain WSGI request for the view to wrap, carrying the batch request's server
+    # details and its already authenticated user
+    content = b'' if body is None else dumps(body)
+    environ = {key: value for key, value in request.META.items()
+               if key not in OUTER_ONLY_HEADERS and key not in ('CONTENT_TYPE', 'CONTENT_LENGTH')}
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': query,
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': io.BytesIO(content),
+        'wsgi.url_scheme': request.scheme,
+    })
+    for name, value in headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key not in ('HTTP_AUTHORIZATION', 'HTTP_COOKIE'):
+            environ[key] = value
+    sub = WSGIRequest(environ)
+    sub.user = request.user
+    # Read by rest_framework.request.Request in place of running the authenticators again
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def response_body(response):
+    if hasattr(response, 'data'):
+        return response.data
+    if not response.content:
+        return None
+    try:
+        return loads(response.content)
+    except ValueError:
+        return response.content.decode(response.charset, 'replace')
+
+
+def discard(response):
+    # What HttpResponse.close() does, except sending request_finished: that would close this
+    # thread's database connections, and with them an atomic batch's transaction
+    for closer in response._resource_closers:
+        try:
+            closer()
+        except Exception:
+            pass
+    response._resource_closers.clear()
+    response.closed = True
+
+
+def run(item, request):
+    match = item['match']
+    sub = sub_request(request, item['method'], item['path'], item['query'], item.get('body'),
+                      item.get('headers', {}))
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+    except Exception:
+        # Reported for this request alone, so the caller still learns what the others did
+        logger.exception('Batch request %s %s failed', item['method'], item['path'])
+        return {'status': 500, 'headers': {}, 'body': {'error': 'Internal server error'}}
+    if response.streaming:
+        # Never read into memory: discarded unread, which also releases a FileResponse's file
+        discard(response)
+        return {'status': 400, 'headers': {}, 'body': {'error': 'Streaming responses cannot be returned in a batch'}}
+    return {
+        'status': response.status_code,
+        'headers': {name: response[name] for name in RESPONSE_HEADERS if name in response},
+        'body': response_body(response),
+    }
+
+
+def execute(request, items, atomic=False):
+    """Runs validated sub-requests in order and returns one {status, headers, body} each; a
+    sub-request that raises is answered with a 500 of its own.
+
+    With `atomic` they share one transaction: the first response with an error status
+    rolls every earlier write back and the rest are not run (status 424). Atomic batches
+    also read around the detail cache, whose entries would outlive a rollback.
+    """
+    results = []
+    with transaction.atomic() if atomic else nullcontext(), detail_cache.bypass() if atomic else nullcontext():
+        for item in items:
+            results.append(run(item, request))
+            if atomic and results[-1]['status'] >= 400:
+                transaction.set_rollback(True)
+                break
+    for item in items[len(results):]:
+        results.append({'status': 424, 'headers': {},
+                        'body': {'error': 'Not run: an earlier request in this atomic batch failed'}})
+    return results
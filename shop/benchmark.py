@@ -0,0 +1,576 @@
+import http.client
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .models import User, Shop, Shopkeeper, Customer, Product, Review, Order, OrderItem, ShopAssignment, Job
+from .parsers import FastJSONParser
+from .queryplan import optimize_queryset
+from .readers import order_item_reader, product_reader
+from .renderers import FastJSONRenderer
+from .seeding import SEED_PASSWORD
+from .serializers import ClaimsTokenObtainPairSerializer
+
+# How many ids of each model the detail scenarios pick from
+SAMPLE_SIZE = 1000
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Fixtures:
+    """Ids, tokens and credentials the scenarios draw from, read from a seeded database."""
+
+    def __init__(self, password=SEED_PASSWORD):
+        def sample(model, **filters):
+            return list(model.objects.filter(**filters).order_by('pk').values_list('pk', flat=True)[:SAMPLE_SIZE])
+
+        self.ids = {model: sample(model) for model in (User, Shop, Shopkeeper, Customer, Product, Review, Order,
+                                                       OrderItem)}
+        if not self.ids[Product] or not self.ids[Customer]:
+            raise ValueError('The database has no products or customers; seed it first.')
+
+        customer = Customer.objects.select_related('user').order_by('pk').first()
+        # A shopkeeper who works at a shop that has products
+        assignment = (ShopAssignment.objects.select_related('shopkeeper__user')
+                      .filter(shop__product__isnull=False).order_by('pk').first())
+        self.customer_user = customer.user
+        self.shopkeeper_user = assignment.shopkeeper.user
+        self.shopkeeper_shop_id = assignment.shop_id
+        self.password = password
+        # Issued like /login/ issues them, so requests take the trusted-claims path
+        refresh = ClaimsTokenObtainPairSerializer.get_token(self.customer_user)
+        self.tokens = {
+            'customer': str(refresh.access_token),
+            'shopkeeper': str(ClaimsTokenObtainPairSerializer.get_token(self.shopkeeper_user).access_token),
+        }
+        self.refresh_token = str(refresh)
+        self.search_term = Product.objects.order_by('pk').values_list('name', flat=True).first().split()[0]
+
+    def pick(self, model, rng):
+        return rng.choice(self.ids[model])
+
+
+class Scenario:
+    """One request shape. `path` and `body` are called with (fixtures, rng, i) for every request."""
+
+    def __init__(self, name, url_name, path=None, method='GET', body=None, role='customer', expect=(200,),
+                 content_type='application/json', max_requests=None):
+        self.name = name
+        self.url_name = url_name
+        self.path = path or (lambda fixtures, rng, i: reverse(url_name))
+        self.method = method
+        self.body = body
+        self.role = role
+        self.expect = expect
+        self.content_type = content_type
+        self.max_requests = max_requests
+
+    def setup(self, fixtures):
+        pass
+
+    def check(self, fixtures, result):
+        # Invariants the scenario must leave intact; returns a list of violations
+        return []
+
+    def encode(self, fixtures, rng, i):
+        if self.body is None:
+            return None
+        body = self.body(fixtures, rng, i)
+        if isinstance(body, bytes):
+            return body
+        return json.dumps(body).encode('utf-8')
+
+
+def detail(url_name, model):
+    return lambda fixtures, rng, i: reverse(url_name, args=[fixtures.pick(model, rng)])
+
+
+def listing(url_name, query):
+    return lambda fixtures, rng, i: reverse(url_name) + query
+
+
+class CheckoutScenario(Scenario):
+    """Many customers buying the same few products at once. Stock is set low enough that
+    some checkouts must be refused, and afterwards every unit sold has to be accounted for:
+    no oversells and no lost updates."""
+
+    hot_products = 5
+    initial_stock = 50
+
+    def __init__(self):
+        super().__init__('checkout', 'checkout', method='POST', body=self.make_body, expect=(201, 409))
+
+    def setup(self, fixtures):
+        self.product_ids = list(Product.objects.filter(shop_id=fixtures.shopkeeper_shop_id)
+                                .order_by('pk').values_list('pk', flat=True)[:self.hot_products])
+        Product.objects.filter(pk__in=self.product_ids).update(stock_quantity=self.initial_stock)
+        self.last_item_id = OrderItem.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        self.last_order_id = Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def make_body(self, fixtures, rng, i):
+        items = [{'product': product_id, 'quantity': rng.randint(1, 3)}
+                 for product_id in rng.sample(self.product_ids, rng.randint(1, len(self.product_ids)))]
+        return {'shop': fixtures.shopkeeper_shop_id, 'items': items}
+
+    def check(self, fixtures, result):
+        violations = []
+        sold = dict(OrderItem.objects.filter(pk__gt=self.last_item_id, product_id__in=self.product_ids)
+                    .values_list('product_id').annotate(Sum('quantity')))
+        for product_id, stock in Product.objects.filter(pk__in=self.product_ids).values_list('pk', 'stock_quantity'):
+            if stock < 0:
+                violations.append('product %s oversold: stock %s' % (product_id, stock))
+            if self.initial_stock - stock != sold.get(product_id, 0):
+                violations.append('product %s lost an update: %s units left, %s sold of %s'
+                                  % (product_id, stock, sold.get(product_id, 0), self.initial_stock))
+        orders = Order.objects.filter(pk__gt=self.last_order_id).count()
+        if orders != result['status_codes'].get('201', 0):
+            violations.append('%s orders created for %s successful checkouts'
+                              % (orders, result['status_codes'].get('201', 0)))
+        return violations
+
+
+class BulkDeleteScenario(Scenario):
+    """Bulk deletes of products made for the purpose. The request only queues a job, so
+    each accepted request must have left exactly one job behind."""
+
+    batch = 10
+
+    def __init__(self):
+        super().__init__('bulk product delete', 'bulk-product-create-delete', method='DELETE', role='shopkeeper',
+                         expect=(202,), max_requests=50, body=self.make_body)
+
+    def setup(self, fixtures):
+        shopkeeper_id = Shopkeeper.objects.filter(user=fixtures.shopkeeper_user).values_list('pk', flat=True).get()
+        products = Product.objects.bulk_create([
+            Product(name='Doomed %d' % n, description='Benchmark delete', price='1.00', stock_quantity=1,
+                    shop_id=fixtures.shopkeeper_shop_id, added_by_id=shopkeeper_id)
+            for n in range(self.batch * (self.max_requests or 50))
+        ])
+        self.product_ids = [product.pk for product in products]
+        self.last_job_id = Job.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def make_body(self, fixtures, rng, i):
+        start = i * self.batch % len(self.product_ids)
+        return {'ids': self.product_ids[start:start + self.batch]}
+
+    def check(self, fixtures, result):
+        jobs = Job.objects.filter(pk__gt=self.last_job_id, name='products.bulk_delete').count()
+        accepted = result['status_codes'].get('202', 0)
+        if jobs != accepted:
+            return ['%s jobs queued for %s accepted deletes' % (jobs, accepted)]
+        return []
+
+
+class ReassignScenario(Scenario):
+    """Batch reassignments that move shopkeepers between pairs of shops made for the
+    purpose. Afterwards every shopkeeper must work at one shop at most."""
+
+    groups = 20
+    shopkeepers_per_group = 4
+
+    def __init__(self):
+        super().__init__('shop reassign batch', 'shop-assignments', method='POST', body=self.make_body,
+                         expect=(200, 409))
+
+    def setup(self, fixtures):
+        count = self.groups * self.shopkeepers_per_group
+        users = User.objects.bulk_create([
+            User(email='reassign-%s-%d@example.com' % (uuid.uuid4().hex[:8], n), name='Reassign',
+                 role=User.SHOPKEEPER, password='!') for n in range(count)
+        ])
+        shopkeepers = Shopkeeper.objects.bulk_create([
+            Shopkeeper(user=user, TIN='tin', NID='nid', approval_status='approved') for user in users
+        ])
+        shops = Shop.objects.bulk_create([
+            Shop(name='Reassign %d' % n, address='Benchmark', status='active') for n in range(self.groups * 2)
+        ])
+        size = self.shopkeepers_per_group
+        self.pairs = [(shops[2 * g].pk, shops[2 * g + 1].pk, [sk.pk for sk in shopkeepers[g * size:(g + 1) * size]])
+                      for g in range(self.groups)]
+        self.shopkeeper_ids = [shopkeeper.pk for shopkeeper in shopkeepers]
+
+    def make_body(self, fixtures, rng, i):
+        # Each request re-deals one pair's shopkeepers and another pair's
+        body = []
+        for first, second, shopkeeper_ids in rng.sample(self.pairs, 2):
+            dealt = rng.sample(shopkeeper_ids, rng.randint(0, len(shopkeeper_ids)))
+            body.append({'shop': first, 'shopkeeper_ids': dealt})
+            body.append({'shop': second, 'shopkeeper_ids': [pk for pk in shopkeeper_ids if pk not in dealt]})
+        return {'shops': body}
+
+    def check(self, fixtures, result):
+        counts = (ShopAssignment.objects.filter(shopkeeper_id__in=self.shopkeeper_ids)
+                  .values('shopkeeper_id').annotate(shops=Count('shop_id')).filter(shops__gt=1))
+        return ['shopkeeper %s assigned to %s shops' % (row['shopkeeper_id'], row['shops']) for row in counts]
+
+
+class JobStatusScenario(Scenario):
+    """Clients polling finished jobs of their own."""
+
+    jobs = 100
+
+    def __init__(self):
+        super().__init__('job status', 'job-detail', path=self.make_path)
+
+    def setup(self, fixtures):
+        jobs = Job.objects.bulk_create([
+            Job(name='ratings.rebuild', status=Job.SUCCEEDED, attempts=1, result={'updated': 0},
+                run_at=timezone.now(), finished_at=timezone.now(), created_by=fixtures.customer_user)
+            for _ in range(self.jobs)
+        ])
+        self.job_ids = [job.pk for job in jobs]
+
+    def make_path(self, fixtures, rng, i):
+        return reverse('job-detail', args=[rng.choice(self.job_ids)])
+
+
+def import_body(fixtures, rng, i):
+    rows = [{'name': 'Imported %d-%d' % (i, n), 'description': 'Benchmark import', 'price': '4.99',
+             'stock_quantity': 10, 'shop': fixtures.shopkeeper_shop_id} for n in range(20)]
+    return '\n'.join(json.dumps(row) for row in rows).encode('utf-8')
+
+
+def multi_get(url_name, model, count=10):
+    return lambda fixtures, rng, i: '%s?ids=%s' % (
+        reverse(url_name), ','.join(str(pk) for pk in rng.sample(fixtures.ids[model], count)))
+
+
+def batch_body(fixtures, rng, i):
+    # What a product page fetches: the product, its shop and reviews, and related products
+    product = fixtures.pick(Product, rng)
+    paths = [reverse('product-detail', args=[product]), reverse('shop-detail', args=[fixtures.pick(Shop, rng)]),
+             reverse('product-review-list', args=[product]) + '?page_size=10']
+    paths += [reverse('product-detail', args=[fixtures.pick(Product, rng)]) for _ in range(7)]
+    return {'requests': [{'path': path} for path in paths]}
+
+
+def get_scenarios():
+    run = uuid.uuid4().hex[:8]
+    return [
+        # Authentication
+        Scenario('login', 'token_obtain_pair', method='POST', role=None,
+                 body=lambda f, rng, i: {'email': f.customer_user.email, 'password': f.password}),
+        Scenario('login refresh', 'token_refresh', method='POST', role=None,
+                 body=lambda f, rng, i: {'refresh': f.refresh_token}),
+        Scenario('register', 'sign_up', method='POST', role=None, expect=(201,),
+                 body=lambda f, rng, i: {'email': 'bench-%s-%d@example.com' % (run, i), 'name': 'Bench',
+                                         'password': 'bench-password', 'role': User.CUSTOMER}),
+
+        # Lists and details
+        Scenario('users list', 'user-list-create'),
+        Scenario('user detail', 'user-detail', detail('user-detail', User)),
+        Scenario('shops list', 'shop-list-create'),
+        Scenario('shop detail', 'shop-detail', detail('shop-detail', Shop)),
+        Scenario('shopkeepers list', 'shopkeeper-list-create'),
+        Scenario('shopkeeper detail', 'shopkeeper-detail', detail('shopkeeper-detail', Shopkeeper)),
+        Scenario('customers list', 'customer-list-create'),
+        Scenario('customer detail', 'customer-detail', detail('customer-detail', Customer)),
+        Scenario('products list', 'product-list-create'),
+        Scenario('products by price', 'product-list-create', listing('product-list-create', '?ordering=-price')),
+        Scenario('products filtered', 'product-list-create',
+                 listing('product-list-create', '?in_stock=true&min_price=10&max_price=200')),
+        Scenario('products search', 'product-list-create',
+                 lambda f, rng, i: reverse('product-list-create') + '?q=' + f.search_term),
+        Scenario('product detail', 'product-detail', detail('product-detail', Product)),
+        Scenario('products multi-get', 'product-list-create', multi_get('product-list-create', Product)),
+        Scenario('product page batch', 'batch', method='POST', body=batch_body),
+        Scenario('product reviews', 'product-review-list', detail('product-review-list', Product)),
+        Scenario('reviews list', 'review-list-create'),
+        Scenario('review detail', 'review-detail', detail('review-detail', Review)),
+        Scenario('orders list', 'order-list-create'),
+        Scenario('order detail', 'order-detail', detail('order-detail', Order)),
+        Scenario('order items list', 'orderitem-list-create'),
+        Scenario('order item detail', 'orderitem-detail', detail('orderitem-detail', OrderItem)),
+        Scenario('order items sparse', 'orderitem-list-create',
+                 listing('orderitem-list-create', '?fields=id,quantity,price')),
+        Scenario('order items shallow', 'orderitem-list-create', listing('orderitem-list-create', '?expand=')),
+
+        # Async variants of the same reads
+        Scenario('async shops list', 'async-shop-list'),
+        Scenario('async shop detail', 'async-shop-detail', detail('async-shop-detail', Shop)),
+        Scenario('async products list', 'async-product-list'),
+        Scenario('async product detail', 'async-product-detail', detail('async-product-detail', Product)),
+        Scenario('async orders list', 'async-order-list'),
+        Scenario('async order detail', 'async-order-detail', detail('async-order-detail', Order)),
+
+        # Full-table exports stream every row, so they get far fewer requests
+        Scenario('products export', 'product-export', max_requests=10),
+        Scenario('orders export', 'order-export', listing('order-export', '?output=csv'), max_requests=10),
+        Scenario('order items export', 'orderitem-export', max_requests=10),
+
+        # Writes
+        Scenario('review create', 'review-list-create', method='POST', expect=(201,),
+                 body=lambda f, rng, i: {'rating': rng.randint(1, 5), 'comment': 'Benchmark',
+                                         'product': f.pick(Product, rng)}),
+        ReassignScenario(),
+        Scenario('product create', 'product-list-create', method='POST', role='shopkeeper', expect=(201,),
+                 body=lambda f, rng, i: {'name': 'Bench %s-%d' % (run, i), 'description': 'Benchmark',
+                                         'price': '9.99', 'stock_quantity': 5, 'shop': f.shopkeeper_shop_id}),
+        Scenario('bulk product create', 'bulk-product-create-delete', method='POST', role='shopkeeper',
+                 expect=(201,), max_requests=50,
+                 body=lambda f, rng, i: [{'name': 'Bulk %s-%d-%d' % (run, i, n), 'description': 'Benchmark',
+                                          'price': '1.99', 'stock_quantity': 1, 'shop': f.shopkeeper_shop_id}
+                                         for n in range(50)]),
+        BulkDeleteScenario(),
+        Scenario('product import', 'product-import', method='POST', role='shopkeeper', max_requests=50,
+                 body=import_body, content_type='application/x-ndjson'),
+        CheckoutScenario(),
+
+        # Background jobs
+        JobStatusScenario(),
+    ]
+
+
+class LocalTransport:
+    """Requests through Django's test client in this process; counts the queries each one runs."""
+
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body, headers):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        extra = {'HTTP_%s' % name.upper().replace('-', '_'): value for name, value in headers.items()
+                 if name != 'Content-Type'}
+        with connection.execute_wrapper(count):
+            response = self.client.generic(method, path, body or b'',
+                                           content_type=headers.get('Content-Type'), **extra)
+            if response.streaming:
+                try:
+                    b''.join(response.streaming_content)
+                except Exception:
+                    # The status line went out already; a server would just cut the body short
+                    return 0, queries[0]
+        return response.status_code, queries[0]
+
+    def close(self):
+        # Client threads own their connection; the main thread's may be inside a transaction
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+class HTTPTransport:
+    """Keep-alive HTTP/1.1 connection to a running server (query counts are not visible from here)."""
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=60)
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, method, path, body, headers):
+        self.connection.request(method, self.prefix + path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status, None
+
+    def close(self):
+        self.connection.close()
+
+
+class Runner:
+    """Drives each scenario with `concurrency` client threads and summarizes the latencies."""
+
+    def __init__(self, fixtures, concurrency=8, requests=200, base_url=None, seed=0):
+        self.fixtures = fixtures
+        self.concurrency = concurrency
+        self.requests = requests
+        self.base_url = base_url
+        self.seed = seed
+
+    def make_transport(self):
+        if self.base_url:
+            return HTTPTransport(self.base_url)
+        return LocalTransport()
+
+    def run(self, scenario):
+        scenario.setup(self.fixtures)
+        total = min(self.requests, scenario.max_requests or self.requests)
+        headers = {'Content-Type': scenario.content_type}
+        if scenario.role:
+            headers['Authorization'] = 'Bearer %s' % self.fixtures.tokens[scenario.role]
+
+        samples = []
+        lock = threading.Lock()
+        counter = iter(range(total))
+
+        def worker(number):
+            rng = random.Random('%s:%s:%s' % (self.seed, scenario.name, number))
+            transport = self.make_transport()
+            own = []
+            try:
+                while True:
+                    with lock:
+                        i = next(counter, None)
+                    if i is None:
+                        break
+                    path = scenario.path(self.fixtures, rng, i)
+                    body = scenario.encode(self.fixtures, rng, i)
+                    started = time.perf_counter()
+                    try:
+                        status_code, queries = transport.request(scenario.method, path, body, headers)
+                    except (OSError, http.client.HTTPException):
+                        status_code, queries = 0, None
+                        transport.close()
+                        transport = self.make_transport()
+                    own.append((time.perf_counter() - started, status_code, queries))
+            finally:
+                transport.close()
+            with lock:
+                samples.extend(own)
+
+        started = time.perf_counter()
+        if self.concurrency == 1 and not self.base_url:
+            # Inline, on this thread's connection (needed inside test transactions)
+            worker(0)
+        else:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(min(self.concurrency, total))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = self.summarize(scenario, samples, elapsed)
+        result['violations'] = scenario.check(self.fixtures, result)
+        return result
+
+    def summarize(self, scenario, samples, elapsed):
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        statuses = Counter(str(sample[1]) for sample in samples)
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+        errors = sum(count for code, count in statuses.items() if int(code) not in scenario.expect)
+
+        def ms(value):
+            return round(value, 3) if value is not None else None
+
+        return {
+            'method': scenario.method,
+            'url_name': scenario.url_name,
+            'requests': len(samples),
+            'errors': errors,
+            'status_codes': dict(sorted(statuses.items())),
+            'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+                'p50': ms(percentile(latencies, 0.50)),
+                'p95': ms(percentile(latencies, 0.95)),
+                'p99': ms(percentile(latencies, 0.99)),
+                'max': ms(latencies[-1]) if latencies else None,
+            },
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Regressions of `results` against an earlier run: p95 latency up or throughput down by
+    more than `tolerance`, or any growth in queries per request (which is deterministic)."""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        p95, previous_p95 = current['latency_ms']['p95'], previous['latency_ms']['p95']
+        if p95 is not None and previous_p95 and p95 > previous_p95 * (1 + tolerance):
+            regressions.append('%s: p95 %.1fms -> %.1fms' % (name, previous_p95, p95))
+        if current['rps'] is not None and previous['rps'] and current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append('%s: %.1f -> %.1f requests/s' % (name, previous['rps'], current['rps']))
+        queries, previous_queries = current['queries_per_request'], previous.get('queries_per_request')
+        if queries is not None and previous_queries is not None and queries > previous_queries + 0.01:
+            regressions.append('%s: %.2f -> %.2f queries/request' % (name, previous_queries, queries))
+    return regressions
+
+
+def best_of(func, repeat):
+    # Shortest of `repeat` timed calls, in seconds
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def time_serializers(readers, rows=1000, repeat=5):
+    """Serialization cost per row of each reader's ModelSerializer against the reader, on the
+    first `rows` rows of its model (best of `repeat` runs; fetching is not timed), and
+    whether the two render byte-identical JSON."""
+    renderer = JSONRenderer()
+    results = {}
+    for reader in readers:
+        serializer_class = reader.serializer_class
+        queryset = reader.model.objects.order_by('id')[:rows]
+        instances = list(optimize_queryset(queryset, serializer_class))
+        values = list(reader.queryset(queryset))
+        if not instances:
+            continue
+
+        serializer_us = best_of(lambda: serializer_class(instances, many=True).data, repeat) / len(instances) * 1e6
+        reader_us = best_of(lambda: reader.serialize(values), repeat) / len(instances) * 1e6
+        results[serializer_class.__name__] = {
+            'rows': len(instances),
+            'serializer_us_per_row': round(serializer_us, 2),
+            'reader_us_per_row': round(reader_us, 2),
+            'speedup': round(serializer_us / reader_us, 1),
+            'identical': (renderer.render(serializer_class(instances, many=True).data)
+                          == renderer.render(reader.serialize(values))),
+        }
+    return results
+
+
+def time_renderers(rows=500, repeat=20):
+    """Encoding and decoding time of JSONRenderer/JSONParser against the shop's renderer and
+    parser on realistic payloads: list pages as the API returns them, and raw values() rows
+    with Decimal and datetime values. Also reports whether both render the same bytes."""
+    payloads = {
+        'product page': {'next': None, 'previous': None, 'results': product_reader.serialize(
+            product_reader.queryset(Product.objects.order_by('id')[:rows]))},
+        'order item page': {'next': None, 'previous': None, 'results': order_item_reader.serialize(
+            order_item_reader.queryset(OrderItem.objects.order_by('id')[:rows]))},
+        'order rows': list(Order.objects.order_by('id').values()[:rows]),
+    }
+    results = {}
+    for name, payload in payloads.items():
+        standard, fast = JSONRenderer().render(payload), FastJSONRenderer().render(payload)
+        render_ms = best_of(lambda: JSONRenderer().render(payload), repeat) * 1000
+        fast_render_ms = best_of(lambda: FastJSONRenderer().render(payload), repeat) * 1000
+        parse_ms = best_of(lambda: JSONParser().parse(io.BytesIO(standard)), repeat) * 1000
+        fast_parse_ms = best_of(lambda: FastJSONParser().parse(io.BytesIO(standard)), repeat) * 1000
+        results[name] = {
+            'bytes': len(standard),
+            'render_ms': round(render_ms, 3),
+            'fast_render_ms': round(fast_render_ms, 3),
+            'render_speedup': round(render_ms / fast_render_ms, 1),
+            'parse_ms': round(parse_ms, 3),
+            'fast_parse_ms': round(fast_parse_ms, 3),
+            'parse_speedup': round(parse_ms / fast_parse_ms, 1),
+            'identical': standard == fast,
+        }
+    return results
@@ -0,0 +1,204 @@
+import csv
+import gzip
+import json
+import zlib
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Shop, Product
+from .parsers import loads
+
+
+class ProductRowSerializer(serializers.ModelSerializer):
+    # Shops are resolved once per batch instead of one lookup per row
+    shop = serializers.IntegerField()
+
+    class Meta:
+        model = Product
+        fields = ['name', 'description', 'price', 'stock_quantity', 'shop']
+
+
+# Uploads are read this many (decompressed) bytes at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def get_config():
+    config = {'MAX_LINE_BYTES': 1024 * 1024, 'MAX_UPLOAD_BYTES': 256 * 1024 * 1024}
+    config.update(getattr(settings, 'SHOP_IMPORT', {}))
+    return config
+
+
+class UploadTooLarge(Exception):
+    # A line, or the whole upload once decompressed, is over the SHOP_IMPORT limits
+    pass
+
+
+# What reading an upload can raise once it is under way: a corrupt or truncated gzip stream,
+# CSV the csv module cannot tokenize, or a limit reached. Rows parsed so far stay imported.
+UPLOAD_ERRORS = (OSError, EOFError, zlib.error, csv.Error, UploadTooLarge)
+
+
+class InvalidRow:
+    # Stands in for a record that could not be parsed so it is reported like any other bad row
+    def __init__(self, message):
+        self.message = message
+
+
+def iter_ndjson(lines):
+    # `lines` are bytes, decoded one at a time so a bad one is just a bad row
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield loads(line.decode('utf-8'))
+        except UnicodeDecodeError:
+            yield InvalidRow('Invalid UTF-8')
+        except ValueError as exc:
+            yield InvalidRow('Invalid JSON: %s' % exc)
+
+
+def _invalid_utf8(record):
+    # Undecodable bytes survive as lone surrogates (see iter_upload)
+    for value in record.values():
+        if isinstance(value, str):
+            try:
+                value.encode('utf-8')
+            except UnicodeEncodeError:
+                return True
+    return False
+
+
+def iter_csv(lines):
+    # csv.reader pulls extra lines itself when a quoted field spans several of them
+    for record in csv.DictReader(line.decode('utf-8', 'surrogateescape') for line in lines):
+        if None in record:
+            yield InvalidRow('Too many columns')
+        elif _invalid_utf8(record):
+            yield InvalidRow('Invalid UTF-8')
+        else:
+            yield record
+
+
+def iter_lines(stream, max_line_bytes, max_upload_bytes):
+    # Lines (newline kept) from fixed-size reads, so no line, however long, is read whole
+    # and a small gzip bomb is cut off after max_upload_bytes of output
+    pending = b''
+    total = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_upload_bytes:
+            raise UploadTooLarge('Upload is larger than %d bytes' % max_upload_bytes)
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if len(line) > max_line_bytes:
+                raise UploadTooLarge('A line is longer than %d bytes' % max_line_bytes)
+            yield line + b'\n'
+        if len(pending) > max_line_bytes:
+            raise UploadTooLarge('A line is longer than %d bytes' % max_line_bytes)
+    if pending:
+        yield pending
+
+
+def iter_upload(stream, content_type, content_encoding=''):
+    """Parse an NDJSON or CSV upload lazily, one record at a time. Reading it may raise
+    one of UPLOAD_ERRORS."""
+    if 'gzip' in content_encoding or content_type in ('application/gzip', 'application/x-gzip'):
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    config = get_config()
+    lines = iter_lines(stream, config['MAX_LINE_BYTES'], config['MAX_UPLOAD_BYTES'])
+    if content_type in ('text/csv', 'application/csv'):
+        return iter_csv(lines)
+    return iter_ndjson(lines)
+
+
+class ProductImporter:
+    """Validate product rows in batches and insert the valid ones with bulk_create.
+
+    Invalid rows are reported by their position in the input and never abort the
+    rest of the import. Each batch commits on its own unless the caller wraps the
+    whole run in a transaction.
+    """
+    batch_size = 1000
+
+    def __init__(self, shopkeeper_id, batch_size=None):
+        self.shopkeeper_id = shopkeeper_id
+        if batch_size is not None:
+            self.batch_size = batch_size
+        # A single serializer instance is reused for every row so its fields are built once
+        self.row_serializer = ProductRowSerializer()
+
+    def validate_batch(self, start, rows):
+        valid, errors = [], []
+        for index, row in enumerate(rows, start):
+            if isinstance(row, InvalidRow):
+                errors.append({'row': index, 'errors': {'non_field_errors': [row.message]}})
+                continue
+            try:
+                valid.append((index, self.row_serializer.run_validation(row)))
+            except serializers.ValidationError as exc:
+                errors.append({'row': index, 'errors': exc.detail})
+
+        shop_ids = {data['shop'] for _, data in valid}
+        existing = set(Shop.objects.filter(id__in=shop_ids).values_list('id', flat=True))
+        products = []
+        for index, data in valid:
+            if data['shop'] not in existing:
+                errors.append({'row': index,
+                               'errors': {'shop': ['Invalid pk "%s" - object does not exist.' % data['shop']]}})
+                continue
+            shop_id = data.pop('shop')
+            products.append(Product(shop_id=shop_id, added_by_id=self.shopkeeper_id, **data))
+        errors.sort(key=lambda error: error['row'])
+        return products, errors
+
+    def import_batch(self, start, rows):
+        products, errors = self.validate_batch(start, rows)
+        # Commits per batch when run on its own, joins the caller's transaction otherwise
+        with transaction.atomic(savepoint=False):
+            Product.objects.bulk_create(products, batch_size=self.batch_size)
+        return len(products), errors
+
+    def batches(self, rows):
+        # Yields (processed, created, errors) for each batch, consuming `rows` lazily
+        rows = iter(rows)
+        processed = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            created, errors = self.import_batch(processed, batch)
+            processed += len(batch)
+            yield processed, created, errors
+
+    def progress(self, rows):
+        # Streams one NDJSON progress line per batch; only counters are kept between batches.
+        # The status is already sent, so an unreadable upload ends with an error line instead.
+        created = processed = 0
+        try:
+            for processed, batch_created, errors in self.batches(rows):
+                created += batch_created
+                yield json.dumps({'processed': processed, 'created': created, 'errors': errors}) + '\n'
+        except UploadTooLarge as exc:
+            yield json.dumps({'processed': processed, 'created': created, 'error': str(exc)}) + '\n'
+            return
+        except UPLOAD_ERRORS as exc:
+            yield json.dumps({'processed': processed, 'created': created,
+                              'error': 'Unreadable upload: %s' % exc}) + '\n'
+            return
+        yield json.dumps({'processed': processed, 'created': created, 'done': True}) + '\n'
+
+    def run(self, rows):
+        processed = created = 0
+        errors = []
+        for processed, batch_created, batch_errors in self.batches(rows):
+            created += batch_created
+            errors.extend(batch_errors)
+        return {'processed': processed, 'created': created, 'errors': errors}
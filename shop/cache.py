@@ -0,0 +1,110 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .routers import primary_reads
+
+# Set while payloads are built inside a transaction that may still roll back
+_bypassed = ContextVar('shop_detail_cache_bypassed', default=False)
+
+
+class DetailCache:
+    """Read-through cache of serialized detail payloads, keyed by model and pk.
+
+    The storage is a Django cache alias (local-memory LRU by default, Redis or any
+    compatible backend through CACHES), so the backend is swapped in settings only.
+    """
+
+    def __init__(self, alias='default', timeout=300, key_prefix='shop:detail'):
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, model, pk):
+        return '%s:%s:%s' % (self.key_prefix, model._meta.label_lower, pk)
+
+    def _record(self, data):
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def get(self, model, pk):
+        return self._record(self.backend.get(self.make_key(model, pk)))
+
+    def set(self, model, pk, data):
+        self.backend.set(self.make_key(model, pk), dict(data), self.timeout)
+
+    @contextmanager
+    def bypass(self):
+        token = _bypassed.set(True)
+        try:
+            yield
+        finally:
+            _bypassed.reset(token)
+
+    def get_or_build(self, model, pk, build):
+        # `build` returns the payload, or None when the object does not exist (never cached).
+        # It reads the primary: a lagging replica's copy would stay cached for `timeout`.
+        if _bypassed.get():
+            return build()
+        data = self.get(model, pk)
+        if data is None:
+            with primary_reads():
+                data = build()
+            if data is not None:
+                self.set(model, pk, data)
+        return data
+
+    # Async variants for async views; backends without native async support run these in a thread
+
+    async def aget(self, model, pk):
+        return self._record(await self.backend.aget(self.make_key(model, pk)))
+
+    async def aset(self, model, pk, data):
+        await self.backend.aset(self.make_key(model, pk), dict(data), self.timeout)
+
+    async def aget_or_build(self, model, pk, build):
+        # `build` is a coroutine function here
+        data = await self.aget(model, pk)
+        if data is None:
+            with primary_reads():
+                data = await build()
+            if data is not None:
+                await self.aset(model, pk, data)
+        return data
+
+    def invalidate(self, model, *pks):
+        if not pks:
+            return
+        keys = [self.make_key(model, pk) for pk in pks]
+        self.backend.delete_many(keys)
+        # A reader may refill the key from pre-commit data; drop it again once the write is visible
+        transaction.on_commit(lambda: self.backend.delete_many(keys))
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+_config = getattr(settings, 'SHOP_DETAIL_CACHE', {})
+detail_cache = DetailCache(alias=_config.get('ALIAS', 'default'), timeout=_config.get('TIMEOUT', 300))
@@ -0,0 +1,54 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+from .cache import detail_cache
+from .models import Product, Order, OrderItem
+
+
+class StockConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Not enough stock.'
+    default_code = 'out_of_stock'
+
+
+def place_order(customer_id, shop_id, items):
+    """Create an Order and its OrderItems in one transaction, reserving stock.
+
+    Stock is decremented with conditional UPDATE ... SET stock = stock - n WHERE
+    stock >= n, so concurrent checkouts can never oversell or lose an update.
+    Rows are updated in product id order so two checkouts never lock in opposite
+    orders. Prices and the total come from the database, not the client.
+    """
+    quantities = Counter()
+    for item in items:
+        quantities[item['product']] += item['quantity']
+    product_ids = sorted(quantities)
+
+    with transaction.atomic():
+        now = timezone.now()
+        for product_id in product_ids:
+            quantity = quantities[product_id]
+            reserved = Product.objects.filter(pk=product_id, shop_id=shop_id, stock_quantity__gte=quantity).update(
+                stock_quantity=F('stock_quantity') - quantity, updated_at=now)
+            if not reserved:
+                if not Product.objects.filter(pk=product_id, shop_id=shop_id).exists():
+                    raise serializers.ValidationError(
+                        {'items': ['Product %s is not sold by shop %s.' % (product_id, shop_id)]})
+                raise StockConflict('Not enough stock for product %s.' % product_id)
+
+        # Read after the updates: the rows are locked, so these are the prices being charged
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+        order = Order.objects.create(customer_id=customer_id, shop_id=shop_id, status='pending',
+                                     total_price=sum(prices[pk] * quantities[pk] for pk in product_ids))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=pk, quantity=quantities[pk], price=prices[pk])
+            for pk in product_ids
+        ])
+        # update() bypasses post_save, so drop the cached product payloads here
+        detail_cache.invalidate(Product, *product_ids)
+    return order
@@ -0,0 +1,118 @@
+import hashlib
+from functools import lru_cache
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .queryplan import VERSION_FIELD, get_query_plan
+
+
+@lru_cache(maxsize=1024)
+def get_version_fields(model, serializer_class):
+    """Every updated_at column that feeds a serializer's output: the row's own plus
+    those of each relation it embeds (the select_related paths of its query plan)."""
+    fields = [VERSION_FIELD]
+    select_related, _ = get_query_plan(serializer_class())
+    for path in select_related:
+        related = model
+        for name in path.split('__'):
+            related = related._meta.get_field(name).related_model
+        if any(field.name == VERSION_FIELD for field in related._meta.concrete_fields):
+            fields.append('%s__%s' % (path, VERSION_FIELD))
+    return tuple(fields)
+
+
+def _resolve(obj, path):
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+
+def _make_etag(*parts):
+    digest = hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return '"%s"' % digest
+
+
+def _latest(values):
+    values = [value for value in values if value is not None]
+    return max(values).timestamp() if values else None
+
+
+def object_validators(obj, serializer_class):
+    versions = [_resolve(obj, path) for path in get_version_fields(type(obj), serializer_class)]
+    parts = [obj._meta.label_lower, obj.pk, versions]
+    if getattr(serializer_class, 'field_spec', None) is not None:
+        # A sparse representation is a different entity than the full one
+        parts.append(str(serializer_class.field_spec))
+    etag = _make_etag(*parts)
+    return etag, _latest(versions)
+
+
+def _validator_aggregates(queryset, serializer_class):
+    # One aggregate over the rows being returned; Count and Sum(pk) change when rows
+    # enter or leave the set, the Max() columns when any of them (or what they embed) is edited
+    fields = get_version_fields(queryset.model, serializer_class)
+    aggregates = {'count': Count('pk'), 'pk_sum': Sum('pk')}
+    aggregates.update({'v%d' % i: Max(field) for i, field in enumerate(fields)})
+    return queryset.order_by(), aggregates
+
+
+def _aggregate_validators(model, aggregates, result, extra):
+    versions = [result[name] for name in aggregates if name.startswith('v')]
+    etag = _make_etag(model._meta.label_lower, result['count'], result['pk_sum'], versions, extra)
+    return etag, _latest(versions)
+
+
+def queryset_validators(queryset, serializer_class, *extra):
+    queryset, aggregates = _validator_aggregates(queryset, serializer_class)
+    return _aggregate_validators(queryset.model, aggregates, queryset.aggregate(**aggregates), extra)
+
+
+async def aqueryset_validators(queryset, serializer_class, *extra):
+    queryset, aggregates = _validator_aggregates(queryset, serializer_class)
+    return _aggregate_validators(queryset.model, aggregates, await queryset.aaggregate(**aggregates), extra)
+
+
+class ConditionalGetMixin:
+    """Adds ETag/Last-Modified validators to GET responses and answers 304 before any
+    serialization happens when the client's copy is still current."""
+
+    validators = None
+
+    def conditional_response(self, etag, last_modified):
+        self.validators = (etag, last_modified)
+        return get_conditional_response(
+            self.request, etag=etag, last_modified=int(last_modified) if last_modified is not None else None)
+
+    def conditional_object(self, obj, serializer_class):
+        return self.conditional_response(*object_validators(obj, serializer_class))
+
+    def page_rows(self, queryset):
+        # Validate exactly the page that would be returned, so the aggregate stays page-sized.
+        # The page's pks are fetched first: MySQL has no LIMIT inside an IN subquery.
+        page = self.paginator.get_page_queryset(queryset, self.request)
+        return queryset.filter(pk__in=list(page.values_list('pk', flat=True)))
+
+    async def apage_rows(self, queryset):
+        page = self.paginator.get_page_queryset(queryset, self.request)
+        return queryset.filter(pk__in=[pk async for pk in page.values_list('pk', flat=True)])
+
+    def conditional_list(self, queryset, serializer_class):
+        return self.conditional_response(
+            *queryset_validators(self.page_rows(queryset), serializer_class, self.request.get_full_path()))
+
+    async def aconditional_list(self, queryset, serializer_class):
+        return self.conditional_response(
+            *await aqueryset_validators(await self.apage_rows(queryset), serializer_class, self.request.get_full_path()))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.validators is not None and request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+            etag, last_modified = self.validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,33 @@
+import csv
+
+from .renderers import dumps
+
+
+class Echo:
+    # csv.writer only needs write(); hand each formatted line straight back to the caller
+    def write(self, value):
+        return value
+
+
+def _buffered(lines, lines_per_chunk, empty=''):
+    # Join lines (str, or bytes with empty=b'') into larger chunks so the server does not flush once per row
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= lines_per_chunk:
+            yield empty.join(buffer)
+            buffer = []
+    if buffer:
+        yield empty.join(buffer)
+
+
+def iter_ndjson_export(queryset, fields, chunk_size=2000):
+    rows = queryset.order_by('id').values(*fields).iterator(chunk_size=chunk_size)
+    return _buffered((dumps(row) + b'\n' for row in rows), 200, b'')
+
+
+def iter_csv_export(queryset, fields, chunk_size=2000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    rows = queryset.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+    yield from _buffered((writer.writerow(row) for row in rows), 200)
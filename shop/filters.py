@@ -0,0 +1,97 @@
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .search import get_search_engine
+
+
+def _parse(params, name, parse):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return parse(value)
+    except (ValueError, InvalidOperation):
+        raise ValidationError({name: ['Invalid value "%s".' % value]})
+
+
+def _parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+class IdsFilterBackend(BaseFilterBackend):
+    # ?ids=1,2,3: a multi-get, served by one pk__in query on a single page
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get('ids')
+        if value in (None, ''):
+            return queryset
+        try:
+            ids = {int(part) for part in value.split(',') if part.strip()}
+        except ValueError:
+            raise ValidationError({'ids': ['Invalid value "%s".' % value]})
+        paginator = view.paginator
+        if len(ids) > paginator.max_page_size:
+            raise ValidationError({'ids': ['At most %d ids.' % paginator.max_page_size]})
+        paginator.default_page_size = max(len(ids), 1)
+        return queryset.filter(pk__in=ids)
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    # ?shop=, ?added_by=, ?min_price=, ?max_price=, ?in_stock=true|false
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        shop = _parse(params, 'shop', int)
+        if shop is not None:
+            queryset = queryset.filter(shop_id=shop)
+        added_by = _parse(params, 'added_by', int)
+        if added_by is not None:
+            queryset = queryset.filter(added_by_id=added_by)
+        min_price = _parse(params, 'min_price', Decimal)
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        max_price = _parse(params, 'max_price', Decimal)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+        in_stock = _parse(params, 'in_stock', _parse_bool)
+        if in_stock is True:
+            queryset = queryset.filter(stock_quantity__gt=0)
+        elif in_stock is False:
+            queryset = queryset.filter(stock_quantity__lte=0)
+        return queryset
+
+
+class ProductSearchBackend(BaseFilterBackend):
+    # ?q=keywords, matched against name and description by the configured engine
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return queryset
+        return get_search_engine().search(queryset, query)
+
+
+class FilterMixin:
+    filter_backends = (IdsFilterBackend,)
+    ordering_param = 'ordering'
+    ordering_fields = ()
+
+    def filter_queryset(self, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(self.request, queryset, self)
+        return queryset
+
+    def get_ordering(self):
+        # ?ordering=price or ?ordering=-price; the pk is always appended as the keyset tiebreaker
+        value = self.request.query_params.get(self.ordering_param)
+        if not value or not self.ordering_fields:
+            return self.ordering
+        if value.lstrip('-') not in self.ordering_fields:
+            raise ValidationError({self.ordering_param: ['Cannot order by "%s".' % value]})
+        if value.lstrip('-') == 'id':
+            return (value,)
+        return (value, '-id' if value.startswith('-') else 'id')
@@ -0,0 +1,134 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+def get_config():
+    # Costs default to OWASP's recommended minimums (scrypt's are Django's own defaults)
+    config = {
+        'SLOTS': max(1, (os.cpu_count() or 1) // 2),
+        'WAIT_SECONDS': 1.0,
+        'ARGON2_TIME_COST': 2,
+        'ARGON2_MEMORY_COST': 19456,
+        'ARGON2_PARALLELISM': 1,
+        'SCRYPT_WORK_FACTOR': 2 ** 14,
+        'SCRYPT_BLOCK_SIZE': 8,
+        'SCRYPT_PARALLELISM': 5,
+        'PBKDF2_ITERATIONS': hashers.PBKDF2PasswordHasher.iterations,
+    }
+    config.update(getattr(settings, 'SHOP_PASSWORD_HASHING', {}))
+    return config
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress, try again shortly.'
+    default_code = 'hashing_busy'
+    # Sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+_held = threading.local()
+
+
+def _semaphore(slots):
+    with _semaphores_lock:
+        if slots not in _semaphores:
+            _semaphores[slots] = threading.BoundedSemaphore(slots)
+        return _semaphores[slots]
+
+
+@contextmanager
+def hashing_slot():
+    """Hold one of SHOP_PASSWORD_HASHING['SLOTS'] while hashing.
+
+    Hashing is pure CPU (and releases the GIL), so a burst of sign-ins would otherwise
+    take every core from the other requests. Callers that cannot get a slot within
+    WAIT_SECONDS fail fast with 503 instead of queueing up request threads. Re-entrant,
+    since some hashers verify by encoding again.
+    """
+    if getattr(_held, 'depth', 0):
+        _held.depth += 1
+        try:
+            yield
+        finally:
+            _held.depth -= 1
+        return
+
+    config = get_config()
+    semaphore = _semaphore(config['SLOTS'])
+    if not semaphore.acquire(timeout=config['WAIT_SECONDS']):
+        raise HashingBusy()
+    _held.depth = 1
+    try:
+        yield
+    finally:
+        _held.depth = 0
+        semaphore.release()
+
+
+class BoundedHasherMixin:
+
+    def encode(self, password, salt, *args, **kwargs):
+        with hashing_slot():
+            return super().encode(password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        with hashing_slot():
+            return super().verify(password, encoded)
+
+    def harden_runtime(self, password, encoded):
+        with hashing_slot():
+            return super().harden_runtime(password, encoded)
+
+
+# Same algorithm names as Django's hashers, so stored hashes stay interchangeable; when a
+# cost changes in settings, must_update() rehashes each password at its next login.
+
+class Argon2PasswordHasher(BoundedHasherMixin, hashers.Argon2PasswordHasher):
+
+    @property
+    def time_cost(self):
+        return get_config()['ARGON2_TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return get_config()['ARGON2_MEMORY_COST']
+
+    @property
+    def parallelism(self):
+        return get_config()['ARGON2_PARALLELISM']
+
+
+class ScryptPasswordHasher(BoundedHasherMixin, hashers.ScryptPasswordHasher):
+
+    @property
+    def work_factor(self):
+        return get_config()['SCRYPT_WORK_FACTOR']
+
+    @property
+    def block_size(self):
+        return get_config()['SCRYPT_BLOCK_SIZE']
+
+    @property
+    def parallelism(self):
+        return get_config()['SCRYPT_PARALLELISM']
+
+    @property
+    def maxmem(self):
+        # hashlib's default limit (32 MiB) is below what larger work factors need
+        return 128 * self.work_factor * self.block_size * 2
+
+
+class PBKDF2PasswordHasher(BoundedHasherMixin, hashers.PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return get_config()['PBKDF2_ITERATIONS']
@@ -0,0 +1,228 @@
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('shop.jobs')
+
+
+def get_config():
+    config = {'EAGER': False, 'MAX_ATTEMPTS': 5, 'RETRY_DELAY_SECONDS': 5, 'MAX_RETRY_DELAY_SECONDS': 3600,
+              'LEASE_SECONDS': 600, 'POLL_INTERVAL': 1.0, 'BATCH_SIZE': 10}
+    config.update(getattr(settings, 'SHOP_JOBS', {}))
+    return config
+
+
+# Job name -> function; tasks.py registers the app's jobs when the app loads
+registry = {}
+
+
+def task(name):
+    def register(func):
+        registry[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, idempotency_key=None, delay=0, max_attempts=None, created_by=None):
+    """Queue `name` to run with `payload` (JSON) as keyword arguments.
+
+    Joins the caller's transaction, so a job whose request rolls back never exists. With
+    an idempotency key, repeating the call returns the job the first call created.
+    """
+    if name not in registry:
+        raise ValueError('Unknown job %r' % name)
+    config = get_config()
+    fields = {'name': name, 'payload': payload or {}, 'run_at': timezone.now() + timedelta(seconds=delay),
+              'max_attempts': max_attempts or config['MAX_ATTEMPTS'], 'created_by_id': created_by}
+
+    if idempotency_key is None:
+        job = Job.objects.create(**fields)
+    else:
+        job = Job.objects.filter(idempotency_key=idempotency_key).first()
+        if job is not None:
+            return job
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(idempotency_key=idempotency_key, **fields)
+        except IntegrityError:
+            # Lost a race with a concurrent enqueue of the same key
+            return Job.objects.get(idempotency_key=idempotency_key)
+
+    if config['EAGER']:
+        # Development and tests without a worker: run as soon as the job is committed
+        transaction.on_commit(lambda: run_job(job.pk))
+    return job
+
+
+def retry_delay(attempts, config):
+    # Exponential backoff with jitter, so jobs failing together do not retry together
+    delay = min(config['RETRY_DELAY_SECONDS'] * 2 ** (attempts - 1), config['MAX_RETRY_DELAY_SECONDS'])
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Lease:
+    """Holds a running job's lease for as long as its worker is running it: a helper thread
+    renews locked_at every third of LEASE_SECONDS, so only a worker that stopped (died,
+    hung, lost the database) lets the lease expire and the job go to another worker."""
+
+    def __init__(self, pk, worker, lease_seconds):
+        self.pk = pk
+        self.worker = worker
+        self.interval = lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='shop-job-lease', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    now = timezone.now()
+                    if not Job.objects.filter(pk=self.pk, status=Job.RUNNING, locked_by=self.worker).update(
+                            locked_at=now, updated_at=now):
+                        return
+                except DatabaseError:
+                    logger.warning('Could not renew the lease of job %s', self.pk, exc_info=True)
+        finally:
+            # This thread's own connection
+            connection.close()
+
+
+def requeue_expired(config):
+    # Jobs whose worker died mid-run go back to the queue once their lease runs out
+    expired = Job.objects.filter(status=Job.RUNNING,
+                                 locked_at__lt=timezone.now() - timedelta(seconds=config['LEASE_SECONDS']))
+    now = timezone.now()
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, locked_by='', locked_at=None, finished_at=now, updated_at=now,
+        last_error='Worker lease expired')
+    expired.update(status=Job.PENDING, locked_by='', locked_at=None, run_at=now, updated_at=now)
+
+
+def claim(worker, limit, pk=None):
+    """Mark up to `limit` due jobs as running for `worker` and return their ids.
+
+    Each job is taken with a conditional UPDATE ... WHERE status = 'pending', so of
+    several workers polling the same rows exactly one gets each job, on any database.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING)
+    if pk is not None:
+        due = due.filter(pk=pk)
+    else:
+        due = due.filter(run_at__lte=now)
+    claimed = []
+    for job_id in due.order_by('run_at', 'id').values_list('pk', flat=True)[:limit]:
+        if Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+                status=Job.RUNNING, locked_by=worker, locked_at=now, updated_at=now, attempts=F('attempts') + 1):
+            claimed.append(job_id)
+    return claimed
+
+
+def execute(pk, config=None):
+    # Runs one claimed job and records its outcome; failures are retried until max_attempts.
+    # Every update is conditional on still holding the lease: a worker that lost it (the job
+    # was requeued and claimed again) leaves the job to the new holder.
+    config = config or get_config()
+    job = Job.objects.get(pk=pk)
+    held = Job.objects.filter(pk=pk, status=Job.RUNNING, locked_by=job.locked_by)
+    func = registry.get(job.name)
+    try:
+        if func is None:
+            raise LookupError('No job registered as %r' % job.name)
+        with Lease(pk, job.locked_by, config['LEASE_SECONDS']):
+            result = func(**job.payload)
+    except Exception:
+        now = timezone.now()
+        fields = {'last_error': traceback.format_exc(), 'locked_by': '', 'locked_at': None, 'updated_at': now}
+        if job.attempts >= job.max_attempts:
+            fields.update(status=Job.FAILED, finished_at=now)
+            logger.error('Job %s (%s) failed after %d attempts', job.pk, job.name, job.attempts, exc_info=True)
+        else:
+            fields.update(status=Job.PENDING, run_at=now + timedelta(seconds=retry_delay(job.attempts, config)))
+            logger.warning('Job %s (%s) failed, attempt %d of %d', job.pk, job.name, job.attempts,
+                           job.max_attempts, exc_info=True)
+        held.update(**fields)
+        return False
+
+    now = timezone.now()
+    if not held.update(status=Job.SUCCEEDED, result=result, last_error='', locked_by='', locked_at=None,
+                       finished_at=now, updated_at=now):
+        logger.warning('Job %s (%s) finished after losing its lease; result discarded', job.pk, job.name)
+        return False
+    return True
+
+
+def run_job(pk):
+    # Eager mode: claim and run one job in this process
+    if claim('eager:%d' % os.getpid(), 1, pk=pk):
+        execute(pk)
+
+
+class Worker:
+    """Polls the Job table and runs due jobs one at a time. Run several worker processes
+    (manage.py run_jobs) for more throughput; they coordinate through claim()."""
+
+    def __init__(self, name=None, batch_size=None, poll_interval=None, stdout=None):
+        config = get_config()
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.stdout = stdout
+        self._stop = threading.Event()
+
+    def stop(self):
+        # Finishes the job in hand, then returns from run()
+        self._stop.set()
+
+    def release(self, pks):
+        # Claimed but not started: back to the queue without using up an attempt
+        Job.objects.filter(pk__in=pks, status=Job.RUNNING, locked_by=self.name).update(
+            status=Job.PENDING, locked_by='', locked_at=None, attempts=F('attempts') - 1, updated_at=timezone.now())
+
+    def run(self, burst=False):
+        # With burst=True, returns once no job is due; returns the number of jobs run
+        processed = 0
+        while not self._stop.is_set():
+            self.refresh_connections()
+            config = get_config()
+            requeue_expired(config)
+            claimed = claim(self.name, self.batch_size)
+            for index, pk in enumerate(claimed):
+                if self._stop.is_set():
+                    self.release(claimed[index:])
+                    break
+                succeeded = execute(pk, config)
+                processed += 1
+                if self.stdout is not None:
+                    self.stdout.write('job %s %s' % (pk, 'succeeded' if succeeded else 'failed'))
+            if not claimed:
+                if burst:
+                    break
+                self._stop.wait(self.poll_interval)
+        self.refresh_connections()
+        return processed
+
+    def refresh_connections(self):
+        # What Django does around each request: drop broken or expired connections. Never
+        # inside a transaction (a test case, or a caller's atomic block) since that ends it.
+        if not connection.in_atomic_block:
+            close_old_connections()
@@ -0,0 +1,174 @@
+import fnmatch
+import json
+import os
+import platform
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from shop.benchmark import Fixtures, Runner, compare, get_scenarios, time_renderers, time_serializers
+from shop.readers import product_reader, review_reader, order_reader, order_item_reader
+from shop.seeding import SCALES, Seeder
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic data, drive every shop endpoint with concurrent clients and report '
+            'latency percentiles, throughput and queries per request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                            help='Size of the synthetic dataset (default: small).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for data and request mix.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per scenario.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--only', action='append', default=[], metavar='PATTERN',
+                            help='Only run scenarios whose name matches this glob (repeatable).')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--baseline', help='Results file of an earlier run to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95/throughput regression against the baseline (default: 0.2).')
+        parser.add_argument('--base-url',
+                            help='Benchmark a running server (e.g. http://127.0.0.1:8000) instead of an '
+                                 'in-process client. It must share this project\'s database.')
+        parser.add_argument('--seed-database', action='store_true',
+                            help='With --base-url, seed the configured database first.')
+        parser.add_argument('--serializers', action='store_true',
+                            help='Instead of the endpoints, time each list serializer against its '
+                                 'values() reader (shop/readers.py) per row.')
+        parser.add_argument('--renderers', action='store_true',
+                            help='Instead of the endpoints, time DRF\'s JSON renderer and parser against '
+                                 'the configured ones (shop/renderers.py) on list-sized payloads.')
+
+    def handle(self, *args, **options):
+        scenarios = get_scenarios()
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios
+                         if any(fnmatch.fnmatch(scenario.name, pattern) for pattern in options['only'])]
+            if not scenarios:
+                raise CommandError('No scenario matches %s' % ', '.join(options['only']))
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        if (options['serializers'] or options['renderers']) and options['base_url']:
+            raise CommandError('--serializers and --renderers run in-process only.')
+        if options['base_url']:
+            # The server owns the database; only read fixtures from it (seeding first if asked)
+            if options['seed_database']:
+                Seeder(SCALES[options['scale']], seed=options['seed'], stdout=self.stdout).run()
+            results = self.run_scenarios(scenarios, options)
+        else:
+            results = self.run_in_process(scenarios, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write('Results written to %s' % options['output'])
+
+        failures = ['%s: %s' % (name, violation) for name, result in results.get('scenarios', {}).items()
+                    for violation in result['violations']]
+        failures += ['%s: reader output differs from the serializer\'s' % name
+                     for name, result in results.get('serializers', {}).items() if not result['identical']]
+        failures += ['%s: fast renderer output differs from JSONRenderer\'s' % name
+                     for name, result in results.get('renderers', {}).items() if not result['identical']]
+        if baseline is not None:
+            failures += compare(results, baseline, options['tolerance'])
+        if failures:
+            raise CommandError('Benchmark check failed:\n  ' + '\n  '.join(failures))
+
+    def run_in_process(self, scenarios, options):
+        # A throwaway database, like the test runner's; on SQLite a file so client threads share it
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+                test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                Seeder(SCALES[options['scale']], seed=options['seed'], stdout=self.stdout).run()
+                # Production-like: no per-query debug logging; the test client's host is allowed
+                with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+                    if options['serializers']:
+                        return self.run_serializers(options)
+                    if options['renderers']:
+                        return self.run_renderers(options)
+                    return self.run_scenarios(scenarios, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def micro_meta(self, options):
+        return {
+            'created': timezone.now().isoformat(),
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        }
+
+    def run_serializers(self, options):
+        results = time_serializers([product_reader, review_reader, order_reader, order_item_reader])
+        self.stdout.write('%-24s %8s %14s %14s %8s %10s' % (
+            'serializer', 'rows', 'drf us/row', 'reader us/row', 'speedup', 'identical'))
+        for name, result in results.items():
+            line = '%-24s %8d %14.2f %14.2f %7.1fx %10s' % (
+                name, result['rows'], result['serializer_us_per_row'], result['reader_us_per_row'],
+                result['speedup'], 'yes' if result['identical'] else 'NO')
+            self.stdout.write(line if result['identical'] else self.style.ERROR(line))
+        return {'meta': self.micro_meta(options), 'serializers': results}
+
+    def run_renderers(self, options):
+        results = time_renderers()
+        self.stdout.write('%-18s %9s %10s %10s %8s %10s %10s %8s %10s' % (
+            'payload', 'bytes', 'render ms', 'fast ms', 'speedup', 'parse ms', 'fast ms', 'speedup', 'identical'))
+        for name, result in results.items():
+            line = '%-18s %9d %10.3f %10.3f %7.1fx %10.3f %10.3f %7.1fx %10s' % (
+                name, result['bytes'], result['render_ms'], result['fast_render_ms'], result['render_speedup'],
+                result['parse_ms'], result['fast_parse_ms'], result['parse_speedup'],
+                'yes' if result['identical'] else 'NO')
+            self.stdout.write(line if result['identical'] else self.style.ERROR(line))
+        return {'meta': self.micro_meta(options), 'renderers': results}
+
+    def run_scenarios(self, scenarios, options):
+        try:
+            fixtures = Fixtures()
+        except ValueError as e:
+            raise CommandError(str(e))
+        runner = Runner(fixtures, concurrency=options['concurrency'], requests=options['requests'],
+                        base_url=options['base_url'], seed=options['seed'])
+
+        self.stdout.write('%-24s %8s %7s %9s %9s %9s %9s %8s' % (
+            'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        results = {}
+        for scenario in scenarios:
+            result = results[scenario.name] = runner.run(scenario)
+            latency = result['latency_ms']
+            queries = result['queries_per_request']
+            line = '%-24s %8d %7d %9.1f %9.1f %9.1f %9.1f %8s' % (
+                scenario.name, result['requests'], result['errors'], result['rps'] or 0, latency['p50'] or 0,
+                latency['p95'] or 0, latency['p99'] or 0, '-' if queries is None else '%.2f' % queries)
+            self.stdout.write(self.style.ERROR(line) if result['errors'] or result['violations'] else line)
+            for violation in result['violations']:
+                self.stdout.write(self.style.ERROR('    %s' % violation))
+
+        return {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'mode': 'http' if options['base_url'] else 'in-process',
+                'base_url': options['base_url'],
+                'scale': options['scale'],
+                'counts': SCALES[options['scale']],
+                'seed': options['seed'],
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+            },
+            'scenarios': results,
+        }
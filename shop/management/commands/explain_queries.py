@@ -0,0 +1,87 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.models import User, Shop, Shopkeeper, Customer, Product, Review, Order, OrderItem
+from shop.queryplan import optimize_queryset
+from shop.serializers import (UserSerializer, ShopSerializer, ShopkeeperSerializer, CustomerSerializer,
+                              ProductSerializer, ReviewSerializer, OrderSerializer, OrderItemSerializer)
+from shop.search import get_search_engine
+
+PAGE = 51
+# Any id works: the plan, not the result, is under test
+CURSOR = 1
+
+# "SCAN t" on SQLite and "Seq Scan on t" on PostgreSQL read every row of t (an FTS5
+# MATCH shows up as a VIRTUAL TABLE scan and is an index lookup). SQLite reports a
+# PK-ordered scan that stops at LIMIT the same way as a full one, so the
+# representative queries below always seek from a cursor, as real pages do.
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def list_page(model, serializer_class, **filters):
+    queryset = optimize_queryset(model.objects.filter(**filters), serializer_class)
+    return queryset.filter(pk__gt=CURSOR).order_by('pk')[:PAGE]
+
+
+def hot_queries():
+    return [
+        # List endpoints (one keyset page each)
+        ('users list', list_page(User, UserSerializer)),
+        ('shops list', list_page(Shop, ShopSerializer)),
+        ('shopkeepers list', list_page(Shopkeeper, ShopkeeperSerializer)),
+        ('customers list', list_page(Customer, CustomerSerializer)),
+        ('products list', list_page(Product, ProductSerializer)),
+        ('reviews list', list_page(Review, ReviewSerializer)),
+        ('product reviews list', list_page(Review, ReviewSerializer, product_id=CURSOR)),
+        ('orders list', list_page(Order, OrderSerializer)),
+        ('order items list', list_page(OrderItem, OrderItemSerializer)),
+        # Detail endpoints
+        ('product detail', optimize_queryset(Product.objects.filter(pk=CURSOR), ProductSerializer)),
+        ('order item detail', optimize_queryset(OrderItem.objects.filter(pk=CURSOR), OrderItemSerializer)),
+        # Filtered and sorted product listings
+        ('products by price', Product.objects.filter(price__gt=1).order_by('price', 'id')[:PAGE]),
+        ('products by shop in stock', Product.objects.filter(shop_id=CURSOR, stock_quantity__gt=0)[:PAGE]),
+        ('products search', get_search_engine().search(Product.objects.all(), 'mug').filter(
+            pk__gt=CURSOR).order_by('pk')[:PAGE]),
+        # Hot lookups
+        ('orders by customer and status', Order.objects.filter(customer_id=CURSOR, status='pending')),
+        ('orders by shop and status', Order.objects.filter(shop_id=CURSOR, status='pending')),
+        ('order items by order', OrderItem.objects.filter(order_id=CURSOR)),
+        ('reviews by product', Review.objects.filter(product_id=CURSOR)),
+        ('shopkeeper by user', Shopkeeper.objects.filter(user_id=CURSOR)),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Print the query plan of every hot API query and flag full table scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error if any query plan contains a full table scan.')
+        parser.add_argument('--quiet', action='store_true', help='Only report queries with full scans.')
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError('Query plans are not supported on %s' % connection.vendor)
+
+        flagged = []
+        queries = hot_queries()
+        for name, queryset in queries:
+            plan = queryset.explain()
+            scans = sorted(set(pattern.findall(plan)))
+            if scans:
+                flagged.append(name)
+            if scans or not options['quiet']:
+                status = self.style.ERROR('FULL SCAN: %s' % ', '.join(scans)) if scans else self.style.SUCCESS('ok')
+                self.stdout.write('%s ... %s' % (name, status))
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+        if flagged and options['fail_on_scan']:
+            raise CommandError('Full table scans in: %s' % ', '.join(flagged))
+        self.stdout.write('%d queries checked, %d with full scans' % (len(queries), len(flagged)))
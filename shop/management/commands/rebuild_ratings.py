@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from shop.jobs import enqueue
+from shop.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute every product\'s rating_count and rating_sum from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of products updated per transaction.')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the rebuild as a job for run_jobs workers instead of running it here.')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('ratings.rebuild', {'batch_size': options['batch_size']})
+            self.stdout.write(self.style.SUCCESS('Queued rating rebuild as job %d' % job.pk))
+            return
+        updated = rebuild_rating_aggregates(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Rebuilt rating aggregates for %d products' % updated))
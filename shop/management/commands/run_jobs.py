@@ -0,0 +1,29 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from shop.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = ('Run background jobs from the Job table until stopped. Start several of these '
+            'processes for more throughput.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due.')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed per poll.')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--name', help='Worker name recorded on claimed jobs (default: host:pid).')
+
+    def handle(self, *args, **options):
+        worker = Worker(name=options['name'], batch_size=options['batch_size'],
+                        poll_interval=options['poll_interval'], stdout=self.stdout)
+
+        # SIGTERM/SIGINT let the job in hand finish; unstarted claimed jobs go back to the queue
+        def stop(signum, frame):
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        processed = worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS('Worker %s ran %d jobs' % (worker.name, processed)))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.seeding import SCALES, Seeder, default_workers
+
+COUNT_OPTIONS = ['shops', 'shopkeepers', 'customers', 'products', 'orders', 'items_per_order', 'reviews']
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with deterministic synthetic shops, users, products, orders and reviews, '
+            'with skewed popularity, using bulk inserts and parallel workers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                            help='Preset row counts (default: small). Individual counts can be overridden.')
+        for name in COUNT_OPTIONS:
+            parser.add_argument('--%s' % name.replace('_', '-'), type=int, dest=name)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of shop and product popularity; 0 is uniform (default: 1.1).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert transaction.')
+        parser.add_argument('--workers', type=int,
+                            help='Worker processes per table (default: 1 on SQLite, one per CPU otherwise).')
+
+    def handle(self, *args, **options):
+        counts = dict(SCALES[options['scale']])
+        for name in COUNT_OPTIONS:
+            if options[name] is not None:
+                counts[name] = options[name]
+        for name in ('shops', 'shopkeepers', 'customers', 'items_per_order'):
+            if counts[name] < 1:
+                raise CommandError('--%s must be at least 1' % name.replace('_', '-'))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        workers = options['workers'] or default_workers()
+        self.stdout.write('Seeding %s with %d worker(s)' % (
+            ', '.join('%d %s' % (counts[name], name) for name in COUNT_OPTIONS if name != 'items_per_order'), workers))
+        started = time.perf_counter()
+        Seeder(counts, seed=options['seed'], batch_size=options['batch_size'], skew=options['skew'],
+               workers=workers, stdout=self.stdout).run()
+        self.stdout.write(self.style.SUCCESS('Done in %.1fs' % (time.perf_counter() - started)))
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shop.routers import get_config
+
+
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database into each replica file (DB_REPLICAS), standing in '
+            'for replication when trying replicas locally.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float,
+                            help='Keep copying every this many seconds (the simulated replication lag).')
+
+    def handle(self, *args, **options):
+        replicas = get_config()['REPLICAS']
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Server database replicas are kept in sync by the database itself.')
+        if not replicas:
+            raise CommandError('No replicas configured; set DB_REPLICAS to a comma separated list of files.')
+
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(str(primary['NAME']))
+            try:
+                for alias in replicas:
+                    target = sqlite3.connect(str(connections[alias].settings_dict['NAME']))
+                    try:
+                        # Online backup: a consistent snapshot even while the primary takes writes
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write('Synced %d replicas in %.1fms' % (len(replicas), (time.perf_counter() - started) * 1000))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,254 @@
+import bisect
+import hmac
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+from .cache import detail_cache
+from .profiling import PROFILE_PARAM
+
+logger = logging.getLogger('shop.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# SQL kept per request for the slow-request log
+MAX_STATEMENTS = 50
+
+
+def get_config():
+    config = {'TOKEN': None, 'SLOW_REQUEST_SECONDS': 1.0}
+    config.update(getattr(settings, 'SHOP_METRICS', {}))
+    return config
+
+
+class RequestRecord:
+    __slots__ = ('queries', 'query_seconds', 'serializer_seconds', 'statements', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.statements = []
+        self.serializing = False
+
+
+# The record of the request being handled. A context variable rather than a thread local so
+# it follows async views and the sync_to_async threads their queries run in.
+current_record = ContextVar('shop_request_record', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every database connection (see signals.py); a no-op outside requests
+    record = current_record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        record.queries += 1
+        record.query_seconds += elapsed
+        if len(record.statements) < MAX_STATEMENTS:
+            record.statements.append((sql, elapsed))
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializer_timer():
+    # Adds the time spent inside to the request's serializer time; nested uses count once.
+    # Used by the shop's serializers (TimedSerializerMixin) and readers
+    record = current_record.get()
+    if record is None or record.serializing:
+        yield
+        return
+    record.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.serializer_seconds += time.perf_counter() - started
+        record.serializing = False
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in labels.items())
+
+
+class MetricsRegistry:
+    """In-process metrics per view (URL name). Each worker process keeps its own, so
+    Prometheus should scrape every worker, as with any multi-process exporter."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = Counter()
+            self.latency = {}
+            self.queries = {}
+            self.query_seconds = Counter()
+            self.serializer_seconds = Counter()
+            self.response_bytes = {}
+
+    def observe(self, view, method, status_code, duration, record, size):
+        with self._lock:
+            self.requests[view, method, status_code] += 1
+            self._histogram(self.latency, (view, method), LATENCY_BUCKETS).observe(duration)
+            self._histogram(self.queries, view, QUERY_BUCKETS).observe(record.queries)
+            self.query_seconds[view] += record.query_seconds
+            self.serializer_seconds[view] += record.serializer_seconds
+            if size is not None:
+                self._histogram(self.response_bytes, view, SIZE_BUCKETS).observe(size)
+
+    def _histogram(self, histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def render(self):
+        lines = []
+
+        def header(name, kind, description):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+
+        def histogram(name, histogram, **labels):
+            total = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                total += count
+                lines.append('%s_bucket{%s} %d' % (name, _labels(**labels, le=bound), total))
+            lines.append('%s_sum{%s} %s' % (name, _labels(**labels), repr(histogram.sum)))
+            lines.append('%s_count{%s} %d' % (name, _labels(**labels), total))
+
+        with self._lock:
+            header('shop_http_requests_total', 'counter', 'Requests handled, by view, method and status.')
+            for (view, method, status_code), count in sorted(self.requests.items()):
+                lines.append('shop_http_requests_total{%s} %d' % (
+                    _labels(view=view, method=method, status=status_code), count))
+            header('shop_http_request_duration_seconds', 'histogram', 'Time spent handling requests.')
+            for (view, method), value in sorted(self.latency.items()):
+                histogram('shop_http_request_duration_seconds', value, view=view, method=method)
+            header('shop_db_queries_per_request', 'histogram', 'Database queries run per request.')
+            for view, value in sorted(self.queries.items()):
+                histogram('shop_db_queries_per_request', value, view=view)
+            header('shop_db_query_duration_seconds_total', 'counter', 'Time spent in database queries.')
+            for view, seconds in sorted(self.query_seconds.items()):
+                lines.append('shop_db_query_duration_seconds_total{%s} %r' % (_labels(view=view), seconds))
+            header('shop_serializer_duration_seconds_total', 'counter', 'Time spent producing serializer output.')
+            for view, seconds in sorted(self.serializer_seconds.items()):
+                lines.append('shop_serializer_duration_seconds_total{%s} %r' % (_labels(view=view), seconds))
+            header('shop_http_response_size_bytes', 'histogram', 'Response body sizes (streaming bodies excluded).')
+            for view, value in sorted(self.response_bytes.items()):
+                histogram('shop_http_response_size_bytes', value, view=view)
+
+        stats = detail_cache.stats()
+        header('shop_detail_cache_hits_total', 'counter', 'Detail cache hits in this process.')
+        lines.append('shop_detail_cache_hits_total %d' % stats['hits'])
+        header('shop_detail_cache_misses_total', 'counter', 'Detail cache misses in this process.')
+        lines.append('shop_detail_cache_misses_total %d' % stats['misses'])
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """Records latency, query count/time, serializer time and response size per URL name,
+    and logs the SQL of requests slower than SHOP_METRICS['SLOW_REQUEST_SECONDS']. Works
+    for sync and async views without forcing either onto the other's thread model."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.slow_request_seconds = get_config()['SLOW_REQUEST_SECONDS']
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        record = RequestRecord()
+        token = current_record.set(record)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_record.reset(token)
+        self.finish(request, response, record, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        record = RequestRecord()
+        token = current_record.set(record)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_record.reset(token)
+        self.finish(request, response, record, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, response, record, duration):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.route) if match is not None else 'unmatched'
+        # Queries a streaming body runs after this point are not attributed to the request
+        size = None if response.streaming else len(response.content)
+        registry.observe(view, request.method, response.status_code, duration, record, size)
+
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            statements = '\n'.join('  %.1fms %s' % (elapsed * 1000, sql[:500]) for sql, elapsed in record.statements)
+            logger.warning('Slow request: %s %s (%s) %.1fms, %d queries in %.1fms, serializer %.1fms\n%s',
+                           request.method, logged_path(request), view, duration * 1000, record.queries,
+                           record.query_seconds * 1000, record.serializer_seconds * 1000, statements)
+
+
+def logged_path(request):
+    # The full path without the profiling token, which would otherwise end up in the log
+    if PROFILE_PARAM not in request.GET:
+        return request.get_full_path()
+    query = request.GET.copy()
+    del query[PROFILE_PARAM]
+    return request.path + ('?' + query.urlencode() if query else '')
+
+
+def metrics_view(request):
+    # Prometheus text exposition, for "Authorization: Bearer <SHOP_METRICS['TOKEN']>" or a
+    # signed-in staff user; without a token set, staff only
+    token = get_config()['TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scraper = bool(token) and hmac.compare_digest(header.encode('utf-8'), ('Bearer %s' % token).encode('utf-8'))
+    if not scraper and not request.user.is_staff:
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
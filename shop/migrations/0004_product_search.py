@@ -0,0 +1,75 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class RunSQLOn(migrations.RunSQL):
+    # RunSQL for one database vendor only; a no-op on the others
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+# The search engines' schema as of this migration (shop/search.py), kept here so later
+# changes to that module leave this migration as it was
+SQLITE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+    "name, description, content='shop_product', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, description ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_FTS_REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_ai",
+    "DROP TRIGGER IF EXISTS shop_product_fts_ad",
+    "DROP TRIGGER IF EXISTS shop_product_fts_au",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+POSTGRES_FTS_SQL = [
+    "CREATE INDEX IF NOT EXISTS shop_product_search_idx ON shop_product USING gin "
+    "((to_tsvector('simple'::regconfig, COALESCE(name, '') || ' ' || COALESCE(description, ''))))",
+]
+
+POSTGRES_FTS_REVERSE_SQL = ["DROP INDEX IF EXISTS shop_product_search_idx"]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock_quantity', 'id'], name='product_stock_id_idx'),
+        ),
+        # SQLite FTS5 table and sync triggers, or a GIN index on PostgreSQL
+        RunSQLOn('sqlite', SQLITE_FTS_SQL, SQLITE_FTS_REVERSE_SQL),
+        RunSQLOn('postgresql', POSTGRES_FTS_SQL, POSTGRES_FTS_REVERSE_SQL),
+    ]
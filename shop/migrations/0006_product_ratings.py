@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_ratings(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Review = apps.get_model('shop', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).values('product')
+    Product.objects.update(
+        rating_count=Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), 0),
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+    )
+
+
+class RunSQLOn(migrations.RunSQL):
+    # RunSQL for one database vendor only; a no-op on the others
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+# Adding NOT NULL columns makes SQLite rebuild shop_product, which drops the search sync
+# triggers of migration 0004; these are them again, as they were then
+SQLITE_FTS_TRIGGERS_SQL = [
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, description ON shop_product BEGIN "
+    "INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='shop.product'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'id'], name='review_product_id_idx'),
+        ),
+        RunSQLOn('sqlite', SQLITE_FTS_TRIGGERS_SQL, migrations.RunSQL.noop),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 
 
@@ -48,6 +48,7 @@ class User(AbstractBaseUser):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = UserManager()
 
@@ -72,6 +73,7 @@ class Shop(models.Model):
     shopkeepers = models.ManyToManyField('Shopkeeper', related_name='assigned_shop', through='ShopAssignment')
     status = models.CharField(max_length=50,
                               choices=[('active', 'Active'), ('pending', 'Pending'), ('deleted', 'Deleted')])
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -84,6 +86,8 @@ class Shopkeeper(models.Model):
     NID = models.CharField(max_length=100)
     approval_status = models.CharField(max_length=50,
                                        choices=[('pending', 'Pending'), ('approved', 'Approved') ,('rejected', 'Rejected')])
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return self.user.name
 
@@ -103,6 +107,7 @@ class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     approval_status = models.CharField(max_length=50,
                                        choices=[('pending', 'Pending'), ('approved', 'Approved') ,('rejected', 'Rejected')])
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.user.name
@@ -116,30 +121,77 @@ class Product(models.Model):
     stock_quantity = models.IntegerField()
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
     added_by = models.ForeignKey(Shopkeeper, on_delete=models.CASCADE)
+    # Denormalized review aggregates, kept in step by the Review signals (see shop/ratings.py)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Keyset pagination seeks on (ordering field, id) for each sortable column
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['stock_quantity', 'id'], name='product_stock_id_idx'),
+            models.Index(fields=['shop', 'stock_quantity'], name='product_shop_stock_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def rating_average(self):
+        return self.compute_rating_average(self.rating_sum, self.rating_count)
+
+    @staticmethod
+    def compute_rating_average(rating_sum, rating_count):
+        if not rating_count:
+            return None
+        return round(rating_sum / rating_count, 2)
+
 
 # Review Model
 class Review(models.Model):
     rating = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)])
     comment = models.TextField()
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Covered by the (product, id) index, which also serves per-product review pages
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'id'], name='review_product_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.rating} by {self.customer.user.name}"
 
+    def save(self, *args, **kwargs):
+        # The rating signals (signals.py) lock the stored row in pre_save and apply the delta
+        # in post_save; one transaction around both keeps concurrent edits from each
+        # applying a delta against the same old rating
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
 
 # Order Model
 class Order(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    shop = models.ForeignKey(Shop, on_delete=models.CASCADE)
+    # Both FKs are covered by the composite indexes below, which lead with them
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, db_index=False)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=50,
                               choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'),
                                        ('shipped', 'Shipped'), ('delivered', 'Delivered')])
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),
+            models.Index(fields=['shop', 'status'], name='order_shop_status_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.customer.user.name}"
 
@@ -150,6 +202,46 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product.name}"
+
+# Job Model: the background job queue table (see shop/jobs.py)
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    # Enqueueing twice with the same key returns the first job instead of adding another
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # Workers poll for due jobs: WHERE status = 'pending' AND run_at <= now ORDER BY run_at
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.quantity} of {self.product.name}"
\ No newline at end of file
+        return f"{self.name} #{self.id} ({self.status})"
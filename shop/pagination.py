@@ -0,0 +1,198 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+# Keyset (seek) pagination: the cursor holds the ordering values of the row at the
+# edge of the current page, so every page is a `WHERE (ordering) > (cursor) LIMIT n`
+# index range scan and never pays OFFSET cost however deep the client goes.
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    # When set (e.g. by IdsFilterBackend), the page size used without ?page_size=
+    default_page_size = None
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        # The last ordering field must be unique so the keyset is a total order
+        assert self.ordering and self.ordering[-1].lstrip('-') in ('id', 'pk'), \
+            'Keyset ordering must end with the primary key'
+
+    def get_page_size(self, request):
+        page_size = self.default_page_size or api_settings.PAGE_SIZE or 50
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return page_size
+        try:
+            value = int(value)
+        except ValueError:
+            return page_size
+        return max(1, min(value, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = payload['p'], bool(payload.get('r'))
+            ordering = payload.get('o', 'id')
+        except (TypeError, ValueError, KeyError, AttributeError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor is only meaningful for the ordering it was issued under
+        if not isinstance(position, list) or len(position) != len(self.ordering) or ordering != self.ordering[0]:
+            raise NotFound(self.invalid_cursor_message)
+        # Only what encode_cursor writes: JSON scalars (not objects, arrays or booleans)
+        if any(isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse=False):
+        payload = {'p': [_encode_value(value) for value in position]}
+        if self.ordering[0] != 'id':
+            payload['o'] = self.ordering[0]
+        if reverse:
+            payload['r'] = 1
+        data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, base64.urlsafe_b64encode(data).decode('ascii'))
+
+    def get_position(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def keyset_filter(self, position, reverse):
+        # (a, b, id) > (x, y, z)  ==  a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = '%s__%s' % (name, 'lt' if descending else 'gt')
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        if self.reverse:
+            ordering = [field[1:] if field.startswith('-') else '-' + field for field in self.ordering]
+        else:
+            ordering = list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            # A forged value the ordering fields cannot take ('abc' for an id, a bad date)
+            try:
+                queryset = queryset.filter(self.keyset_filter(self.position, self.reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        # Fetch one extra row to learn whether there is a page beyond this one
+        return queryset[:self.page_size + 1]
+
+    def finalize_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows:
+            if has_more or self.reverse:
+                self.next_position = self.get_position(rows[-1])
+            if self.position is not None and (has_more or not self.reverse):
+                self.previous_position = self.get_position(rows[0])
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finalize_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request)
+        # chunk_size lets aiterator() honour prefetch_related()
+        return self.finalize_page([row async for row in page.aiterator(chunk_size=self.page_size + 1)])
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    pagination_class = KeysetPagination
+    ordering = ('id',)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = self.pagination_class(self.get_ordering())
+        return self._paginator
+
+    def get_ordering(self):
+        return self.ordering
+
+    def paginate_queryset(self, queryset):
+        return self.paginator.paginate_queryset(queryset, self.request, view=self)
+
+    async def apaginate_queryset(self, queryset):
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    # The page serialized by a ValuesReader (see readers.py) straight from values_list() rows
+
+    def paginate_values(self, queryset, reader):
+        return reader.serialize(self.paginate_queryset(reader.queryset(queryset, self.ordering_columns())))
+
+    async def apaginate_values(self, queryset, reader):
+        return reader.serialize(await self.apaginate_queryset(reader.queryset(queryset, self.ordering_columns())))
+
+    def ordering_columns(self):
+        return [field.lstrip('-') for field in self.paginator.ordering]
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
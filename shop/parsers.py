@@ -0,0 +1,42 @@
+import io
+import json
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import FastJSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    # Optional: without it everything below takes the stdlib json path
+    orjson = None
+
+
+def loads(data):
+    # Parses a JSON document from bytes or str; errors are ValueErrors either way
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Let json decide: it accepts what orjson does not (integers beyond 64 bits)
+            pass
+    return json.loads(data)
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser decoding through orjson when it is installed. Like the strict stdlib
+    parser it rejects NaN and infinities; bodies orjson refuses are re-parsed by
+    JSONParser, so what is accepted and the error messages stay the same."""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return orjson.loads(body if encoding.lower() in ('utf-8', 'utf8') else body.decode(encoding))
+        except (orjson.JSONDecodeError, UnicodeDecodeError):
+            return super().parse(io.BytesIO(body), media_type, parser_context)
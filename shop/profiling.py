@@ -0,0 +1,230 @@
+import asyncio
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import FileResponse
+from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_MODE_HEADER = 'HTTP_X_PROFILE_MODE'
+PROFILE_PARAM = 'profile'
+PROFILE_MODE_PARAM = 'profile_mode'
+MODES = {'cprofile': '.pstats', 'sampling': '.collapsed'}
+ARTIFACT_RE = re.compile(r'^[\w-]+\.(?:pstats|collapsed)$')
+# cProfile hooks are process-wide and Python 3.12+ refuses a second active profiler, so
+# one request at a time is profiled with it; requests overlapping it get the stack sampler
+cprofile_lock = threading.Lock()
+
+
+def get_config():
+    config = {'TOKEN': None, 'SAMPLE_RATE': 0.0, 'MODE': 'cprofile', 'SAMPLING_INTERVAL': 0.001,
+              'DIRECTORY': os.path.join(settings.BASE_DIR, 'profiles'), 'MAX_ARTIFACTS': 200}
+    config.update(getattr(settings, 'SHOP_PROFILING', {}))
+    return config
+
+
+class StackSampler:
+    """Samples one thread's Python stack every `interval` seconds from a helper thread and
+    counts identical stacks, ready for flamegraph.pl / speedscope (collapsed format).
+
+    With `task`, the thread is an event loop's and only samples taken while that task is
+    the one running count; the loop's other coroutines are left out.
+    """
+
+    def __init__(self, thread_id, interval, task=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.task = task
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='shop-stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            if not self.running():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            # Checked again: the loop may have switched tasks while the frame was read
+            if frame is not None and self.running():
+                self.stacks[self.collapse(frame)] += 1
+
+    def running(self):
+        return self.task is None or asyncio.current_task(self.task.get_loop()) is self.task
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            filename = '/'.join(code.co_filename.split(os.sep)[-2:])
+            names.append('%s (%s:%d)' % (code.co_name, filename, code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+
+class ProfilingMiddleware:
+    """Opt-in per-request profiling.
+
+    A request is profiled when it carries the configured token in an X-Profile header or
+    ?profile= parameter, or when it is picked by SHOP_PROFILING['SAMPLE_RATE']. The
+    profile (cProfile .pstats, or sampled stacks in collapsed format with
+    X-Profile-Mode: sampling) is written to SHOP_PROFILING['DIRECTORY'] and its name
+    returned in the X-Profile-Id header; staff download it from /profiles/<name>. A request
+    that overlaps one already under cProfile is sampled instead.
+
+    Under ASGI requests are always sampled, and only while their own task runs: cProfile
+    would record every coroutine on the event loop. Time the task spends waiting, such as
+    on queries an async view runs in the sync thread pool, is not sampled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def get_mode(self, request, config):
+        token = config['TOKEN']
+        supplied = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        if token and supplied and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+            mode = request.META.get(PROFILE_MODE_HEADER) or request.GET.get(PROFILE_MODE_PARAM) or config['MODE']
+            return mode if mode in MODES else config['MODE']
+        if config['SAMPLE_RATE'] and random.random() < config['SAMPLE_RATE']:
+            return config['MODE']
+        return None
+
+    def start(self, mode, config, task=None):
+        if mode != 'sampling' and task is None and cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler (a debugger, coverage) holds the hooks
+                cprofile_lock.release()
+            else:
+                return profiler
+        profiler = StackSampler(threading.get_ident(), config['SAMPLING_INTERVAL'], task)
+        profiler.start()
+        return profiler
+
+    def stop(self, profiler):
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+        else:
+            try:
+                profiler.disable()
+            finally:
+                cprofile_lock.release()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = get_config()
+        mode = self.get_mode(request, config)
+        if mode is None:
+            return self.get_response(request)
+        profiler = self.start(mode, config)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(profiler)
+        return self.finish(request, response, profiler, config, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        config = get_config()
+        mode = self.get_mode(request, config)
+        if mode is None:
+            return await self.get_response(request)
+        profiler = self.start(mode, config, asyncio.current_task())
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(profiler)
+        return self.finish(request, response, profiler, config, time.perf_counter() - started)
+
+    def finish(self, request, response, profiler, config, duration):
+        mode = 'sampling' if isinstance(profiler, StackSampler) else 'cprofile'
+        match = getattr(request, 'resolver_match', None)
+        view = re.sub(r'[^\w-]', '_', (match.url_name or 'view') if match is not None else 'unmatched')
+        name = '%s-%s-%s%s' % (timezone.now().strftime('%Y%m%dT%H%M%S'), view, uuid.uuid4().hex[:8], MODES[mode])
+        directory = config['DIRECTORY']
+        os.makedirs(directory, exist_ok=True)
+        if isinstance(profiler, StackSampler):
+            profiler.dump(os.path.join(directory, name))
+        else:
+            profiler.dump_stats(os.path.join(directory, name))
+        prune_artifacts(directory, config['MAX_ARTIFACTS'])
+        response['X-Profile-Id'] = name
+        response['X-Profile-Duration'] = '%.1fms' % (duration * 1000)
+        return response
+
+
+def list_artifacts(directory):
+    try:
+        names = [name for name in os.listdir(directory) if ARTIFACT_RE.match(name)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def prune_artifacts(directory, keep):
+    for name in list_artifacts(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class ProfileListView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    # Not an /api/ endpoint, and downloads stream a file; see batch.py
+    batchable = False
+
+    # Newest first; download one from /profiles/<name>
+    def get(self, request):
+        directory = get_config()['DIRECTORY']
+        return Response([{'name': name, 'size': os.path.getsize(os.path.join(directory, name))}
+                         for name in list_artifacts(directory)])
+
+
+class ProfileDownloadView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    # Not an /api/ endpoint, and downloads stream a file; see batch.py
+    batchable = False
+
+    def get(self, request, name):
+        path = os.path.join(get_config()['DIRECTORY'], name)
+        if not ARTIFACT_RE.match(name) or not os.path.isfile(path):
+            return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name,
+                            content_type='application/octet-stream')
@@ -0,0 +1,108 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+from .models import Product
+
+VERSION_FIELD = 'updated_at'
+
+# Serializer sources that are model properties rather than columns: the columns the
+# property reads, and a function computing it from their values
+COMPUTED = {
+    (Product, 'rating_average'): (('rating_sum', 'rating_count'), Product.compute_rating_average),
+}
+
+
+# Derives the select_related/prefetch_related plan that matches a serializer tree, so a
+# list of N rows costs a fixed number of queries instead of one per nested relation.
+def get_query_plan(serializer, prefix=''):
+    select_related = []
+    prefetch_related = []
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = prefix + '__'.join(field.source_attrs)
+
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            if isinstance(child, serializers.ModelSerializer):
+                queryset = optimize_queryset(child.Meta.model._default_manager.all(), child)
+                prefetch_related.append(Prefetch(path, queryset=queryset))
+            else:
+                prefetch_related.append(path)
+        elif isinstance(field, serializers.BaseSerializer):
+            select_related.append(path)
+            nested_select, nested_prefetch = get_query_plan(field, prefix=path + '__')
+            select_related.extend(nested_select)
+            prefetch_related.extend(nested_prefetch)
+        elif isinstance(field, ManyRelatedField):
+            prefetch_related.append(path)
+        elif isinstance(field, RelatedField) and not field.use_pk_only_optimization():
+            select_related.append(path)
+
+    return select_related, prefetch_related
+
+
+def get_only_fields(serializer, model, prefix=''):
+    """The columns a serializer tree reads, for only(): its sources, the pk and version
+    column of each row and what COMPUTED properties need. None when some source is
+    neither a column nor in COMPUTED, as deferring could then cost a query per row."""
+    meta = model._meta
+    only = [prefix + meta.pk.name]
+    if any(field.name == VERSION_FIELD for field in meta.concrete_fields):
+        only.append(prefix + VERSION_FIELD)
+
+    for field in serializer.fields.values():
+        if field.write_only or isinstance(field, (serializers.ListSerializer, ManyRelatedField)):
+            # Prefetched by the pk, which is always loaded
+            continue
+        if (model, field.source) in COMPUTED:
+            only.extend(prefix + column for column in COMPUTED[model, field.source][0])
+            continue
+        try:
+            model_field = meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        only.append(prefix + field.source)
+
+        if isinstance(field, serializers.BaseSerializer):
+            nested = get_only_fields(field, model_field.related_model, prefix + field.source + '__')
+            if nested is None:
+                return None
+            only.extend(nested)
+        elif isinstance(field, RelatedField) and not field.use_pk_only_optimization():
+            return None
+    return only
+
+
+# Bounded: sparse serializer classes (serializers.sparse_serializer_class) are one per spec
+@lru_cache(maxsize=1024)
+def _get_class_query_plan(serializer_class):
+    serializer = serializer_class()
+    select_related, prefetch_related = get_query_plan(serializer)
+    only = None
+    if getattr(serializer_class, 'field_spec', None) is not None:
+        # A sparse serializer also leaves the columns it does not output unfetched
+        only = get_only_fields(serializer, serializer_class.Meta.model)
+    return select_related, prefetch_related, only
+
+
+def optimize_queryset(queryset, serializer):
+    only = None
+    if isinstance(serializer, type):
+        select_related, prefetch_related, only = _get_class_query_plan(serializer)
+    else:
+        select_related, prefetch_related = get_query_plan(serializer)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if only:
+        queryset = queryset.only(*only)
+    return queryset
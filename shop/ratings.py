@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import detail_cache
+from .models import Product, Review
+
+
+def apply_rating_delta(product_id, count, total):
+    # A single UPDATE ... SET x = x + n: atomic without locking or reading the row first
+    Product.objects.filter(pk=product_id).update(
+        rating_count=F('rating_count') + count, rating_sum=F('rating_sum') + total, updated_at=timezone.now())
+    detail_cache.invalidate(Product, product_id)
+
+
+def rebuild_rating_aggregates(batch_size=5000):
+    """Recompute rating_count/rating_sum for every product from the Review table.
+
+    Runs one set-based UPDATE per range of product ids, each in its own short
+    transaction. Returns the number of products updated.
+    """
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    count = Subquery(reviews.annotate(count=Count('id')).values('count'))
+    total = Subquery(reviews.annotate(total=Sum('rating')).values('total'))
+
+    updated = 0
+    last_id = 0
+    while True:
+        ids = list(Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return updated
+        with transaction.atomic():
+            updated += Product.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(
+                rating_count=Coalesce(count, 0), rating_sum=Coalesce(total, 0), updated_at=timezone.now())
+            detail_cache.invalidate(Product, *ids)
+        last_id = ids[-1]
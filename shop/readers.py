@@ -0,0 +1,152 @@
+import decimal
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.settings import api_settings
+
+from .metrics import serializer_timer
+from .queryplan import COMPUTED
+from .serializers import ProductSerializer, ReviewSerializer, OrderSerializer, OrderItemSerializer
+
+# Python type the database layer returns for each column type, where DRF's conversion of
+# that type is a no-op (int(int), str(str)) and can be skipped
+COLUMN_TYPES = {
+    'AutoField': int, 'BigAutoField': int, 'SmallAutoField': int, 'IntegerField': int, 'BigIntegerField': int,
+    'SmallIntegerField': int, 'PositiveIntegerField': int, 'PositiveBigIntegerField': int,
+    'PositiveSmallIntegerField': int, 'CharField': str, 'TextField': str,
+}
+SCALAR_TYPES = {serializers.IntegerField: int, serializers.CharField: str, serializers.FloatField: float}
+
+
+def decimal_converter(field):
+    # DecimalField.to_representation, with its quantize context built once instead of per value
+    if (field.decimal_places is None or field.normalize_output or field.localize
+            or not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)):
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+    return convert
+
+
+def converter_for(field, model_field):
+    """The function DRF would apply to a non-null column value for `field`, or None when
+    it returns the value unchanged for what this column's database type yields."""
+    column_type = COLUMN_TYPES.get(model_field.get_internal_type())
+    if type(field) is serializers.ChoiceField:
+        choices = field.choice_strings_to_values
+        if column_type is not None and all(type(key) is column_type for key in choices.values()):
+            return None
+        return lambda value: choices.get(str(value), value)
+    if type(field) is serializers.DecimalField:
+        return decimal_converter(field)
+    scalar = SCALAR_TYPES.get(type(field))
+    if scalar is not None:
+        return None if scalar is column_type else scalar
+    return field.to_representation
+
+
+class ValuesReader:
+    """Read-only twin of a ModelSerializer that serializes values_list() rows.
+
+    A ModelSerializer builds its fields and walks them for every instance it renders. Here
+    that walk happens once: the serializer's fields are compiled into the columns to fetch
+    and a single function turning a row tuple into the output dict, and rows never become
+    model instances. Output is identical to `serializer_class(instances, many=True).data`.
+    Fields with no column equivalent (to-many relations, method fields, dotted sources)
+    raise ImproperlyConfigured when the reader is built, not per request.
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.columns = []
+        # Converters the generated code calls, by name
+        self.namespace = {}
+        source = 'def to_representation(row):\n    return %s\n' % self.compile(serializer_class(), self.model, '')
+        exec(compile(source, '<%s reader>' % serializer_class.__name__, 'exec'), self.namespace)
+        self.to_representation = self.namespace['to_representation']
+
+    def column(self, path):
+        if path not in self.columns:
+            self.columns.append(path)
+        return 'row[%d]' % self.columns.index(path)
+
+    def function(self, func):
+        name = 'f%d' % len(self.namespace)
+        self.namespace[name] = func
+        return name
+
+    def compile(self, serializer, model, prefix):
+        # A dict display over the row, in the serializer's field order
+        items = ['%r: %s' % (field.field_name, self.compile_field(field, model, prefix))
+                 for field in serializer.fields.values() if not field.write_only]
+        return '{%s}' % ', '.join(items)
+
+    def compile_field(self, field, model, prefix):
+        source = field.source
+        name = '%s.%s' % (type(field.parent).__name__, field.field_name)
+        if source == '*' or '.' in source or isinstance(field, (serializers.ListSerializer, ManyRelatedField)):
+            raise ImproperlyConfigured('%s has no values() equivalent' % name)
+
+        if (model, source) in COMPUTED:
+            sources, compute = COMPUTED[model, source]
+            convert = SCALAR_TYPES.get(type(field), field.to_representation)
+
+            def computed(*values):
+                value = compute(*values)
+                return None if value is None else convert(value)
+            return '%s(%s)' % (self.function(computed), ', '.join(self.column(prefix + column) for column in sources))
+
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured('%s reads %s.%s, which is not a column; add it to COMPUTED' % (
+                name, model.__name__, source))
+        value = self.column(prefix + source)
+
+        if isinstance(field, serializers.BaseSerializer):
+            # A nested object: None when the foreign key is, else its own fields
+            nested = self.compile(field, model_field.related_model, prefix + source + '__')
+            return '(None if %s is None else %s)' % (value, nested)
+        if isinstance(field, RelatedField):
+            if not isinstance(field, PrimaryKeyRelatedField) or field.pk_field is not None:
+                raise ImproperlyConfigured('%s has no values() equivalent' % name)
+            # The foreign key column is the related object's pk
+            return value
+
+        convert = converter_for(field, model_field)
+        if convert is None:
+            return value
+        return '(None if %s is None else %s(%s))' % (value, self.function(convert), value)
+
+    def queryset(self, queryset, extra=()):
+        """`queryset` as named rows of the columns this reader needs, plus `extra` ones
+        (e.g. the keyset pagination ordering); select_related() etc. no longer apply."""
+        columns = self.columns + [column for column in extra if column not in self.columns]
+        return queryset.select_related(None).prefetch_related(None).values_list(*columns, named=True)
+
+    def serialize(self, rows):
+        with serializer_timer():
+            return list(map(self.to_representation, rows))
+
+
+# One reader per serializer class, sparse ones (serializers.sparse_serializer_class) included
+@lru_cache(maxsize=256)
+def get_reader(serializer_class):
+    return ValuesReader(serializer_class)
+
+
+product_reader = get_reader(ProductSerializer)
+review_reader = get_reader(ReviewSerializer)
+order_reader = get_reader(OrderSerializer)
+order_item_reader = get_reader(OrderItemSerializer)
@@ -0,0 +1,55 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    # Optional: without it everything below takes the stdlib json path
+    orjson = None
+
+# Datetimes go through the encoder's default() so they keep DRF's/Django's format
+# (milliseconds, "Z") rather than orjson's own
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME if orjson is not None else 0
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding through orjson when it is installed.
+
+    Produces the same bytes as JSONRenderer with the default (compact, unicode, strict)
+    settings: Decimal, datetime, lazy strings and the rest go through the same
+    encoder's default(). Anything orjson rejects (non-string keys, integers beyond 64
+    bits, unknown types) and indented output are handed to JSONRenderer itself. orjson
+    writes NaN and infinities as null where JSONRenderer raises.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer too: valid JSON, but they end string literals in JavaScript
+        for character, escape in LINE_SEPARATORS:
+            if character in ret:
+                ret = ret.replace(character, escape)
+        return ret
+
+
+def dumps(data):
+    """Compact UTF-8 JSON bytes, encoding values the way DjangoJSONEncoder does (used for
+    NDJSON export lines)."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_django_default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass
+    return _django_encoder.encode(data).encode('utf-8')
+
+
+_django_encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+_django_default = _django_encoder.default
+
@@ -0,0 +1,122 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_config():
+    config = {'REPLICAS': [], 'STICKY_SECONDS': 5, 'COOKIE': 'shop_primary'}
+    config.update(getattr(settings, 'SHOP_DATABASE_ROUTING', {}))
+    return config
+
+
+# Whether reads may go to a replica. Off unless ReplicaRoutingMiddleware turns it on for a
+# safe request, so management commands, job workers and writes always read the primary.
+replica_reads = ContextVar('shop_replica_reads', default=False)
+
+
+@contextmanager
+def primary_reads():
+    # Reads whose result outlives the request (e.g. cached payloads) must not be stale
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Writes go to the primary ('default'); reads in safe requests go to a random replica
+    from SHOP_DATABASE_ROUTING['REPLICAS']. Replicas get their schema and rows from the
+    primary by replication, never from migrate."""
+
+    def db_for_read(self, model, **hints):
+        if replica_reads.get():
+            replicas = get_config()['REPLICAS']
+            if replicas:
+                return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every replica holds the primary's data, so objects read from any of them may relate
+        databases = {DEFAULT_DB_ALIAS, *get_config()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_config()['REPLICAS']:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Lets safe requests read from replicas, with read-your-writes stickiness.
+
+    After a POST/PUT/PATCH/DELETE the client is pinned to the primary for STICKY_SECONDS
+    (the replication lag budget): by cookie, and for token clients that send no cookies,
+    by their Authorization header. Does nothing when no replica is configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def pin_key(self, request):
+        header = request.META.get('HTTP_AUTHORIZATION')
+        if not header:
+            return None
+        return 'shop:primary-pin:%s' % hashlib.sha256(header.encode('utf-8')).hexdigest()
+
+    def may_use_replica(self, request, config):
+        if not config['REPLICAS'] or request.method not in SAFE_METHODS:
+            return False
+        if config['COOKIE'] in request.COOKIES:
+            return False
+        key = self.pin_key(request)
+        return key is None or not cache.get(key)
+
+    def pin(self, request, response, config):
+        if not config['REPLICAS'] or request.method in SAFE_METHODS:
+            return
+        response.set_cookie(config['COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        key = self.pin_key(request)
+        if key is not None:
+            cache.set(key, True, config['STICKY_SECONDS'])
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = get_config()
+        token = replica_reads.set(self.may_use_replica(request, config))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        self.pin(request, response, config)
+        return response
+
+    async def __acall__(self, request):
+        config = get_config()
+        token = replica_reads.set(self.may_use_replica(request, config))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        self.pin(request, response, config)
+        return response
@@ -0,0 +1,121 @@
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'shop_product_fts'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class BaseSearchEngine:
+    """Keyword search over Product.name/description.
+
+    Engines only narrow a queryset, so they compose with filters, ordering and
+    keyset pagination. Select one with SHOP_SEARCH_ENGINE (a dotted path).
+    """
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def tokenize(self, query):
+        return TOKEN_RE.findall(query)
+
+
+class SimpleSearchEngine(BaseSearchEngine):
+    # Index-free fallback for backends without a full-text engine
+    def search(self, queryset, query):
+        for token in self.tokenize(query):
+            queryset = queryset.filter(Q(name__icontains=token) | Q(description__icontains=token))
+        return queryset
+
+
+class SQLiteFTS5SearchEngine(BaseSearchEngine):
+    # Backed by the external-content FTS5 table created in migration 0004
+    def search(self, queryset, query):
+        tokens = self.tokenize(query)
+        if not tokens:
+            return queryset
+        # Every token quoted (no FTS syntax from the client) and prefix-matched
+        match = ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+        return queryset.filter(pk__in=RawSQL('SELECT rowid FROM %s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE),
+                                             [match]))
+
+
+class PostgresSearchEngine(BaseSearchEngine):
+    # Backed by the GIN expression index created in migration 0004
+    config = 'simple'
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+
+        tokens = self.tokenize(query)
+        if not tokens:
+            return queryset
+        vector = SearchVector('name', 'description', config=self.config)
+        return queryset.annotate(search=vector).filter(
+            search=SearchQuery(' & '.join('%s:*' % token for token in tokens), config=self.config,
+                               search_type='raw'))
+
+
+def get_search_engine():
+    path = getattr(settings, 'SHOP_SEARCH_ENGINE', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5SearchEngine()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchEngine()
+    return SimpleSearchEngine()
+
+
+# Schema for the engines, as migration 0004 creates it (the migrations keep their own
+# copy). Idempotent, so deferred_search_index() can drop part of it and reinstall all of it.
+
+SQLITE_FTS_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {t} USING fts5("
+    "name, description, content='shop_product', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS {t}_ai AFTER INSERT ON shop_product BEGIN "
+    "INSERT INTO {t}(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS {t}_ad AFTER DELETE ON shop_product BEGIN "
+    "INSERT INTO {t}({t}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); END",
+    # Only text edits touch the index, stock and price updates do not
+    "CREATE TRIGGER IF NOT EXISTS {t}_au AFTER UPDATE OF name, description ON shop_product BEGIN "
+    "INSERT INTO {t}({t}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO {t}(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+SQLITE_FTS_REBUILD_SQL = "INSERT INTO {t}({t}) VALUES ('rebuild')"
+
+POSTGRES_FTS_SQL = [
+    "CREATE INDEX IF NOT EXISTS shop_product_search_idx ON shop_product USING gin "
+    "((to_tsvector('simple'::regconfig, COALESCE(name, '') || ' ' || COALESCE(description, ''))))",
+]
+
+
+def search_index_sql(vendor, rebuild=True):
+    statements = {'sqlite': SQLITE_FTS_SQL, 'postgresql': POSTGRES_FTS_SQL}.get(vendor, [])
+    if vendor == 'sqlite' and rebuild:
+        statements = statements + [SQLITE_FTS_REBUILD_SQL]
+    return [statement.format(t=FTS_TABLE) for statement in statements]
+
+
+@contextmanager
+def deferred_search_index():
+    """For bulk loads: stop maintaining the index row by row and build it once at the end,
+    which is several times cheaper than the per-row trigger or GIN insert."""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute('DROP TRIGGER IF EXISTS %s_ai' % FTS_TABLE)
+        elif vendor == 'postgresql':
+            cursor.execute('DROP INDEX IF EXISTS shop_product_search_idx')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for statement in search_index_sql(vendor):
+                cursor.execute(statement)
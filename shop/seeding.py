@@ -0,0 +1,354 @@
+import bisect
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import User, Shop, Shopkeeper, Customer, ShopAssignment, Product, Review, Order, OrderItem
+from .ratings import rebuild_rating_aggregates
+from .search import deferred_search_index
+
+# Row counts per preset; orders get 1..items_per_order items from their shop
+SCALES = {
+    'tiny': {'shops': 3, 'shopkeepers': 6, 'customers': 20, 'products': 100, 'orders': 50,
+             'items_per_order': 3, 'reviews': 100},
+    'small': {'shops': 20, 'shopkeepers': 40, 'customers': 500, 'products': 5000, 'orders': 2000,
+              'items_per_order': 3, 'reviews': 5000},
+    'medium': {'shops': 200, 'shopkeepers': 400, 'customers': 10000, 'products': 100000, 'orders': 50000,
+               'items_per_order': 4, 'reviews': 100000},
+    'large': {'shops': 2000, 'shopkeepers': 5000, 'customers': 200000, 'products': 1000000,
+              'orders': 1000000, 'items_per_order': 4, 'reviews': 2000000},
+    'xlarge': {'shops': 20000, 'shopkeepers': 50000, 'customers': 2000000, 'products': 10000000,
+               'orders': 10000000, 'items_per_order': 4, 'reviews': 20000000},
+}
+
+SEED_PASSWORD = 'seed-password'
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+
+WORDS = ['red', 'blue', 'green', 'classic', 'organic', 'steel', 'wooden', 'mini', 'deluxe', 'travel',
+         'mug', 'kettle', 'lamp', 'chair', 'notebook', 'pen', 'shirt', 'bottle', 'basket', 'candle']
+ORDER_STATUSES = (['pending', 'confirmed', 'shipped', 'delivered'], [10, 10, 20, 60])
+RATINGS = ([1, 2, 3, 4, 5], [5, 5, 15, 35, 40])
+
+
+def zipf_index(n, skew, u):
+    """Map a uniform u in [0, 1) to an index in [0, n) with P(k) roughly proportional to
+    1 / (k + 1) ** skew, by inverting the continuous power-law CDF (O(1), no tables)."""
+    if n <= 1:
+        return 0
+    if skew == 0:
+        return int(u * n)
+    if abs(skew - 1) < 1e-9:
+        x = (n + 1) ** u
+    else:
+        a = 1 - skew
+        x = (((n + 1) ** a - 1) * u + 1) ** (1 / a)
+    return min(n - 1, int(x) - 1)
+
+
+def product_price(seed, product_id):
+    # A pure function of the id, so order items can be priced without reading products back
+    h = (product_id * 0x9E3779B1 + seed * 0x85EBCA77) & 0xFFFFFFFF
+    h = ((h ^ (h >> 15)) * 0x2C1B3C6D) & 0xFFFFFFFF
+    return Decimal(100 + (h ^ (h >> 12)) % 49900) / 100
+
+
+class SeedPlan:
+    """Everything a worker needs to generate any chunk of any table on its own.
+
+    Ids are explicit and contiguous, starting after the current maximum of each table,
+    so rows can reference each other without reading anything back. Each chunk draws
+    from its own RNG seeded with (seed, table, chunk), so the data only depends on the
+    seed, counts and batch size, never on how many workers produced it.
+    """
+
+    def __init__(self, counts, seed, skew, batch_size, password_hash, offsets):
+        self.counts = counts
+        self.seed = seed
+        self.skew = skew
+        self.batch_size = batch_size
+        self.password_hash = password_hash
+        self.offsets = offsets
+        # Every row gets the same timestamp, adapted for the backend once since rows skip the ORM
+        self.now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        # Hot shops first: shop k holds a share of the catalog proportional to 1 / (k + 1) ** skew,
+        # as one contiguous range of product ids, and sells in the same proportion
+        shops, products = counts['shops'], counts['products']
+        weights = [1 / (k + 1) ** skew for k in range(shops)]
+        total = sum(weights)
+        sizes = [1 if k < products else 0 for k in range(shops)]
+        spare = products - sum(sizes)
+        for k in range(shops):
+            sizes[k] += int(spare * weights[k] / total)
+        sizes[0] += products - sum(sizes)
+        self.catalog_starts = []
+        start = 0
+        for size in sizes:
+            self.catalog_starts.append(start)
+            start += size
+        self.catalog_sizes = sizes
+        self.stocked_shops = sum(1 for size in sizes if size)
+
+    def random(self, table, chunk):
+        return random.Random('%s:%s:%s' % (self.seed, table, chunk))
+
+    def words(self, rng, count):
+        return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+    # Id layout
+
+    def user_id(self, index):
+        return self.offsets[User] + index + 1
+
+    def shopkeeper_id(self, index):
+        return self.offsets[Shopkeeper] + index + 1
+
+    def customer_id(self, index):
+        return self.offsets[Customer] + index + 1
+
+    def shop_id(self, index):
+        return self.offsets[Shop] + index + 1
+
+    def product_id(self, index):
+        return self.offsets[Product] + index + 1
+
+    def order_id(self, index):
+        return self.offsets[Order] + index + 1
+
+    def staff_member(self, shop, n):
+        # Shopkeeper k works at shop k % shops (see assignments); shops without staff fall back to the owner
+        shops, shopkeepers = self.counts['shops'], self.counts['shopkeepers']
+        staff = len(range(shop, shopkeepers, shops))
+        if not staff:
+            return shop % shopkeepers
+        return shop + shops * (n % staff)
+
+    def pick_product(self, rng):
+        # Popular products of popular shops
+        shop = zipf_index(self.stocked_shops, self.skew, rng.random())
+        rank = zipf_index(self.catalog_sizes[shop], self.skew, rng.random())
+        return shop, rank
+
+    # Row generators: each returns {model: (fields, rows)} for one chunk
+
+    def users(self, chunk, start, stop):
+        shopkeepers = self.counts['shopkeepers']
+        rows = []
+        for i in range(start, stop):
+            user_id = self.user_id(i)
+            role, number = (User.SHOPKEEPER, i) if i < shopkeepers else (User.CUSTOMER, i - shopkeepers)
+            rows.append((user_id, self.password_hash, '%s %d' % (role.title(), number),
+                         '%s%d@%s' % (role, user_id, SEED_EMAIL_DOMAIN), role, self.now, False, True, False, False,
+                         self.now))
+        fields = ['id', 'password', 'name', 'email', 'role', 'date_joined', 'is_admin', 'is_active', 'is_staff',
+                  'is_superuser', 'updated_at']
+        return {User: (fields, rows)}
+
+    def shopkeepers(self, chunk, start, stop):
+        rows = [(self.shopkeeper_id(i), self.user_id(i), 'TIN%08d' % i, 'NID%08d' % i, 'approved', self.now)
+                for i in range(start, stop)]
+        return {Shopkeeper: (['id', 'user', 'TIN', 'NID', 'approval_status', 'updated_at'], rows)}
+
+    def customers(self, chunk, start, stop):
+        offset = self.counts['shopkeepers']
+        rows = [(self.customer_id(i), self.user_id(offset + i), 'approved', self.now) for i in range(start, stop)]
+        return {Customer: (['id', 'user', 'approval_status', 'updated_at'], rows)}
+
+    def shops(self, chunk, start, stop):
+        shopkeepers = self.counts['shopkeepers']
+        rows = [(self.shop_id(i), 'Shop %d' % i, '%d Market Street' % i, self.shopkeeper_id(i % shopkeepers),
+                 'active', self.now) for i in range(start, stop)]
+        return {Shop: (['id', 'name', 'address', 'owner', 'status', 'updated_at'], rows)}
+
+    def assignments(self, chunk, start, stop):
+        shops = self.counts['shops']
+        rows = [(self.shop_id(i % shops), self.shopkeeper_id(i), self.now) for i in range(start, stop)]
+        return {ShopAssignment: (['shop', 'shopkeeper', 'assigned_at'], rows)}
+
+    def products(self, chunk, start, stop):
+        rng = self.random('products', chunk)
+        shop = bisect.bisect_right(self.catalog_starts, start) - 1
+        rows = []
+        for i in range(start, stop):
+            while i >= self.catalog_starts[shop] + self.catalog_sizes[shop]:
+                shop += 1
+            product_id = self.product_id(i)
+            rows.append((product_id, '%s %d' % (self.words(rng, 2).title(), i), self.words(rng, 8),
+                         product_price(self.seed, product_id), rng.randint(0, 500), self.shop_id(shop),
+                         self.shopkeeper_id(self.staff_member(shop, i)), 0, 0, self.now))
+        fields = ['id', 'name', 'description', 'price', 'stock_quantity', 'shop', 'added_by', 'rating_count',
+                  'rating_sum', 'updated_at']
+        return {Product: (fields, rows)}
+
+    def orders(self, chunk, start, stop):
+        rng = self.random('orders', chunk)
+        customers, per_order = self.counts['customers'], self.counts['items_per_order']
+        orders, items = [], []
+        for i in range(start, stop):
+            order_id = self.order_id(i)
+            shop, rank = self.pick_product(rng)
+            size = self.catalog_sizes[shop]
+            total = Decimal(0)
+            # Distinct products: the picked one and the ones ranked just after it
+            for n in range(min(size, rng.randint(1, per_order))):
+                product_id = self.product_id(self.catalog_starts[shop] + (rank + n) % size)
+                price, quantity = product_price(self.seed, product_id), rng.randint(1, 3)
+                total += price * quantity
+                items.append((order_id, product_id, quantity, price, self.now))
+            orders.append((order_id, self.customer_id(rng.randrange(customers)), self.shop_id(shop), total,
+                           rng.choices(*ORDER_STATUSES)[0], self.now))
+        return {
+            Order: (['id', 'customer', 'shop', 'total_price', 'status', 'updated_at'], orders),
+            OrderItem: (['order', 'product', 'quantity', 'price', 'updated_at'], items),
+        }
+
+    def reviews(self, chunk, start, stop):
+        rng = self.random('reviews', chunk)
+        customers = self.counts['customers']
+        rows = []
+        for _ in range(start, stop):
+            shop, rank = self.pick_product(rng)
+            rows.append((rng.choices(*RATINGS)[0], self.words(rng, 6),
+                         self.product_id(self.catalog_starts[shop] + rank),
+                         self.customer_id(rng.randrange(customers)), self.now))
+        return {Review: (['rating', 'comment', 'product', 'customer', 'updated_at'], rows)}
+
+    # (table, number of rows) in dependency order
+    def stages(self):
+        counts = self.counts
+        return [
+            ('users', counts['shopkeepers'] + counts['customers']),
+            ('shopkeepers', counts['shopkeepers']),
+            ('customers', counts['customers']),
+            ('shops', counts['shops']),
+            ('assignments', counts['shopkeepers']),
+            ('products', counts['products']),
+            ('orders', counts['orders']),
+            ('reviews', counts['reviews']),
+        ]
+
+    def chunks(self, total):
+        return [(chunk, start, min(start + self.batch_size, total))
+                for chunk, start in enumerate(range(0, total, self.batch_size))]
+
+
+def insert_rows(model, fields, rows):
+    # Plain executemany: no model instances, no signals (aggregates are rebuilt at the end)
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name).column for name in fields]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        quote(model._meta.db_table), ', '.join(quote(column) for column in columns), ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+_plan = None
+
+
+def _init_worker(plan, database_name):
+    global _plan
+    import django
+    django.setup()
+    connections['default'].settings_dict['NAME'] = database_name
+    _plan = plan
+
+
+def seed_chunk(table, chunk, start, stop, plan=None):
+    plan = plan or _plan
+    generated = getattr(plan, table)(chunk, start, stop)
+    with transaction.atomic():
+        for model, (fields, rows) in generated.items():
+            insert_rows(model, fields, rows)
+    return stop - start
+
+
+class Seeder:
+    """Deterministic synthetic data for benchmarks and load tests, at up to tens of millions of rows.
+
+    Rows are generated in chunks of `batch_size` and written with executemany, one
+    transaction per chunk, optionally by several worker processes per table. Every user
+    shares one password hashed once up front. Popularity is skewed: a few shops hold most
+    of the catalog and take most orders, and within a shop a few products get most of the
+    orders and reviews.
+    """
+
+    def __init__(self, counts, seed=0, batch_size=5000, password=SEED_PASSWORD, skew=1.1, workers=1, stdout=None):
+        self.counts = dict(counts)
+        self.seed = seed
+        self.batch_size = batch_size
+        self.password = password
+        self.skew = skew
+        self.workers = workers
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def make_plan(self):
+        offsets = {}
+        for model in (User, Shopkeeper, Customer, Shop, Product, Order):
+            offsets[model] = model.objects.aggregate(top=Max('pk'))['top'] or 0
+        return SeedPlan(self.counts, self.seed, self.skew, self.batch_size, make_password(self.password), offsets)
+
+    def run(self):
+        plan = self.make_plan()
+        executor = None
+        if self.workers > 1:
+            # Children open their own connections; none may be inherited mid-use
+            connections.close_all()
+            executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                           initargs=(plan, connection.settings_dict['NAME']))
+        try:
+            for table, total in plan.stages():
+                started = time.perf_counter()
+                if table == 'products':
+                    with deferred_search_index():
+                        self.run_stage(executor, plan, table, total)
+                else:
+                    self.run_stage(executor, plan, table, total)
+                elapsed = time.perf_counter() - started
+                self.log('%s: %d rows in %.1fs (%d rows/s)' % (table, total, elapsed, total / elapsed if elapsed else 0))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.reset_sequences()
+        started = time.perf_counter()
+        # Raw inserts skip the Review signals, so the aggregates are computed once at the end
+        rebuild_rating_aggregates()
+        self.log('rating aggregates: %.1fs' % (time.perf_counter() - started))
+        return self.counts
+
+    def run_stage(self, executor, plan, table, total):
+        chunks = plan.chunks(total)
+        if executor is None:
+            for chunk in chunks:
+                seed_chunk(table, *chunk, plan=plan)
+        elif chunks:
+            list(executor.map(seed_chunk, *zip(*[(table,) + chunk for chunk in chunks])))
+
+    def reset_sequences(self):
+        # Explicit ids leave PostgreSQL's sequences behind; SQLite's rowid allocation needs nothing
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Shopkeeper, Customer, Shop, Product, Order])
+        if statements:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+
+def default_workers():
+    # SQLite has a single writer, so extra processes only help generation, not inserts
+    if connection.vendor == 'sqlite':
+        return 1
+    return os.cpu_count() or 1
@@ -1,15 +1,196 @@
+from functools import lru_cache
+
 from django.db import IntegrityError
 from rest_framework import serializers
-from .models import User, Shopkeeper, Customer, Shop, Product, Review, Order, OrderItem, ShopAssignment
-
-
-class LoginSerializer(serializers.ModelSerializer):
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from .authentication import ClaimsRefreshToken, add_claims, user_claims
+from .batch import get_config as get_batch_config, resolve_view
+from .metrics import serializer_timer
+from .models import User, Shopkeeper, Customer, Shop, Product, Review, Order, OrderItem, ShopAssignment, Job
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _parse_paths(value):
+    # "id,product.name,product.price" -> {'id': {}, 'product': {'name': {}, 'price': {}}}
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def _leaf_paths(tree, prefix=''):
+    # {'a': {'b': {}, 'c': {}}} -> ['a.b', 'a.c']
+    paths = []
+    for name, subtree in tree.items():
+        paths.extend(_leaf_paths(subtree, prefix + name + '.') if subtree else [prefix + name])
+    return paths
+
+
+def _canonical(tree):
+    return ','.join(name + ('(%s)' % _canonical(tree[name]) if tree[name] else '') for name in sorted(tree))
+
+
+# Sparse fieldsets: ?fields= names the fields a response carries (dotted for those of a
+# nested object) and ?expand= the relations it embeds; any relation not expanded is given
+# as its primary key. Without ?expand= every relation stays embedded as declared.
+class FieldSpec:
+
+    def __init__(self, fields=None, expand=None, prefix=''):
+        # None: all fields / the declared nesting
+        self.fields = fields or None
+        self.expand = expand
+        self.prefix = prefix
+        self.key = (None if self.fields is None else _canonical(self.fields),
+                    None if expand is None else _canonical(expand))
+
+    def __eq__(self, other):
+        return isinstance(other, FieldSpec) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return '%s=%s&%s=%s' % (FIELDS_PARAM, self.key[0] or '', EXPAND_PARAM, self.key[1] or '')
+
+    @classmethod
+    def from_request(cls, request):
+        # Only responses are trimmed: a write still validates against every field
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        fields = request.query_params.get(FIELDS_PARAM)
+        expand = request.query_params.get(EXPAND_PARAM)
+        if fields is None and expand is None:
+            return None
+        return cls(None if fields is None else _parse_paths(fields),
+                   None if expand is None else _parse_paths(expand))
+
+    def expands(self, name):
+        # Asking for a relation's own fields expands it too
+        return self.expand is None or name in self.expand or bool(self.fields and self.fields.get(name))
+
+    def child(self, name):
+        fields = self.fields.get(name) if self.fields else None
+        expand = None if self.expand is None else self.expand.get(name, {})
+        if not fields and expand is None:
+            return None
+        return FieldSpec(fields, expand, self.prefix + name + '.')
+
+    def apply(self, fields):
+        """Trims a serializer's fields, replacing relations that are not expanded with
+        their primary key and handing nested serializers their part of the spec."""
+        errors = {}
+        if self.fields is not None:
+            unknown = [name for name in self.fields if name not in fields or fields[name].write_only]
+            for name, subtree in self.fields.items():
+                # Dotted paths under a field with no fields of its own (a plain field or a pk)
+                if subtree and name not in unknown and not isinstance(
+                        getattr(fields[name], 'child', fields[name]), serializers.BaseSerializer):
+                    unknown += [name + '.' + path for path in _leaf_paths(subtree)]
+            if unknown:
+                errors[FIELDS_PARAM] = ['Unknown field "%s%s".' % (self.prefix, name) for name in unknown]
+        if self.expand:
+            unknown = [name for name in self.expand
+                       if not isinstance(fields.get(name), serializers.BaseSerializer)]
+            if unknown:
+                errors[EXPAND_PARAM] = ['Cannot expand "%s%s".' % (self.prefix, name) for name in unknown]
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        if self.fields is not None:
+            fields = {name: field for name, field in fields.items() if name in self.fields}
+
+        for name, field in fields.items():
+            many = isinstance(field, serializers.ListSerializer)
+            serializer = field.child if many else field
+            if not isinstance(serializer, serializers.BaseSerializer):
+                continue
+            if self.expands(name):
+                serializer.field_spec = self.child(name)
+            else:
+                kwargs = {'source': field.source} if field.source else {}
+                fields[name] = serializers.PrimaryKeyRelatedField(many=many, read_only=True, **kwargs)
+        return fields
+
+
+class TimedListSerializer(serializers.ListSerializer):
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
+
+class TimedSerializerMixin:
+    """Adds producing a serializer's output (its `.data`, also as a list) to the request's
+    serializer time (see metrics.py). Nested serializers call to_representation directly,
+    so only the top level is timed."""
+
+    @property
+    def data(self):
+        with serializer_timer():
+            return super().data
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        serializer = super().many_init(*args, **kwargs)
+        # DRF's default list class, unless Meta.list_serializer_class names another;
+        # TimedListSerializer only adds the timing
+        if type(serializer) is serializers.ListSerializer:
+            serializer.__class__ = TimedListSerializer
+        return serializer
+
+
+# The base of every shop ModelSerializer, and so of every response the API serializes
+class SparseFieldsMixin(TimedSerializerMixin):
+    # Set on the classes sparse_serializer_class() returns, and by a parent on the
+    # serializers it nests
+    field_spec = None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.field_spec is None:
+            return fields
+        return self.field_spec.apply(fields)
+
+
+@lru_cache(maxsize=1024)
+def _sparse_class(serializer_class, spec):
+    return type(serializer_class.__name__, (serializer_class,), {'field_spec': spec})
+
+
+def sparse_serializer_class(serializer_class, request):
+    """`serializer_class` trimmed to the request's ?fields= and ?expand=. It is one class
+    per distinct spec, so query plans, validators and readers cache per spec too."""
+    spec = FieldSpec.from_request(request)
+    if spec is None:
+        return serializer_class
+    return _sparse_class(serializer_class, spec)
+
+
+class LoginSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = User
         fields = ["id", "email", "password"]
 
 
+# Tokens carry the user's role and shopkeeper/customer/shop ids (see authentication.py)
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+
+    @classmethod
+    def get_token(cls, user):
+        return add_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+
 # class UserSerializer(serializers.ModelSerializer):
 #     class Meta:
 #         model = User
@@ -21,7 +202,7 @@ class LoginSerializer(serializers.ModelSerializer):
 #         user.save()
 #         return user
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'name', 'password', 'role']
@@ -46,7 +227,7 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class ShopkeeperSerializer(serializers.ModelSerializer):
+class ShopkeeperSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Accept email directly instead of the entire user object
     email = serializers.EmailField(write_only=True)
 
@@ -106,7 +287,7 @@ class ShopkeeperSerializer(serializers.ModelSerializer):
     #     return shopkeeper
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     email = serializers.EmailField(write_only=True)
 
     class Meta:
@@ -154,13 +335,27 @@ class CustomerSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ShopAssignmentSerializer(serializers.ModelSerializer):
+class ShopAssignmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ShopAssignment
         fields =['shop', 'shopkeeper', 'assigned_at']
 
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopAssignmentSetSerializer(serializers.Serializer):
+    shop = serializers.IntegerField()
+    shopkeeper_ids = serializers.ListField(child=serializers.IntegerField(), max_length=1000)
+
+
+class ShopAssignmentBatchSerializer(serializers.Serializer):
+    shops = ShopAssignmentSetSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_shops(self, shops):
+        if len({item['shop'] for item in shops}) != len(shops):
+            raise serializers.ValidationError('Each shop may appear only once.')
+        return shops
+
+
+class ShopSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=Shopkeeper.objects.all())
     shopkeepers = ShopAssignmentSerializer(source='shopassignment_set', many=True, read_only=True)
 
@@ -169,23 +364,28 @@ class ShopSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'address', 'owner', 'status', 'shopkeepers']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     added_by = ShopkeeperSerializer(read_only=True)
     price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    rating_average = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock_quantity', 'shop', 'added_by']
+        fields = ['id', 'name', 'description', 'price', 'stock_quantity', 'shop', 'added_by',
+                  'rating_count', 'rating_average']
+        read_only_fields = ['rating_count']
 
     def create(self, validated_data):
         # Assign the shopkeeper to the product
         request = self.context.get('request')
-        shopkeeper = Shopkeeper.objects.get(user=request.user)
-        product = Product.objects.create(added_by=shopkeeper, **validated_data)
+        shopkeeper_id = user_claims(request.user)['shopkeeper_id']
+        if shopkeeper_id is None:
+            raise serializers.ValidationError({'error': 'Shopkeeper not found'})
+        product = Product.objects.create(added_by_id=shopkeeper_id, **validated_data)
         return product
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
 
     class Meta:
@@ -193,7 +393,7 @@ class ReviewSerializer(serializers.ModelSerializer):
         fields = ['id', 'rating', 'comment', 'product', 'customer']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
 
     class Meta:
@@ -201,10 +401,63 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['id', 'customer', 'shop', 'total_price', 'status']
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     order = OrderSerializer(read_only=True)
 
     class Meta:
         model = OrderItem
         fields = ['id', 'order', 'product', 'quantity', 'price']
+
+
+class CheckoutItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class CheckoutSerializer(serializers.Serializer):
+    shop = serializers.IntegerField()
+    items = CheckoutItemSerializer(many=True, allow_empty=False)
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=10000)
+
+
+class BatchItemSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
+
+    def validate(self, data):
+        path, _, query = data['path'].partition('?')
+        match = resolve_view(path)
+        if match is None:
+            raise serializers.ValidationError({'path': ['"%s" is not an API endpoint a batch can call.' % path]})
+        return dict(data, path=path, query=query, match=match)
+
+
+class BatchSerializer(serializers.Serializer):
+    atomic = serializers.BooleanField(default=False)
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Checked before any item is validated; read per request so it follows settings
+        fields['requests'].max_length = get_batch_config()['MAX_REQUESTS']
+        return fields
+
+
+class JobSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # The exception message only; the traceback stays in the table for operators
+    error = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'status', 'attempts', 'max_attempts', 'result', 'error', 'created_at',
+                  'finished_at']
+
+    def get_error(self, job):
+        lines = job.last_error.strip().splitlines()
+        return lines[-1] if lines else None
@@ -0,0 +1,109 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .assignments import assignments_changed, batch_in_progress
+from .authentication import revocations
+from .cache import detail_cache
+from .metrics import install_query_recorder
+from .models import User, Shop, Shopkeeper, Customer, Product, ShopAssignment, Review
+from .ratings import apply_rating_delta
+
+
+# Detail cache invalidation. Anything embedded in a cached payload must drop that payload
+# when it changes: products embed their shopkeeper, shops embed their assignments.
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    detail_cache.invalidate(Product, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def invalidate_shop(sender, instance, **kwargs):
+    detail_cache.invalidate(Shop, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ShopAssignment)
+def invalidate_assignment(sender, instance, **kwargs):
+    # Also revokes the shopkeeper's token claims; batches do all of this once (assignments.py)
+    if not batch_in_progress.get():
+        assignments_changed([instance.shop_id], [instance.shopkeeper_id])
+
+
+@receiver([post_save, post_delete], sender=Shopkeeper)
+def invalidate_shopkeeper(sender, instance, **kwargs):
+    product_ids = Product.objects.filter(added_by_id=instance.pk).values_list('id', flat=True)
+    detail_cache.invalidate(Product, *product_ids)
+
+
+# Token claims (see authentication.py). Changing anything a token carries, or whether the
+# user may sign in at all, revokes the claims of the user's existing tokens. Bulk
+# QuerySet.update() calls bypass these and must call revocations.revoke() themselves.
+
+@receiver(post_save, sender=User)
+def revoke_user_on_save(sender, instance, created, **kwargs):
+    # A new user has no tokens yet
+    if not created:
+        revocations.revoke(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_user_on_delete(sender, instance, **kwargs):
+    revocations.revoke(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Shopkeeper)
+@receiver([post_save, post_delete], sender=Customer)
+def revoke_profile(sender, instance, **kwargs):
+    revocations.revoke(instance.user_id)
+
+
+# Product rating aggregates follow every review write incrementally. The delta is taken
+# against the stored row, locked until the write commits (Review.save() and deletes run
+# in a transaction), so concurrent writes to one review apply their deltas one after another.
+
+def locked_rating(review, using):
+    # (product_id, rating) as stored, or None when the row does not exist (any more)
+    return Review.objects.using(using).select_for_update().filter(pk=review.pk).values_list(
+        'product_id', 'rating').first()
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, using, **kwargs):
+    instance._previous_rating = None
+    if instance.pk is not None:
+        instance._previous_rating = locked_rating(instance, using)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        apply_rating_delta(instance.product_id, 1, instance.rating)
+        return
+    previous_product_id, previous_rating = previous
+    if previous_product_id != instance.product_id:
+        apply_rating_delta(previous_product_id, -1, -previous_rating)
+        apply_rating_delta(instance.product_id, 1, instance.rating)
+    elif previous_rating != instance.rating:
+        apply_rating_delta(instance.product_id, 0, instance.rating - previous_rating)
+
+
+@receiver(pre_delete, sender=Review)
+def remember_deleted_rating(sender, instance, using, **kwargs):
+    instance._previous_rating = locked_rating(instance, using)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    # Nothing to take back when a concurrent delete got there first
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is not None:
+        apply_rating_delta(previous[0], -1, -previous[1])
+
+
+# Per-request query metrics (see metrics.py) come from a wrapper on every connection.
+
+@receiver(connection_created)
+def record_queries(sender, connection, **kwargs):
+    install_query_recorder(connection)
@@ -0,0 +1,20 @@
+from django.db import transaction
+
+from .jobs import task
+from .models import Product
+from .ratings import rebuild_rating_aggregates
+
+
+# Jobs run by the queue in shop/jobs.py; the keyword arguments are the job's JSON payload.
+
+@task('products.bulk_delete')
+def bulk_delete_products(ids):
+    # Deleting cascades to reviews and order items, whose signals run per row
+    with transaction.atomic():
+        _, deleted = Product.objects.filter(id__in=ids).delete()
+    return {'deleted': deleted.get(Product._meta.label, 0)}
+
+
+@task('ratings.rebuild')
+def rebuild_ratings(batch_size=5000):
+    return {'updated': rebuild_rating_aggregates(batch_size=batch_size)}
@@ -1,3 +1,1658 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.db.models import Count, Sum
+from django.core.signals import request_finished
+from django.http import FileResponse, HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import ClaimsJWTAuthentication, check_revocation_cache, revocations
+from .benchmark import Fixtures, Runner, compare, get_scenarios
+from .cache import detail_cache
+from .checkout import StockConflict, place_order
+from .hashers import hashing_slot
+from .jobs import Worker, claim, enqueue, get_config as get_job_config, registry as job_registry, requeue_expired
+from .metrics import registry
+from .models import User, Shop, Shopkeeper, Customer, Product, Review, Order, OrderItem, ShopAssignment, Job
+from .parsers import FastJSONParser
+from .profiling import StackSampler, cprofile_lock
+from .queryplan import optimize_queryset
+from .readers import ValuesReader, order_item_reader, order_reader, product_reader, review_reader
+from .renderers import FastJSONRenderer
+from .routers import PrimaryReplicaRouter, ReplicaRoutingMiddleware, replica_reads
+from .search import get_search_engine
+from .seeding import SCALES, Seeder, SeedPlan
+from .serializers import FieldSpec, OrderItemSerializer, ProductSerializer, ShopSerializer
+
+
+def create_catalog(products=0):
+    user = User.objects.create_user(email='keeper@example.com', name='Keeper', password='pass1234',
+                                    role=User.SHOPKEEPER)
+    shopkeeper = Shopkeeper.objects.create(user=user, TIN='tin', NID='nid', approval_status='approved')
+    shop = Shop.objects.create(name='Corner Shop', address='1 Main St', owner=shopkeeper, status='active')
+    Product.objects.bulk_create([
+        Product(name='Product %d' % i, description='Description %d' % i, price='%d.50' % i,
+                stock_quantity=i, shop=shop, added_by=shopkeeper)
+        for i in range(products)
+    ])
+    return user, shopkeeper, shop
+
+
+# Hashing dominates fixture setup otherwise
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ShopTestCase(TestCase):
+
+    def setUp(self):
+        # Primary keys are reused between tests, so cached payloads must not leak across them
+        cache.clear()
+        revocations.backend.clear()
+        detail_cache.reset_stats()
+
+
+class KeysetPaginationTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=7)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_walks_forward_and_back(self):
+        response = self.client.get('/api/products/', {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        first = [row['id'] for row in response.data['results']]
+        self.assertEqual(len(first), 3)
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        second = [row['id'] for row in response.data['results']]
+        self.assertEqual(len(second), 3)
+        self.assertGreater(second[0], first[-1])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], second)
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([row['id'] for row in response.data['results']], first)
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_forged_cursor_values(self):
+        # {"p":[{}]}, {"p":["abc"]}, {"p":[[1]]}
+        for cursor in ('eyJwIjpbe31dfQ==', 'eyJwIjpbImFiYyJdfQ==', 'eyJwIjpbWzFdXX0='):
+            response = self.client.get('/api/products/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_page_size_is_capped(self):
+        response = self.client.get('/api/users/', {'page_size': 100000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class QueryCountTests(ShopTestCase):
+    # Every list and detail endpoint must cost the same number of queries however many
+    # rows (and nested relations) it returns.
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rows = 0
+        self.add_rows(3)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            i = self.rows = self.rows + 1
+            user = User.objects.create_user(email='user%d@example.com' % i, name='User %d' % i, password='x')
+            shopkeeper = Shopkeeper.objects.create(user=user, TIN='t', NID='n', approval_status='approved')
+            ShopAssignment.objects.create(shop=self.shop, shopkeeper=shopkeeper)
+            shop = Shop.objects.create(name='Shop %d' % i, address='Street', owner=shopkeeper, status='active')
+            customer = Customer.objects.create(user=user, approval_status='approved')
+            product = Product.objects.create(name='P', description='D', price='1.00', stock_quantity=1,
+                                             shop=shop, added_by=shopkeeper)
+            Review.objects.create(rating=5, comment='Good', product=product, customer=customer)
+            order = Order.objects.create(customer=customer, shop=shop, total_price='1.00', status='pending')
+            OrderItem.objects.create(order=order, product=product, quantity=1, price='1.00')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, url):
+        before = self.count_queries(url)
+        self.add_rows(5)
+        self.assertEqual(self.count_queries(url), before, url)
+
+    def test_list_endpoints(self):
+        for url in ['/api/users/', '/api/shops/', '/api/shopkeepers/', '/api/customers/', '/api/products/',
+                    '/api/reviews/', '/api/orders/', '/api/order-items/']:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url)
+
+    def test_detail_endpoints(self):
+        for url, model in [('/api/products/%d/', Product),
+                           ('/api/reviews/%d/', Review), ('/api/orders/%d/', Order),
+                           ('/api/order-items/%d/', OrderItem)]:
+            with self.subTest(url=url):
+                self.assertLessEqual(self.count_queries(url % model.objects.first().pk), 1)
+
+    def test_shop_detail_prefetches_assignments(self):
+        self.assertEqual(self.count_queries('/api/shops/%d/' % self.shop.pk), 2)
+
+
+class BulkProductImportTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def row(self, i, **overrides):
+        row = {'name': 'Item %d' % i, 'description': 'Bulk', 'price': '9.99', 'stock_quantity': 3,
+               'shop': self.shop.pk}
+        row.update(overrides)
+        return row
+
+    def test_reports_bad_rows_and_inserts_the_rest(self):
+        rows = [self.row(0), self.row(1, price='abc'), self.row(2, shop=999999), self.row(3)]
+        response = self.client.post('/api/bulk-products/', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2])
+        self.assertEqual(Product.objects.filter(added_by=self.shopkeeper).count(), 2)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        rows = [self.row(i) for i in range(100)]
+        # auth shopkeeper lookup, savepoint pair, shop check, insert
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/bulk-products/', rows, format='json')
+        self.assertEqual(response.data['created'], 100)
+
+    def test_all_rows_invalid(self):
+        response = self.client.post('/api/bulk-products/', [self.row(0, name='')], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+
+
+class ProductStreamingImportTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, body, content_type, **extra):
+        response = self.client.post('/api/products/import/?batch_size=2', body, content_type=content_type, **extra)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_ndjson(self):
+        lines = [json.dumps({'name': 'P%d' % i, 'description': 'D', 'price': '1.00', 'stock_quantity': 1,
+                             'shop': self.shop.pk}) for i in range(4)]
+        lines.insert(2, '{broken')
+        progress = self.upload('\n'.join(lines), 'application/x-ndjson')
+        self.assertEqual([event['processed'] for event in progress], [2, 4, 5, 5])
+        self.assertEqual(progress[1]['errors'][0]['row'], 2)
+        self.assertEqual(progress[-1], {'processed': 5, 'created': 4, 'done': True})
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_gzipped_csv(self):
+        body = 'name,description,price,stock_quantity,shop\n"A, B","multi\nline",2.50,3,%d\n' % self.shop.pk
+        progress = self.upload(gzip.compress(body.encode()), 'text/csv', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(progress[-1]['created'], 1)
+        self.assertEqual(Product.objects.get().description, 'multi\nline')
+
+    def test_undecodable_line_is_a_bad_row(self):
+        row = json.dumps({'name': 'P', 'description': 'D', 'price': '1.00', 'stock_quantity': 1,
+                          'shop': self.shop.pk}).encode()
+        progress = self.upload(b'\n'.join([row, row, b'{"name": "\xff"}', row]), 'application/x-ndjson')
+        self.assertEqual(progress[1]['errors'], [{'row': 2, 'errors': {'non_field_errors': ['Invalid UTF-8']}}])
+        self.assertEqual(progress[-1], {'processed': 4, 'created': 3, 'done': True})
+        body = 'name,description,price,stock_quantity,shop\nA,\xff,1.00,1,%d\n' % self.shop.pk
+        progress = self.upload(body.encode('latin-1'), 'text/csv')
+        self.assertEqual(progress[0]['errors'][0]['errors'], {'non_field_errors': ['Invalid UTF-8']})
+
+    def test_truncated_gzip_ends_with_error_line(self):
+        lines = [json.dumps({'name': 'P%d' % i, 'description': 'D', 'price': '1.00', 'stock_quantity': 1,
+                             'shop': self.shop.pk}) for i in range(50)]
+        body = gzip.compress('\n'.join(lines).encode())
+        progress = self.upload(body[:len(body) // 2], 'application/x-ndjson', HTTP_CONTENT_ENCODING='gzip')
+        self.assertIn('error', progress[-1])
+        self.assertNotIn('done', progress[-1])
+        self.assertEqual(progress[-1]['created'], Product.objects.count())
+
+    @override_settings(SHOP_IMPORT={'MAX_LINE_BYTES': 200})
+    def test_overlong_line_ends_with_error_line(self):
+        row = json.dumps({'name': 'P', 'description': 'D', 'price': '1.00', 'stock_quantity': 1,
+                          'shop': self.shop.pk}).encode()
+        # Longer than a read, and with no newline at all
+        progress = self.upload(b'\n'.join([row, row, b'x' * 200000]), 'application/x-ndjson')
+        self.assertEqual(progress[-1], {'processed': 2, 'created': 2, 'error': 'A line is longer than 200 bytes'})
+        progress = self.upload(b'\n'.join([row, b'y' * 201, row]), 'application/x-ndjson')
+        self.assertEqual(progress[-1]['error'], 'A line is longer than 200 bytes')
+
+    @override_settings(SHOP_IMPORT={'MAX_UPLOAD_BYTES': 100000})
+    def test_decompressed_size_is_capped(self):
+        row = json.dumps({'name': 'P', 'description': 'D', 'price': '1.00', 'stock_quantity': 1,
+                          'shop': self.shop.pk})
+        # About 10 MB of output from a few kilobytes of gzip
+        body = gzip.compress(('\n'.join([row] * 4) + '\n' * 10000000).encode())
+        self.assertLess(len(body), 20000)
+        progress = self.upload(body, 'application/x-ndjson', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(progress[-1], {'processed': 4, 'created': 4, 'error': 'Upload is larger than 100000 bytes'})
+
+    def test_rejects_other_media_types(self):
+        response = self.client.post('/api/products/import/', {}, format='json')
+        self.assertEqual(response.status_code, 415)
+
+
+class ExportTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ndjson_export(self):
+        response = self.client.get('/api/products/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['price'] for row in rows], ['0.50', '1.50', '2.50'])
+        self.assertEqual(rows[0]['shop_id'], self.shop.pk)
+
+    def test_csv_export(self):
+        response = self.client.get('/api/products/export/', {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,name,description,price,stock_quantity,shop_id,added_by_id')
+        self.assertEqual(len(lines), 4)
+
+    def test_unknown_output(self):
+        self.assertEqual(self.client.get('/api/orders/export/', {'output': 'xml'}).status_code, 400)
+
+
+class DetailCacheTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=1)
+        self.product = Product.objects.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = '/api/products/%d/' % self.product.pk
+
+    def test_second_read_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], self.product.name)
+        self.assertEqual(detail_cache.stats()['hits'], 1)
+        self.assertEqual(detail_cache.stats()['misses'], 1)
+
+    def test_product_write_invalidates(self):
+        self.client.get(self.url)
+        self.product.name = 'Renamed'
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).data['name'], 'Renamed')
+
+    def test_nested_shopkeeper_write_invalidates(self):
+        self.client.get(self.url)
+        self.shopkeeper.TIN = 'changed'
+        self.shopkeeper.save()
+        self.assertEqual(self.client.get(self.url).data['added_by']['TIN'], 'changed')
+
+    def test_assignment_invalidates_shop(self):
+        url = '/api/shops/%d/' % self.shop.pk
+        self.assertEqual(self.client.get(url).data['shopkeepers'], [])
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.shopkeeper)
+        self.assertEqual(len(self.client.get(url).data['shopkeepers']), 1)
+
+    def test_missing_objects_are_not_cached(self):
+        self.assertEqual(self.client.get('/api/products/999999/').status_code, 404)
+        self.assertEqual(self.client.get('/api/products/999999/').status_code, 404)
+        self.assertEqual(detail_cache.stats()['hits'], 0)
+
+
+class ConditionalGetTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        # Answered from the page's pks and the validator aggregate alone
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_list_etag_tracks_rows_and_embedded_relations(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.shopkeeper.approval_status = 'rejected'
+        self.shopkeeper.save()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Product.objects.first().delete()
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pages_have_distinct_etags(self):
+        first = self.client.get('/api/products/', {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_cached_detail_revalidates_without_queries(self):
+        url = '/api/products/%d/' % Product.objects.first().pk
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_detail_if_modified_since(self):
+        order_customer = Customer.objects.create(user=self.user, approval_status='approved')
+        order = Order.objects.create(customer=order_customer, shop=self.shop, total_price='1.00', status='pending')
+        response = self.client.get('/api/orders/%d/' % order.pk)
+        response = self.client.get('/api/orders/%d/' % order.pk, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductFilterTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=6)
+        Product.objects.filter(name='Product 0').update(name='Blue ceramic mug', description='Holds coffee')
+        Product.objects.filter(name='Product 1').update(description='A blueish teapot')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, **params):
+        response = self.client.get('/api/products/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row['name'] for row in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.names(min_price='2', max_price='4'), ['Product 2', 'Product 3'])
+        self.assertEqual(len(self.names(in_stock='true')), 5)
+        self.assertEqual(self.names(in_stock='false'), ['Blue ceramic mug'])
+        self.assertEqual(len(self.names(shop=self.shop.pk, added_by=self.shopkeeper.pk)), 6)
+        self.assertEqual(self.names(shop=self.shop.pk + 1), [])
+
+    def test_invalid_filter_value(self):
+        self.assertEqual(self.client.get('/api/products/', {'min_price': 'cheap'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {'ordering': 'description'}).status_code, 400)
+
+    def test_full_text_search(self):
+        self.assertEqual(self.names(q='blue'), ['Blue ceramic mug', 'Product 1'])
+        self.assertEqual(self.names(q='coffee mug'), ['Blue ceramic mug'])
+        self.assertEqual(self.names(q='"); DROP'), [])
+        # The index follows updates
+        Product.objects.filter(name='Product 5').update(name='Blue vase')
+        self.assertEqual(self.names(q='vase'), ['Blue vase'])
+
+    def test_ordering_with_keyset_pages(self):
+        response = self.client.get('/api/products/', {'ordering': '-price', 'page_size': 4})
+        prices = [row['price'] for row in response.data['results']]
+        response = self.client.get(response.data['next'])
+        prices += [row['price'] for row in response.data['results']]
+        self.assertEqual(prices, ['5.50', '4.50', '3.50', '2.50', '1.50', '0.50'])
+        # A cursor cannot be replayed under another ordering
+        cursor = response.request['QUERY_STRING'].split('cursor=')[1].split('&')[0]
+        self.assertEqual(self.client.get('/api/products/', {'cursor': cursor}).status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        # Fails when an index that a hot endpoint relies on goes missing
+        call_command('explain_queries', '--fail-on-scan', '--quiet', stdout=io.StringIO())
+
+
+class CheckoutTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.buyer = User.objects.create_user(email='buyer@example.com', name='Buyer', password='x',
+                                              role=User.CUSTOMER)
+        self.customer = Customer.objects.create(user=self.buyer, approval_status='approved')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.mug, self.pot, self.cup = Product.objects.order_by('id')
+        Product.objects.update(stock_quantity=5)
+
+    def checkout(self, *items):
+        return self.client.post('/api/checkout/', {
+            'shop': self.shop.pk,
+            'items': [{'product': product.pk, 'quantity': quantity} for product, quantity in items],
+        }, format='json')
+
+    def test_places_order_and_reserves_stock(self):
+        response = self.checkout((self.mug, 2), (self.pot, 1), (self.mug, 1))
+        self.assertEqual(response.status_code, 201, response.data)
+        # 3 x 0.50 + 1 x 1.50, whatever the client thinks prices are
+        self.assertEqual(response.data['total_price'], '3.00')
+        self.assertEqual([(item['product'], item['quantity']) for item in response.data['items']],
+                         [(self.mug.pk, 3), (self.pot.pk, 1)])
+        self.mug.refresh_from_db()
+        self.assertEqual(self.mug.stock_quantity, 2)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.data['id']).count(), 2)
+
+    def test_oversell_rolls_back_everything(self):
+        response = self.checkout((self.mug, 1), (self.pot, 6))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Product.objects.get(pk=self.mug.pk).stock_quantity, 5)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stale_reads_cannot_oversell(self):
+        # Two checkouts that both saw 5 in stock: the second one must lose
+        self.assertEqual(self.checkout((self.cup, 4)).status_code, 201)
+        self.assertEqual(self.checkout((self.cup, 4)).status_code, 409)
+        self.assertEqual(Product.objects.get(pk=self.cup.pk).stock_quantity, 1)
+
+    def test_product_from_another_shop(self):
+        other = Shop.objects.create(name='Other', address='x', owner=self.shopkeeper, status='active')
+        Product.objects.filter(pk=self.cup.pk).update(shop=other)
+        self.assertEqual(self.checkout((self.cup, 1)).status_code, 400)
+
+    def test_requires_customer(self):
+        self.client.force_authenticate(User.objects.get(email='keeper@example.com'))
+        self.assertEqual(self.checkout((self.cup, 1)).status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ConcurrentCheckoutTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        _, _, self.shop = create_catalog(products=2)
+        self.customer = Customer.objects.create(user=User.objects.create_user(
+            email='buyer@example.com', name='Buyer', password='x', role=User.CUSTOMER), approval_status='approved')
+        self.mug, self.pot = Product.objects.order_by('id')
+        Product.objects.filter(pk=self.mug.pk).update(stock_quantity=5)
+        Product.objects.filter(pk=self.pot.pk).update(stock_quantity=3)
+
+    def test_no_oversell_under_concurrency(self):
+        buyers = 8
+        start = threading.Barrier(buyers)
+        placed, conflicts, errors = [], [], []
+
+        def buy(n):
+            # Half list the products the other way round, which must not deadlock either
+            items = [{'product': self.mug.pk, 'quantity': 1}, {'product': self.pot.pk, 'quantity': 1}]
+            try:
+                start.wait()
+                placed.append(place_order(self.customer.pk, self.shop.pk, items[::1 if n % 2 else -1]).pk)
+            except StockConflict:
+                conflicts.append(n)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(n,)) for n in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # The pot runs out after three orders; the rest are refused whole
+        self.assertEqual((len(placed), len(conflicts)), (3, 5))
+        self.mug.refresh_from_db()
+        self.pot.refresh_from_db()
+        self.assertEqual((self.mug.stock_quantity, self.pot.stock_quantity), (2, 0))
+        self.assertEqual(Order.objects.count(), 3)
+        self.assertEqual(OrderItem.objects.filter(order_id__in=placed).count(), 6)
+
+
+class RatingAggregateTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _, self.shopkeeper, self.shop = create_catalog(products=2)
+        self.reviewer = User.objects.create_user(email='reviewer@example.com', name='Reviewer', password='x')
+        self.customer = Customer.objects.create(user=self.reviewer, approval_status='approved')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reviewer)
+        self.product, self.other = Product.objects.order_by('id')
+
+    def assertRating(self, product, count, total):
+        product.refresh_from_db()
+        self.assertEqual((product.rating_count, product.rating_sum), (count, total))
+
+    def test_review_lifecycle(self):
+        response = self.client.post('/api/reviews/', {'rating': 4, 'comment': 'Nice', 'product': self.product.pk})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.client.post('/api/reviews/', {'rating': 1, 'comment': 'Meh', 'product': self.product.pk})
+        self.assertRating(self.product, 2, 5)
+        self.assertEqual(self.client.get('/api/products/%d/' % self.product.pk).data['rating_average'], 2.5)
+
+        review_id = response.data['id']
+        self.client.put('/api/reviews/%d/' % review_id, {'rating': 5, 'comment': 'Great', 'product': self.product.pk})
+        self.assertRating(self.product, 2, 6)
+
+        self.client.put('/api/reviews/%d/' % review_id, {'rating': 5, 'comment': 'Moved', 'product': self.other.pk})
+        self.assertRating(self.product, 1, 1)
+        self.assertRating(self.other, 1, 5)
+
+        self.client.delete('/api/reviews/%d/' % review_id)
+        self.assertRating(self.other, 0, 0)
+        self.assertIsNone(self.client.get('/api/products/%d/' % self.other.pk).data['rating_average'])
+
+    def test_product_review_listing(self):
+        Review.objects.create(rating=3, comment='a', product=self.product, customer=self.customer)
+        Review.objects.create(rating=5, comment='b', product=self.other, customer=self.customer)
+        response = self.client.get('/api/products/%d/reviews/' % self.product.pk)
+        self.assertEqual([review['comment'] for review in response.data['results']], ['a'])
+        self.assertEqual(self.client.get('/api/products/999999/reviews/').status_code, 404)
+
+    def test_rebuild_command(self):
+        Review.objects.create(rating=3, comment='a', product=self.product, customer=self.customer)
+        Review.objects.create(rating=4, comment='b', product=self.product, customer=self.customer)
+        Product.objects.update(rating_count=99, rating_sum=0)
+        call_command('rebuild_ratings', '--batch-size', '1', stdout=io.StringIO())
+        self.assertRating(self.product, 2, 7)
+        self.assertRating(self.other, 0, 0)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ConcurrentRatingTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        _, shopkeeper, _ = create_catalog(products=1)
+        customer = Customer.objects.create(user=User.objects.create_user(
+            email='reviewer@example.com', name='Reviewer', password='x'), approval_status='approved')
+        self.product = Product.objects.get()
+        self.review = Review.objects.create(rating=1, comment='a', product=self.product, customer=customer)
+
+    def test_interleaved_updates(self):
+        # The first update pauses once it has read the rating it replaces; the second runs then
+        first_read, second_done = threading.Event(), threading.Event()
+        errors = []
+
+        def pause(sender, instance, **kwargs):
+            if instance.rating == 5:
+                first_read.set()
+                # Without the row lock the second update completes here; with it, it waits
+                second_done.wait(0.5)
+
+        def update(rating, started=None):
+            try:
+                if started is not None:
+                    started.wait()
+                review = Review.objects.get(pk=self.review.pk)
+                review.rating = rating
+                review.save()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                if rating == 3:
+                    second_done.set()
+                connection.close()
+
+        pre_save.connect(pause, sender=Review)
+        self.addCleanup(pre_save.disconnect, pause, sender=Review)
+        threads = [threading.Thread(target=update, args=(5,)), threading.Thread(target=update, args=(3, first_read))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        self.product.refresh_from_db()
+        self.review.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (1, self.review.rating))
+
+
+class AsyncViewTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=5)
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.shopkeeper)
+        customer = Customer.objects.create(user=User.objects.create_user(
+            email='buyer@example.com', name='Buyer', password='x', role=User.CUSTOMER), approval_status='approved')
+        self.order = Order.objects.create(customer=customer, shop=self.shop, status='pending', total_price='3.50')
+        self.headers = {'Authorization': 'Bearer %s' % AccessToken.for_user(self.user)}
+        self.sync_client = APIClient(headers=self.headers)
+
+    async def test_matches_sync_views(self):
+        product = await Product.objects.order_by('id').afirst()
+        paths = ['products/', 'products/?page_size=2&ordering=-price', 'products/?q=product&in_stock=true',
+                 'products/%d/' % product.pk, 'shops/', 'shops/%d/' % self.shop.pk, 'orders/',
+                 'orders/%d/' % self.order.pk, 'products/999999/', 'products/?cursor=bad',
+                 'products/?fields=id,name', 'products/%d/?expand=' % product.pk, 'shops/?expand=',
+                 'orders/?fields=id,customer.approval_status', 'products/?fields=nope']
+        for path in paths:
+            expected = await sync_to_async(self.sync_client.get)('/api/' + path)
+            response = await self.async_client.get('/api/async/' + path, headers=self.headers)
+            self.assertEqual(response.status_code, expected.status_code, path)
+            # Pagination links point back at the endpoint that served them
+            self.assertEqual(response.content.replace(b'/api/async/', b'/api/'), expected.content, path)
+
+    async def test_conditional_get(self):
+        response = await self.async_client.get('/api/async/products/', headers=self.headers)
+        etag = response['ETag']
+        response = await self.async_client.get('/api/async/products/', headers=dict(self.headers, **{
+            'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+    async def test_requires_valid_token(self):
+        response = await self.async_client.get('/api/async/products/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+        response = await self.async_client.get('/api/async/products/', headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, 401)
+
+
+class BenchmarkTests(ShopTestCase):
+
+    def test_every_endpoint_has_a_scenario(self):
+        from .urls import urlpatterns
+        covered = {scenario.url_name for scenario in get_scenarios()}
+        self.assertEqual({pattern.name for pattern in urlpatterns} - covered, set())
+
+    def test_seed_and_run(self):
+        counts = Seeder(SCALES['tiny'], seed=1).run()
+        self.assertEqual(Product.objects.count(), counts['products'])
+        self.assertEqual(Review.objects.count(), counts['reviews'])
+        self.assertEqual(Product.objects.aggregate(total=Sum('rating_count'))['total'], counts['reviews'])
+
+        runner = Runner(Fixtures(), concurrency=1, requests=5)
+        scenarios = {scenario.name: scenario for scenario in get_scenarios()}
+        results = {'scenarios': {name: runner.run(scenarios[name])
+                                 for name in ('products list', 'order detail', 'product import', 'checkout')}}
+        for name, result in results['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['violations'], [], name)
+        # Page pks, validators and the page; the token's claims stand in for a user query
+        self.assertEqual(results['scenarios']['products list']['queries_per_request'], 3)
+
+        slower = json.loads(json.dumps(results))
+        slower['scenarios']['products list']['latency_ms']['p95'] *= 10
+        slower['scenarios']['products list']['queries_per_request'] += 1
+        self.assertEqual(len(compare(slower, results)), 2)
+        self.assertEqual(compare(results, results), [])
+
+
+class SeedCommandTests(ShopTestCase):
+
+    def test_seed(self):
+        call_command('seed', '--scale', 'tiny', '--batch-size', '7', '--workers', '1', '--products', '300',
+                     stdout=io.StringIO())
+        counts = dict(SCALES['tiny'], products=300)
+        self.assertEqual(Product.objects.count(), 300)
+        self.assertEqual(Order.objects.count(), counts['orders'])
+        self.assertEqual(User.objects.count(), counts['shopkeepers'] + counts['customers'])
+
+        # Skewed: the first shop holds the biggest share of the catalog
+        per_shop = dict(Product.objects.values_list('shop').annotate(Count('id')))
+        self.assertEqual(max(per_shop, key=per_shop.get), Shop.objects.order_by('pk').first().pk)
+        # Consistent: totals match their items, products are added by staff of their shop
+        for order in Order.objects.prefetch_related('orderitem_set')[:20]:
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in order.orderitem_set.all()))
+        staff = set(ShopAssignment.objects.values_list('shop', 'shopkeeper'))
+        self.assertTrue(all(pair in staff for pair in Product.objects.values_list('shop', 'added_by')))
+        self.assertEqual(Product.objects.aggregate(total=Sum('rating_count'))['total'], counts['reviews'])
+        # Still searchable after the deferred index build, and for rows added later
+        self.assertTrue(get_search_engine().search(Product.objects.all(), Product.objects.first().name).exists())
+
+        # A second run appends after the existing ids
+        call_command('seed', '--scale', 'tiny', stdout=io.StringIO())
+        self.assertEqual(Product.objects.count(), 300 + SCALES['tiny']['products'])
+
+    def test_deterministic(self):
+        offsets = {model: 0 for model in (User, Shopkeeper, Customer, Shop, Product, Order)}
+        first, second = [SeedPlan(SCALES['small'], 5, 1.1, 100, 'hash', offsets) for _ in range(2)]
+        second.now = first.now
+        self.assertEqual(first.orders(3, 300, 400), second.orders(3, 300, 400))
+        self.assertEqual(first.reviews(0, 0, 100), second.reviews(0, 0, 100))
+
+
+class MetricsTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.headers = {'Authorization': 'Bearer %s' % AccessToken.for_user(self.user)}
+        self.api = APIClient(headers=self.headers)
+
+    def metrics(self, **extra):
+        if not extra:
+            self.client.force_login(User.objects.create_user(
+                email='ops@example.com', name='Ops', password='x', is_staff=True))
+        response = self.client.get('/metrics', **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_per_view(self):
+        self.api.get('/api/products/')
+        self.api.get('/api/products/')
+        self.api.get('/api/products/999999/')
+        text = self.metrics()
+        self.assertIn('shop_http_requests_total{view="product-list-create",method="GET",status="200"} 2', text)
+        self.assertIn('shop_http_requests_total{view="product-detail",method="GET",status="404"} 1', text)
+        self.assertIn('shop_http_request_duration_seconds_count{view="product-list-create",method="GET"} 2', text)
+        # auth user, page pks, page aggregate, page rows: every request lands in the le="5" bucket
+        self.assertIn('shop_db_queries_per_request_bucket{view="product-list-create",le="5"} 2', text)
+        self.assertIn('shop_db_queries_per_request_bucket{view="product-list-create",le="3"} 0', text)
+        # Values-based serialization can take few enough microseconds for repr() to use an exponent
+        self.assertRegex(text, r'shop_serializer_duration_seconds_total\{view="product-list-create"\} (0\.\d+|\d\.\d+e-\d+)\n')
+        self.assertIn('shop_http_response_size_bytes_count{view="product-list-create"} 2', text)
+
+    async def test_async_views_count_queries(self):
+        await self.async_client.get('/api/async/products/', headers=self.headers)
+        text = await sync_to_async(self.metrics)()
+        self.assertIn('shop_db_queries_per_request_bucket{view="async-product-list",le="5"} 1', text)
+        self.assertIn('shop_db_queries_per_request_bucket{view="async-product-list",le="3"} 0', text)
+
+    def test_times_the_shops_serializers(self):
+        self.api.get('/api/users/%d/' % self.user.pk)
+        self.api.get('/api/users/')
+        text = self.metrics()
+        for view in ('user-detail', 'user-list-create'):
+            seconds = re.search(r'shop_serializer_duration_seconds_total\{view="%s"\} (\S+)' % view, text).group(1)
+            self.assertGreater(float(seconds), 0)
+        # DRF's own classes are left alone
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+
+    def test_staff_only_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.metrics()
+
+    def test_token(self):
+        with self.settings(SHOP_METRICS={'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code, 403)
+            self.metrics(headers={'Authorization': 'Bearer secret'})
+
+    def test_slow_request_log(self):
+        with self.settings(SHOP_METRICS={'SLOW_REQUEST_SECONDS': 0}):
+            # The threshold is read when the middleware chain is built
+            client = Client(headers=self.headers)
+            with self.assertLogs('shop.metrics', 'WARNING') as logs:
+                client.get('/api/products/')
+        self.assertIn('FROM "shop_product"', logs.output[0])
+
+    def test_slow_request_log_omits_profiling_token(self):
+        with self.settings(SHOP_METRICS={'SLOW_REQUEST_SECONDS': 0}):
+            client = Client(headers=self.headers)
+            with self.assertLogs('shop.metrics', 'WARNING') as logs:
+                client.get('/api/products/', {'profile': 'secret', 'q': 'item'})
+        self.assertIn('/api/products/?q=item (', logs.output[0])
+        self.assertNotIn('secret', logs.output[0])
+
+
+class ProfilingTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        override = override_settings(SHOP_PROFILING={'TOKEN': 'secret', 'DIRECTORY': self.directory,
+                                                     'SAMPLING_INTERVAL': 0.0001})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_cprofile_on_request(self):
+        response = self.api.get('/api/order-items/', headers={'X-Profile': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        name = response['X-Profile-Id']
+        self.assertTrue(name.endswith('.pstats'))
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        # The page is serialized by the order item ValuesReader (see readers.py)
+        self.assertTrue(any(function == 'serialize' and path.endswith('readers.py') for path, _, function in stats.stats))
+
+    def test_sampling_by_query_parameter(self):
+        response = self.api.get('/api/products/', {'profile': 'secret', 'profile_mode': 'sampling'})
+        self.assertTrue(response['X-Profile-Id'].endswith('.collapsed'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, response['X-Profile-Id'])))
+
+    def test_overlapping_request_is_sampled(self):
+        # cProfile is already profiling another request
+        with cprofile_lock:
+            response = self.api.get('/api/products/', headers={'X-Profile': 'secret'})
+        self.assertTrue(response['X-Profile-Id'].endswith('.collapsed'))
+        self.assertFalse(cprofile_lock.locked())
+
+    async def test_async_request_is_sampled(self):
+        headers = {'Authorization': 'Bearer %s' % AccessToken.for_user(self.user), 'X-Profile': 'secret'}
+        response = await self.async_client.get('/api/async/products/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Profile-Id'].endswith('.collapsed'))
+        self.assertFalse(cprofile_lock.locked())
+
+    async def test_sampler_skips_other_tasks(self):
+        other = asyncio.create_task(asyncio.sleep(1))
+        self.addCleanup(other.cancel)
+        sampler = StackSampler(threading.get_ident(), 0.0001, other)
+        sampler.start()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            pass
+        sampler.stop()
+        self.assertFalse(sampler.stacks)
+
+        sampler = StackSampler(threading.get_ident(), 0.0001, asyncio.current_task())
+        sampler.start()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            pass
+        sampler.stop()
+        self.assertTrue(sampler.stacks)
+
+    def test_requires_token(self):
+        self.assertNotIn('X-Profile-Id', self.api.get('/api/products/', headers={'X-Profile': 'wrong'}))
+        self.assertNotIn('X-Profile-Id', self.api.get('/api/products/'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_random_sampling(self):
+        with self.settings(SHOP_PROFILING={'SAMPLE_RATE': 1.0, 'DIRECTORY': self.directory}):
+            self.assertIn('X-Profile-Id', self.api.get('/api/products/'))
+
+    def test_download_is_staff_only(self):
+        name = self.api.get('/api/products/', headers={'X-Profile': 'secret'})['X-Profile-Id']
+        self.assertEqual(self.api.get('/profiles/%s' % name).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual([row['name'] for row in self.api.get('/profiles/').data], [name])
+        response = self.api.get('/profiles/%s' % name)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(self.api.get('/profiles/..%2Fsettings.py').status_code, 404)
+
+
+class TokenClaimsTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=1)
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/login/', {'email': 'keeper@example.com', 'password': 'pass1234'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def user_queries(self, queries):
+        return [query['sql'] for query in queries if '"shop_user"' in query['sql']]
+
+    def test_login_embeds_claims(self):
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.shopkeeper)
+        token = AccessToken(self.login()['access'])
+        self.assertEqual((token['role'], token['shopkeeper_id'], token['shop_id'], token['customer_id']),
+                         (User.SHOPKEEPER, self.shopkeeper.pk, self.shop.pk, None))
+
+    def test_trusted_token_skips_user_and_shopkeeper_lookups(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.login()['access'])
+        row = {'name': 'Item', 'description': 'Bulk', 'price': '9.99', 'stock_quantity': 3, 'shop': self.shop.pk}
+        # savepoint pair, shop check, insert
+        with self.assertNumQueries(4):
+            response = self.client.post('/api/bulk-products/', [row], format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.login()['access'])
+        self.assertEqual(self.client.get('/api/products/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/products/').status_code, 401)
+
+    def test_lost_stamp_is_not_trusted(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.login()['access'])
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+        # As in another worker, or after a restart: no stamp at all must not match the token
+        revocations.backend.clear()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+
+    def test_process_local_revocations_are_refused(self):
+        with mock.patch.object(revocations, 'allow_process_local', False):
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.login()['access'])
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get('/api/products/').status_code, 200)
+            self.assertTrue(self.user_queries(queries.captured_queries))
+            self.assertEqual([message.id for message in check_revocation_cache(None)], ['shop.W001'])
+        self.assertEqual(check_revocation_cache(None), [])
+
+    def test_deleted_user_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % self.login()['access'])
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/products/').status_code, 401)
+
+    def test_changed_claims_fall_back_to_database_until_refresh(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % tokens['access'])
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.shopkeeper)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/products/').status_code, 200)
+        self.assertTrue(self.user_queries(queries.captured_queries))
+
+        response = self.client.post('/api/login/refresh/', {'refresh': tokens['refresh']}, format='json')
+        access = response.data['access']
+        self.assertEqual(AccessToken(access)['shop_id'], self.shop.pk)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % access)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/products/').status_code, 200)
+        self.assertEqual(self.user_queries(queries.captured_queries), [])
+
+    def test_refresh_rejects_deactivated_user(self):
+        refresh = self.login()['refresh']
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post('/api/login/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_async_views_trust_claims(self):
+        tokens = await sync_to_async(self.login)()
+        headers = {'Authorization': 'Bearer %s' % tokens['access']}
+        # update() bypasses the revoking signals, so only the token vouches for the user here
+        await User.objects.filter(pk=self.user.pk).aupdate(is_active=False)
+        response = await self.async_client.get('/api/async/products/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        await sync_to_async(revocations.revoke)(self.user.pk)
+        response = await self.async_client.get('/api/async/products/', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+
+CHEAP_SCRYPT = {'SCRYPT_WORK_FACTOR': 2 ** 4, 'SLOTS': 1, 'WAIT_SECONDS': 0.05}
+
+
+@override_settings(PASSWORD_HASHERS=['shop.hashers.ScryptPasswordHasher'] + FAST_HASHERS,
+                   SHOP_PASSWORD_HASHING=CHEAP_SCRYPT)
+class PasswordHashingTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with override_settings(PASSWORD_HASHERS=FAST_HASHERS):
+            self.user, self.shopkeeper, self.shop = create_catalog()
+        self.client = APIClient()
+
+    def login(self):
+        return self.client.post('/api/login/', {'email': 'keeper@example.com', 'password': 'pass1234'},
+                                format='json')
+
+    def test_login_rehashes_with_preferred_hasher(self):
+        self.assertTrue(self.user.password.startswith('md5$'))
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$16$'))
+
+        # Raising the cost upgrades the hash again at the next login
+        with override_settings(SHOP_PASSWORD_HASHING=dict(CHEAP_SCRYPT, SCRYPT_WORK_FACTOR=2 ** 5)):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$32$'))
+
+    def test_busy_hashing_slots_shed_load(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with hashing_slot():
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            response = self.client.post('/api/register/', {'email': 'new@example.com', 'name': 'New',
+                                                           'password': 'pass1234', 'role': User.CUSTOMER},
+                                        format='json')
+            self.assertEqual(response.status_code, 503)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(self.login().status_code, 200)
+
+
+class JobQueueTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.calls = []
+        job_registry['test.flaky'] = self.flaky
+        self.addCleanup(job_registry.pop, 'test.flaky')
+
+    def flaky(self, fail_times):
+        self.calls.append(fail_times)
+        if len(self.calls) <= fail_times:
+            raise RuntimeError('boom %d' % len(self.calls))
+        return {'calls': len(self.calls)}
+
+    def run_worker(self):
+        return Worker(poll_interval=0).run(burst=True)
+
+    def test_bulk_delete_runs_as_job(self):
+        ids = list(Product.objects.values_list('pk', flat=True)[:3])
+        response = self.client.delete('/api/bulk-products/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], Job.PENDING)
+        self.assertEqual(Product.objects.filter(pk__in=ids).count(), 3)
+
+        self.assertEqual(self.run_worker(), 1)
+        self.assertFalse(Product.objects.filter(pk__in=ids).exists())
+        response = self.client.get(response['Location'])
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'deleted': 3})
+
+        # Other users cannot see the job
+        other = User.objects.create_user(email='other@example.com', name='Other', password='x')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get('/api/jobs/%d/' % response.data['id']).status_code, 404)
+
+    def test_bulk_delete_validates_ids(self):
+        for body in ({}, {'ids': []}, {'ids': ['x']}):
+            response = self.client.delete('/api/bulk-products/', body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertFalse(Job.objects.exists())
+
+    def test_idempotency_key_returns_the_first_job(self):
+        ids = list(Product.objects.values_list('pk', flat=True)[:2])
+        first = self.client.delete('/api/bulk-products/', {'ids': ids}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        second = self.client.delete('/api/bulk-products/', {'ids': ids}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = enqueue('test.flaky', {'fail_times': 1})
+        self.assertEqual(self.run_worker(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('boom 1', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        # Not due yet; once it is, the next attempt succeeds
+        self.assertEqual(self.run_worker(), 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(self.run_worker(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.SUCCEEDED, 2, {'calls': 2}))
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue('test.flaky', {'fail_times': 5}, max_attempts=1)
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.client.force_authenticate(User.objects.create_superuser(email='admin@example.com', name='Admin',
+                                                                     password='x'))
+        self.assertEqual(self.client.get('/api/jobs/%d/' % job.pk).data['error'], 'RuntimeError: boom 1')
+
+    def test_expired_lease_is_requeued(self):
+        job = enqueue('test.flaky', {'fail_times': 0})
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=1, locked_by='dead',
+                                              locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.run_worker(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 2))
+
+    def test_result_of_a_lost_lease_is_discarded(self):
+        def taken_over():
+            # The lease expired and another worker claimed the job meanwhile
+            Job.objects.filter(pk=job.pk).update(locked_by='other', attempts=2)
+            return {'done': True}
+
+        job_registry['test.taken_over'] = taken_over
+        self.addCleanup(job_registry.pop, 'test.taken_over')
+        job = enqueue('test.taken_over')
+        with self.assertLogs('shop.jobs', 'WARNING'):
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.result), (Job.RUNNING, 'other', None))
+
+    @override_settings(SHOP_JOBS={'EAGER': True})
+    def test_eager_mode_runs_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = enqueue('ratings.rebuild')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.SUCCEEDED, {'updated': 5}))
+
+
+class JobLeaseTests(TransactionTestCase):
+
+    @override_settings(SHOP_JOBS={'LEASE_SECONDS': 0.3})
+    def test_running_job_keeps_its_lease(self):
+        seen = []
+
+        def slow():
+            # Well past the lease; another worker looking now finds nothing to take over
+            time.sleep(0.6)
+            requeue_expired(get_job_config())
+            seen.append(claim('other', 10))
+            return {}
+
+        job_registry['test.slow'] = slow
+        self.addCleanup(job_registry.pop, 'test.slow')
+        job = enqueue('test.slow')
+        Worker(poll_interval=0).run(burst=True)
+        job.refresh_from_db()
+        self.assertEqual(seen, [[]])
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 1))
+
+
+class ShopReassignmentTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.owner, self.shop = create_catalog()
+        self.other_shop = Shop.objects.create(name='Other Shop', address='2 Main St', owner=self.owner,
+                                              status='active')
+        self.keepers = [Shopkeeper.objects.create(
+            user=User.objects.create_user(email='k%d@example.com' % i, name='K%d' % i, password='x'),
+            TIN='tin', NID='nid', approval_status='approved') for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assigned(self, shop):
+        return set(ShopAssignment.objects.filter(shop=shop).values_list('shopkeeper_id', flat=True))
+
+    def test_put_applies_only_the_difference(self):
+        a, b, c = self.keepers[:3]
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=a)
+        kept = ShopAssignment.objects.create(shop=self.shop, shopkeeper=b)
+        response = self.client.put('/api/shops/%d/' % self.shop.pk, {'shopkeeper_ids': [b.pk, c.pk]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assigned(self.shop), {b.pk, c.pk})
+        self.assertTrue(ShopAssignment.objects.filter(pk=kept.pk).exists())
+        self.assertEqual({item['shopkeeper'] for item in response.data['shopkeepers']}, {b.pk, c.pk})
+
+    def test_put_without_shopkeeper_ids_keeps_assignments(self):
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.keepers[0])
+        response = self.client.put('/api/shops/%d/' % self.shop.pk, {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.assigned(self.shop), {self.keepers[0].pk})
+
+    def test_bad_id_changes_nothing(self):
+        ShopAssignment.objects.create(shop=self.shop, shopkeeper=self.keepers[0])
+        response = self.client.put('/api/shops/%d/' % self.shop.pk,
+                                   {'name': 'Renamed', 'shopkeeper_ids': [self.keepers[1].pk, 999999]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.data))
+        self.assertEqual(self.assigned(self.shop), {self.keepers[0].pk})
+        self.assertEqual(Shop.objects.get(pk=self.shop.pk).name, 'Corner Shop')
+
+    def test_shopkeeper_of_another_shop_conflicts(self):
+        ShopAssignment.objects.create(shop=self.other_shop, shopkeeper=self.keepers[0])
+        response = self.client.put('/api/shops/%d/' % self.shop.pk, {'shopkeeper_ids': [self.keepers[0].pk]},
+                                   format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.assigned(self.shop), set())
+
+    def test_put_missing_shop(self):
+        response = self.client.put('/api/shops/999999/', {'name': 'Nope'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Shop.objects.filter(name='Nope').exists())
+
+    def test_batch_moves_shopkeepers_between_shops(self):
+        a, b, c, d = self.keepers
+        ShopAssignment.objects.bulk_create([ShopAssignment(shop=self.shop, shopkeeper=a),
+                                            ShopAssignment(shop=self.shop, shopkeeper=b),
+                                            ShopAssignment(shop=self.other_shop, shopkeeper=c)])
+        self.client.get('/api/shops/%d/' % self.shop.pk)  # cached
+        response = self.client.post('/api/shops/assignments/', {'shops': [
+            {'shop': self.shop.pk, 'shopkeeper_ids': [c.pk, d.pk]},
+            {'shop': self.other_shop.pk, 'shopkeeper_ids': [a.pk]},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'added': 3, 'removed': 3})
+        self.assertEqual(self.assigned(self.shop), {c.pk, d.pk})
+        self.assertEqual(self.assigned(self.other_shop), {a.pk})
+        shopkeepers = self.client.get('/api/shops/%d/' % self.shop.pk).data['shopkeepers']
+        self.assertEqual({item['shopkeeper'] for item in shopkeepers}, {c.pk, d.pk})
+
+    def test_batch_rejects_a_shopkeeper_in_two_shops(self):
+        response = self.client.post('/api/shops/assignments/', {'shops': [
+            {'shop': self.shop.pk, 'shopkeeper_ids': [self.keepers[0].pk]},
+            {'shop': self.other_shop.pk, 'shopkeeper_ids': [self.keepers[0].pk]},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShopAssignment.objects.exists())
+
+    def test_batch_query_count_does_not_grow(self):
+        shops = Shop.objects.bulk_create([Shop(name='S%d' % i, address='x', status='active') for i in range(4)])
+
+        def batch(count):
+            return {'shops': [{'shop': shop.pk, 'shopkeeper_ids': [self.keepers[i].pk]}
+                              for i, shop in enumerate(shops[:count])]}
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.post('/api/shops/assignments/', batch(1), format='json')
+        ShopAssignment.objects.all().delete()
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.post('/api/shops/assignments/', batch(4), format='json')
+        self.assertEqual(response.data, {'added': 4, 'removed': 0})
+        self.assertEqual(len(small), len(large))
+
+
+@override_settings(SHOP_DATABASE_ROUTING={'REPLICAS': ['replica1'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(
+            lambda request: HttpResponse(self.router.db_for_read(Product) or 'default'))
+
+    def read_database(self, request):
+        response = self.middleware(request)
+        return response.content.decode(), response
+
+    def test_reads_use_primary_outside_safe_requests(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertEqual(self.read_database(self.factory.get('/api/products/'))[0], 'replica1')
+        self.assertEqual(self.read_database(self.factory.post('/api/products/'))[0], 'default')
+        self.assertIsNone(self.router.db_for_read(Product))
+        self.assertFalse(self.router.allow_migrate('replica1', 'shop'))
+
+    def test_writers_stick_to_primary(self):
+        token = {'HTTP_AUTHORIZATION': 'Bearer first'}
+        database, response = self.read_database(self.factory.post('/api/products/', **token))
+        self.assertEqual(database, 'default')
+        self.assertEqual(response.cookies['shop_primary']['max-age'], 5)
+
+        # Token clients are pinned by their Authorization header, browsers by the cookie
+        self.assertEqual(self.read_database(self.factory.get('/api/products/', **token))[0], 'default')
+        self.assertEqual(self.read_database(self.factory.get(
+            '/api/products/', HTTP_AUTHORIZATION='Bearer second'))[0], 'replica1')
+        request = self.factory.get('/api/products/')
+        request.COOKIES['shop_primary'] = '1'
+        self.assertEqual(self.read_database(request)[0], 'default')
+
+    def test_no_replicas_reads_primary(self):
+        with override_settings(SHOP_DATABASE_ROUTING={'REPLICAS': []}):
+            database, response = self.read_database(self.factory.post('/api/products/'))
+            self.assertEqual(self.read_database(self.factory.get('/api/products/'))[0], 'default')
+        self.assertNotIn('shop_primary', response.cookies)
+
+    def test_cached_payloads_are_built_from_primary(self):
+        def build():
+            return {'database': self.router.db_for_read(Product) or 'default'}
+
+        token = replica_reads.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+            self.assertEqual(detail_cache.get_or_build(Product, 1, build), {'database': 'default'})
+        finally:
+            replica_reads.reset(token)
+
+    def test_sqlite_connections_are_tuned(self):
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+            cursor.execute('PRAGMA synchronous')
+            # 1 is NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class ValuesReaderTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _, self.shopkeeper, self.shop = create_catalog(products=4)
+        buyer = User.objects.create_user(email='buyer@example.com', name='Buyer', password='x', role=User.CUSTOMER)
+        self.customer = Customer.objects.create(user=buyer, approval_status='approved')
+        products = list(Product.objects.order_by('id'))
+        # Ratings give one product a rating_average, leaving the others at None
+        Review.objects.create(rating=4, comment='Good', product=products[0], customer=self.customer)
+        Review.objects.create(rating=3, comment='Fine', product=products[0], customer=self.customer)
+        order = Order.objects.create(customer=self.customer, shop=self.shop, total_price='7', status='pending')
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=2, price='1.5')
+                                       for product in products[:3]])
+        self.client = APIClient()
+        self.client.force_authenticate(buyer)
+
+    def test_output_is_byte_identical(self):
+        renderer = JSONRenderer()
+        for reader in (product_reader, review_reader, order_reader, order_item_reader):
+            with self.subTest(reader.serializer_class.__name__):
+                queryset = reader.model.objects.order_by('id')
+                expected = reader.serializer_class(optimize_queryset(queryset, reader.serializer_class), many=True).data
+                self.assertTrue(expected)
+                self.assertEqual(renderer.render(reader.serialize(reader.queryset(queryset))),
+                                 renderer.render(expected))
+
+    def test_list_pages_match_serializer(self):
+        response = self.client.get('/api/order-items/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        items = optimize_queryset(OrderItem.objects.order_by('id'), OrderItemSerializer)[:2]
+        self.assertEqual(response.data['results'], OrderItemSerializer(items, many=True).data)
+        # The cursor still comes from the row's ordering columns
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']],
+                         list(OrderItem.objects.order_by('id').values_list('id', flat=True)[2:]))
+
+    def test_ordering_by_decimal_column(self):
+        response = self.client.get('/api/products/', {'ordering': '-price', 'page_size': 2})
+        self.assertEqual([row['price'] for row in response.data['results']], ['3.50', '2.50'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['price'] for row in response.data['results']], ['1.50', '0.50'])
+
+    def test_rejects_fields_without_columns(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesReader(ShopSerializer)
+
+
+class SparseFieldsetTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=2)
+        customer = Customer.objects.create(user=self.user, approval_status='approved')
+        order = Order.objects.create(customer=customer, shop=self.shop, total_price='2', status='pending')
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1, price='1')
+                                       for product in Product.objects.all()])
+        self.item = OrderItem.objects.order_by('id').first()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_fields_drop_joins_and_columns(self):
+        response, queries = self.get('/api/order-items/', fields='id,quantity,price')
+        self.assertEqual(response.data['results'][0], {'id': self.item.pk, 'quantity': 1, 'price': '1.00'})
+        # Neither the page nor its validators touch product, order or their relations
+        for sql in queries:
+            self.assertNotIn('JOIN', sql)
+        self.assertNotIn('order_id', queries[-1])
+
+    def test_nested_fields(self):
+        response, queries = self.get('/api/order-items/%d/' % self.item.pk, fields='id,product.name')
+        self.assertEqual(response.data, {'id': self.item.pk, 'product': {'name': 'Product 0'}})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('shop_shopkeeper', queries[0])
+        self.assertNotIn('description', queries[0])
+
+    def test_expand_controls_depth(self):
+        # With ?expand= present, relations it does not name are given as primary keys
+        response, _ = self.get('/api/order-items/', expand='')
+        row = response.data['results'][0]
+        self.assertEqual((row['order'], row['product']), (self.item.order_id, self.item.product_id))
+        response, _ = self.get('/api/order-items/', expand='product')
+        row = response.data['results'][0]
+        self.assertEqual(row['order'], self.item.order_id)
+        self.assertEqual(row['product']['added_by'], self.shopkeeper.pk)
+        response, _ = self.get('/api/order-items/', expand='product.added_by')
+        self.assertEqual(response.data['results'][0]['product']['added_by']['TIN'], 'tin')
+
+    def test_default_output_is_unchanged(self):
+        full = self.client.get('/api/products/%d/' % self.item.product_id).data
+        self.assertEqual(ProductSerializer(Product.objects.get(pk=self.item.product_id)).data, full)
+        self.assertEqual(full['added_by']['TIN'], 'tin')
+
+    def test_sparse_details_bypass_cache(self):
+        url = '/api/products/%d/' % self.item.product_id
+        full = self.client.get(url)
+        response, queries = self.get(url, fields='id,rating_average', expand='')
+        self.assertEqual(response.data, {'id': self.item.product_id, 'rating_average': None})
+        self.assertEqual(len(queries), 1)
+        self.assertNotEqual(response['ETag'], full['ETag'])
+        self.assertEqual(self.client.get(url).data, full.data)
+
+    def test_unknown_names_are_rejected(self):
+        response, _ = self.get('/api/order-items/', fields='id,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['fields'], ['Unknown field "secret".'])
+        response, _ = self.get('/api/order-items/', fields='id,product.secret')
+        self.assertEqual(response.data['fields'], ['Unknown field "product.secret".'])
+        # Nor is anything under a field with no fields of its own
+        response, _ = self.get('/api/products/', fields='id,shop.name')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['fields'], ['Unknown field "shop.name".'])
+        response, _ = self.get('/api/order-items/', fields='quantity.a,product.shop.name')
+        self.assertEqual(response.data['fields'], ['Unknown field "quantity.a".'])
+        response, _ = self.get('/api/order-items/', fields='product.shop.name')
+        self.assertEqual(response.data['fields'], ['Unknown field "product.shop.name".'])
+        response, _ = self.get('/api/order-items/', expand='quantity')
+        self.assertEqual(response.status_code, 400)
+        # Write-only fields are not readable this way either
+        response, _ = self.get('/api/users/', fields='id,password')
+        self.assertEqual(response.status_code, 400)
+
+    def test_spec_identity(self):
+        # One sparse class (and so one query plan and reader) per distinct request
+        self.assertEqual(FieldSpec({'b': {}, 'a': {}}), FieldSpec({'a': {}, 'b': {}}))
+        self.assertNotEqual(FieldSpec({'a': {}}), FieldSpec({'a': {}}, {}))
+
+
+class MultiGetTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=60)
+        self.ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_ids_in_one_page(self):
+        wanted = self.ids[::2][:55]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/', {'ids': ','.join(map(str, wanted + [999999]))})
+        # More than the default page size, yet one page: its pks, the validators and the rows
+        self.assertEqual([row['id'] for row in response.data['results']], wanted)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(queries.captured_queries), 3)
+
+    def test_every_list_accepts_ids(self):
+        for url, pk in [('/api/users/', self.user.pk), ('/api/shops/', self.shop.pk),
+                        ('/api/shopkeepers/', self.shopkeeper.pk), ('/api/async/shops/', self.shop.pk)]:
+            with self.subTest(url=url):
+                if url.startswith('/api/async/'):
+                    response = self.client.get(url, {'ids': pk}, headers={
+                        'Authorization': 'Bearer %s' % AccessToken.for_user(self.user)})
+                else:
+                    response = self.client.get(url, {'ids': pk})
+                self.assertEqual([row['id'] for row in response.json()['results']], [pk])
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.client.get('/api/products/', {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/products/', {'ids': ','.join(map(str, range(1, 502)))}).status_code,
+                         400)
+
+
+class BatchTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.shopkeeper, self.shop = create_catalog(products=3)
+        self.product = Product.objects.order_by('id').first()
+        self.headers = {'Authorization': 'Bearer %s' % AccessToken.for_user(self.user)}
+        self.client = APIClient(headers=self.headers)
+
+    def batch(self, *requests, **options):
+        return self.client.post('/api/batch/', dict(options, requests=list(requests)), format='json')
+
+    def put_body(self, name):
+        return {'name': name, 'description': 'D', 'price': '2.00', 'stock_quantity': 1, 'shop': self.shop.pk}
+
+    def test_matches_separate_requests(self):
+        paths = ['/api/products/%d/' % self.product.pk, '/api/shops/%d/?fields=id,name' % self.shop.pk,
+                 '/api/products/?page_size=2', '/api/products/999999/']
+        response = self.batch(*[{'path': path} for path in paths])
+        self.assertEqual(response.status_code, 200)
+        for path, result in zip(paths, response.json()['responses']):
+            expected = self.client.get(path)
+            self.assertEqual((result['status'], result['body']), (expected.status_code, expected.json()), path)
+            self.assertEqual(result['headers'].get('ETag'), expected.get('ETag'), path)
+
+    def test_authenticates_once(self):
+        with mock.patch('shop.authentication.ClaimsJWTAuthentication.authenticate',
+                        autospec=True, side_effect=ClaimsJWTAuthentication.authenticate) as authenticate:
+            response = self.batch(*[{'path': '/api/products/%d/' % self.product.pk}] * 5)
+        self.assertEqual([result['status'] for result in response.json()['responses']], [200] * 5)
+        self.assertEqual(authenticate.call_count, 1)
+
+    def test_sub_requests_need_the_batch_to_be_authenticated(self):
+        response = APIClient().post('/api/batch/', {'requests': [{'path': '/api/products/'}]}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_writes_and_conditional_headers(self):
+        url = '/api/products/%d/' % self.product.pk
+        etag = self.client.get(url)['ETag']
+        response = self.batch({'path': url, 'headers': {'If-None-Match': etag}},
+                              {'path': url, 'method': 'PUT', 'body': self.put_body('Renamed')},
+                              {'path': url})
+        first, _, last = response.json()['responses']
+        self.assertEqual((first['status'], first['body']), (304, None))
+        # Later requests see earlier writes, and the detail cache was refreshed for them
+        self.assertEqual(last['body']['name'], 'Renamed')
+
+    def test_streaming_responses_are_closed_unread(self):
+        body = io.BytesIO(b'data')
+        finished = mock.Mock()
+        request_finished.connect(finished)
+        self.addCleanup(request_finished.disconnect, finished)
+        with mock.patch('shop.views.ProductDetailView.get', return_value=FileResponse(body)):
+            response = self.batch({'path': '/api/products/%d/' % self.product.pk})
+        self.assertEqual(response.json()['responses'][0]['status'], 400)
+        self.assertTrue(body.closed)
+        # Only the batch request itself finishes: a sub-request's would close the connection
+        self.assertEqual(finished.call_count, 1)
+
+    def test_exception_is_one_requests_500(self):
+        url = '/api/products/%d/' % self.product.pk
+        put = {'path': url, 'method': 'PUT', 'body': self.put_body('Renamed')}
+        with mock.patch('shop.views.ProductDetailView.get', side_effect=RuntimeError('boom')), \
+                self.assertLogs('shop.batch', 'ERROR'):
+            response = self.batch(put, {'path': url}, {'path': '/api/products/'})
+        self.assertEqual([result['status'] for result in response.json()['responses']], [200, 500, 200])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Renamed')
+
+        put['body'] = self.put_body('Again')
+        with mock.patch('shop.views.ProductDetailView.get', side_effect=RuntimeError('boom')), \
+                self.assertLogs('shop.batch', 'ERROR'):
+            response = self.batch(put, {'path': url}, {'path': '/api/products/'}, atomic=True)
+        self.assertEqual([result['status'] for result in response.json()['responses']], [200, 500, 424])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Renamed')
+
+    def test_atomic_rolls_back_on_failure(self):
+        url = '/api/products/%d/' % self.product.pk
+        self.client.get(url)
+        response = self.batch({'path': url, 'method': 'PUT', 'body': self.put_body('Renamed')},
+                              {'path': url},
+                              {'path': '/api/products/999999/'},
+                              {'path': url}, atomic=True)
+        self.assertEqual([result['status'] for result in response.json()['responses']], [200, 200, 404, 424])
+        self.assertEqual(response.json()['responses'][1]['body']['name'], 'Renamed')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Product 0')
+        # Nothing from the rolled-back transaction was cached
+        self.assertEqual(self.client.get(url).data['name'], 'Product 0')
+
+    def test_rejects_what_it_cannot_run(self):
+        response = self.batch({'path': '/api/products/export/'}, {'path': '/api/batch/'},
+                              {'path': '/api/async/products/'}, {'path': '/api/nowhere/'},
+                              {'path': '/profiles/'}, {'path': '/profiles/some.prof'}, {'path': '/admin/'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['requests']), 7)
+        with self.settings(SHOP_BATCH={'MAX_REQUESTS': 2}):
+            response = self.batch(*[{'path': '/api/products/'}] * 3)
+        self.assertEqual(response.status_code, 400)
+
+
+class FastJSONTests(SimpleTestCase):
+
+    def payload(self):
+        return {
+            'price': Decimal('12.50'),
+            'created': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            'label': gettext_lazy('Pending'),
+            'text': 'caf\u00e9 \u2028 \u2029',
+            'rows': [{'id': 1, 'rating_average': 4.5}, None, True],
+        }
+
+    def test_renders_like_json_renderer(self):
+        for data in (self.payload(), {1: 'non-string key'}, {'big': 2 ** 70}, [], None):
+            with self.subTest(data=data):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(self.payload(), indented),
+                         JSONRenderer().render(self.payload(), indented))
+
+    def test_stdlib_fallback(self):
+        with mock.patch('shop.renderers.orjson', None), mock.patch('shop.parsers.orjson', None):
+            body = FastJSONRenderer().render(self.payload())
+            self.assertEqual(body, JSONRenderer().render(self.payload()))
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(body))['price'], 12.5)
+
+    def test_parses_like_json_parser(self):
+        for body in (b'{"name": "caf\xc3\xa9", "price": 1.5, "ids": [1, 2]}', b'{"big": 1180591620717411303424}'):
+            with self.subTest(body=body):
+                self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for body in (b'{"price": NaN}', b'{"name": ', b''):
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError) as expected:
+                    JSONParser().parse(io.BytesIO(body))
+                with self.assertRaises(ParseError) as raised:
+                    FastJSONParser().parse(io.BytesIO(body))
+                self.assertEqual(str(raised.exception.detail), str(expected.exception.detail))
@@ -2,7 +2,12 @@ from django.urls import path
 from .views import (UserListCreateView, UserDetailView, ShopListCreateView, ShopDetailView, ShopkeeperListCreateView,
                     ShopkeeperDetailView, CustomerListCreateView, CustomerDetailView, ProductListCreateView,
                     ProductDetailView, ReviewListCreateView, ReviewDetailView, OrderListCreateView, OrderDetailView,
-                    OrderItemListCreateView, OrderItemDetailView, RegisterView, BulkProductCreateDeleteView)
+                    OrderItemListCreateView, OrderItemDetailView, RegisterView, BulkProductCreateDeleteView,
+                    ProductImportView, ProductExportView, OrderExportView, OrderItemExportView,
+                    CheckoutView, ProductReviewListView, JobDetailView,
+                    ShopAssignmentBatchView, BatchView)
+from .async_views import (AsyncShopListView, AsyncShopDetailView, AsyncProductListView, AsyncProductDetailView,
+                          AsyncOrderListView, AsyncOrderDetailView)
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
@@ -20,6 +25,7 @@ urlpatterns = [
     # Shop URLs
     path('shops/', ShopListCreateView.as_view(), name='shop-list-create'),
     path('shops/<int:pk>/', ShopDetailView.as_view(), name='shop-detail'),
+    path('shops/assignments/', ShopAssignmentBatchView.as_view(), name='shop-assignments'),
 
     # Shopkeeper URLs
     path('shopkeepers/', ShopkeeperListCreateView.as_view(), name='shopkeeper-list-create'),
@@ -32,8 +38,11 @@ urlpatterns = [
     # Product URLs
     path('products/', ProductListCreateView.as_view(), name='product-list-create'),
     path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
+    path('products/<int:pk>/reviews/', ProductReviewListView.as_view(), name='product-review-list'),
 
     path('bulk-products/', BulkProductCreateDeleteView.as_view(), name='bulk-product-create-delete'),
+    path('products/import/', ProductImportView.as_view(), name='product-import'),
+    path('products/export/', ProductExportView.as_view(), name='product-export'),
 
     # Review URLs
     path('reviews/', ReviewListCreateView.as_view(), name='review-list-create'),
@@ -42,8 +51,25 @@ urlpatterns = [
     # Order URLs
     path('orders/', OrderListCreateView.as_view(), name='order-list-create'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
+    path('orders/export/', OrderExportView.as_view(), name='order-export'),
+    path('checkout/', CheckoutView.as_view(), name='checkout'),
 
     # OrderItem URLs
     path('order-items/', OrderItemListCreateView.as_view(), name='orderitem-list-create'),
     path('order-items/<int:pk>/', OrderItemDetailView.as_view(), name='orderitem-detail'),
+    path('order-items/export/', OrderItemExportView.as_view(), name='orderitem-export'),
+
+    # Background job status (see shop/jobs.py)
+    path('jobs/<int:pk>/', JobDetailView.as_view(), name='job-detail'),
+
+    # Several of the calls above in one request (see shop/batch.py)
+    path('batch/', BatchView.as_view(), name='batch'),
+
+    # Async variants of the read-heavy endpoints, served side by side with the ones above
+    path('async/shops/', AsyncShopListView.as_view(), name='async-shop-list'),
+    path('async/shops/<int:pk>/', AsyncShopDetailView.as_view(), name='async-shop-detail'),
+    path('async/products/', AsyncProductListView.as_view(), name='async-product-list'),
+    path('async/products/<int:pk>/', AsyncProductDetailView.as_view(), name='async-product-detail'),
+    path('async/orders/', AsyncOrderListView.as_view(), name='async-order-list'),
+    path('async/orders/<int:pk>/', AsyncOrderDetailView.as_view(), name='async-order-detail'),
 ]
\ No newline at end of file
@@ -1,12 +1,31 @@
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .models import (User, Shop, Shopkeeper, Customer,
-                     Product, Review, Order, OrderItem, ShopAssignment)
-
+                     Product, Review, Order, OrderItem, ShopAssignment, Job)
+
+from .assignments import AssignmentConflict, apply_assignments
+from .authentication import user_claims
+from .batch import execute as execute_batch
+from .bulk import ProductImporter, iter_upload
+from .cache import detail_cache
+from .checkout import place_order
+from .conditional import ConditionalGetMixin, object_validators
+from .exports import iter_csv_export, iter_ndjson_export
+from .filters import FilterMixin, IdsFilterBackend, ProductFilterBackend, ProductSearchBackend
+from .jobs import enqueue
+from .pagination import KeysetPaginationMixin
+from .queryplan import optimize_queryset
+from .readers import get_reader
 from .serializers import (UserSerializer, ShopSerializer, ShopkeeperSerializer, CustomerSerializer,
-                          ProductSerializer, ReviewSerializer, OrderSerializer, OrderItemSerializer)
+                          ProductSerializer, ReviewSerializer, OrderSerializer, OrderItemSerializer,
+                          CheckoutSerializer, BulkDeleteSerializer, JobSerializer, BatchSerializer,
+                          ShopAssignmentSetSerializer, ShopAssignmentBatchSerializer, sparse_serializer_class)
 
 class RegisterView(APIView):
 
@@ -17,14 +36,19 @@ class RegisterView(APIView):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class UserListCreateView(APIView):
+class UserListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(UserSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(User.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        users = self.paginate_queryset(queryset)
+        serializer = serializer_class(users, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
     @swagger_auto_schema(request_body=UserSerializer)
@@ -35,21 +59,25 @@ class UserListCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class UserDetailView(APIView):
+class UserDetailView(ConditionalGetMixin, APIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=UserSerializer):
         try:
-            return User.objects.get(pk=pk)
+            return optimize_queryset(User.objects.all(), serializer_class).get(pk=pk)
         except User.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        user = self.get_object(pk)
+        serializer_class = sparse_serializer_class(UserSerializer, request)
+        user = self.get_object(pk, serializer_class)
         if user is None:
             return Response({"error": "User not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = UserSerializer(user)
+        not_modified = self.conditional_object(user, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(user)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=UserSerializer)
@@ -70,14 +98,19 @@ class UserDetailView(APIView):
         user.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ShopListCreateView(APIView):
+class ShopListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     serializer_class = ShopSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        shops = Shop.objects.all()
-        serializer = ShopSerializer(shops, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(ShopSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Shop.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        shops = self.paginate_queryset(queryset)
+        serializer = serializer_class(shops, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(request_body=ShopSerializer)
     def post(self, request):
@@ -103,22 +136,37 @@ class ShopListCreateView(APIView):
             return Response(shop_serializer.data, status=status.HTTP_201_CREATED)
         return Response(shop_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ShopDetailView(APIView):
+class ShopDetailView(ConditionalGetMixin, APIView):
     serializer_class = ShopSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=ShopSerializer):
         try:
-            return Shop.objects.get(pk=pk)
+            return optimize_queryset(Shop.objects.all(), serializer_class).get(pk=pk)
         except Shop.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        shop = self.get_object(pk)
-        if shop is None:
+        serializer_class = sparse_serializer_class(ShopSerializer, request)
+        if serializer_class is ShopSerializer:
+            # Cached together with its validators, so a revalidation costs no query at all
+            payload = detail_cache.get_or_build(Shop, pk, lambda: self.build_payload(pk))
+        else:
+            # Only the full representation is cached; a sparse one is a smaller query
+            payload = self.build_payload(pk, serializer_class)
+        if payload is None:
             return Response({"error": "Shop not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = ShopSerializer(shop)
-        return Response(serializer.data)
+        not_modified = self.conditional_response(payload['etag'], payload['last_modified'])
+        if not_modified:
+            return not_modified
+        return Response(payload['data'])
+
+    def build_payload(self, pk, serializer_class=ShopSerializer):
+        shop = self.get_object(pk, serializer_class)
+        if shop is None:
+            return None
+        etag, last_modified = object_validators(shop, serializer_class)
+        return {'data': serializer_class(shop).data, 'etag': etag, 'last_modified': last_modified}
 
     # def put(self, request, pk):
     #     shop = self.get_object(pk)
@@ -133,26 +181,29 @@ class ShopDetailView(APIView):
     @swagger_auto_schema(request_body=ShopSerializer)
     def put(self, request, pk):
         shop = self.get_object(pk)
+        if shop is None:
+            return Response({"error": "Shop not found"},status=status.HTTP_404_NOT_FOUND)
         shop_serializer = ShopSerializer(shop, data=request.data, partial=True)
-        if shop_serializer.is_valid():
-            shop = shop_serializer.save()
-
-            # Handle shopkeeper assignment updates
-            shopkeeper_ids = request.data.get('shopkeeper_ids', [])
-            ShopAssignment.objects.filter(shop=shop).delete()  # Clear existing shopkeepers
-
-            for shopkeeper_id in shopkeeper_ids:
-                try:
-                    shopkeeper = Shopkeeper.objects.get(id=shopkeeper_id)
-                    ShopAssignment.objects.create(shop=shop, shopkeeper=shopkeeper)
-                except Shopkeeper.DoesNotExist:
-                    return Response({"error": f"Shopkeeper with ID {shopkeeper_id} does not exist"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-            return Response(shop_serializer.data, status=status.HTTP_200_OK)
-        return Response(shop_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
+        if not shop_serializer.is_valid():
+            return Response(shop_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # shopkeeper_ids, when given, is the shop's complete new set of shopkeepers
+        assignment = None
+        if 'shopkeeper_ids' in request.data:
+            assignment = ShopAssignmentSetSerializer(data={'shop': pk,
+                                                           'shopkeeper_ids': request.data['shopkeeper_ids']})
+            if not assignment.is_valid():
+                return Response(assignment.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # The shop's fields and its shopkeepers change together or not at all
+        try:
+            with transaction.atomic():
+                shop_serializer.save()
+                if assignment is not None:
+                    apply_assignments({pk: assignment.validated_data['shopkeeper_ids']})
+        except AssignmentConflict as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(ShopSerializer(self.get_object(pk)).data, status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
         shop = self.get_object(pk)
@@ -161,14 +212,34 @@ class ShopDetailView(APIView):
         shop.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ShopkeeperListCreateView(APIView):
+class ShopAssignmentBatchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Sets the shopkeepers of many shops in one call: validated together, applied as one diff
+    @swagger_auto_schema(request_body=ShopAssignmentBatchSerializer)
+    def post(self, request):
+        serializer = ShopAssignmentBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            added, removed = apply_assignments({item['shop']: item['shopkeeper_ids']
+                                                for item in serializer.validated_data['shops']})
+        except AssignmentConflict as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({"added": added, "removed": removed}, status=status.HTTP_200_OK)
+
+class ShopkeeperListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     serializer_class = ShopkeeperSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        shopkeepers = Shopkeeper.objects.all()
-        serializer = ShopkeeperSerializer(shopkeepers, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(ShopkeeperSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Shopkeeper.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        shopkeepers = self.paginate_queryset(queryset)
+        serializer = serializer_class(shopkeepers, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(request_body=ShopkeeperSerializer)
     def post(self, request):
@@ -178,21 +249,25 @@ class ShopkeeperListCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ShopkeeperDetailView(APIView):
+class ShopkeeperDetailView(ConditionalGetMixin, APIView):
     serializer_class = ShopkeeperSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=ShopkeeperSerializer):
         try:
-            return Shopkeeper.objects.get(pk=pk)
+            return optimize_queryset(Shopkeeper.objects.all(), serializer_class).get(pk=pk)
         except Shopkeeper.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        shopkeeper = self.get_object(pk)
+        serializer_class = sparse_serializer_class(ShopkeeperSerializer, request)
+        shopkeeper = self.get_object(pk, serializer_class)
         if shopkeeper is None:
             return Response({"error": "Shopkeeper not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = ShopkeeperSerializer(shopkeeper)
+        not_modified = self.conditional_object(shopkeeper, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(shopkeeper)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=ShopkeeperSerializer)
@@ -213,14 +288,19 @@ class ShopkeeperDetailView(APIView):
         shopkeeper.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class CustomerListCreateView(APIView):
+class CustomerListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        customers = Customer.objects.all()
-        serializer = CustomerSerializer(customers, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(CustomerSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Customer.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        customers = self.paginate_queryset(queryset)
+        serializer = serializer_class(customers, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @swagger_auto_schema(request_body=CustomerSerializer)
     def post(self, request):
@@ -230,21 +310,25 @@ class CustomerListCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class CustomerDetailView(APIView):
+class CustomerDetailView(ConditionalGetMixin, APIView):
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=CustomerSerializer):
         try:
-            return Customer.objects.get(pk=pk)
+            return optimize_queryset(Customer.objects.all(), serializer_class).get(pk=pk)
         except Customer.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        customer = self.get_object(pk)
+        serializer_class = sparse_serializer_class(CustomerSerializer, request)
+        customer = self.get_object(pk, serializer_class)
         if customer is None:
             return Response({"error": "Customer not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = CustomerSerializer(customer)
+        not_modified = self.conditional_object(customer, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(customer)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=CustomerSerializer)
@@ -265,14 +349,30 @@ class CustomerDetailView(APIView):
         customer.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ProductListCreateView(APIView):
+class ProductListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
-
+    filter_backends = (IdsFilterBackend, ProductFilterBackend, ProductSearchBackend)
+    ordering_fields = ('id', 'name', 'price', 'stock_quantity')
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('ids', openapi.IN_QUERY, 'Comma-separated ids to fetch in one page', type=openapi.TYPE_STRING),
+        openapi.Parameter('q', openapi.IN_QUERY, 'Keyword search over name and description', type=openapi.TYPE_STRING),
+        openapi.Parameter('shop', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('added_by', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('min_price', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('max_price', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('in_stock', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+        openapi.Parameter('ordering', openapi.IN_QUERY, 'id, name, price or stock_quantity, "-" for descending',
+                          type=openapi.TYPE_STRING),
+    ])
     def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(ProductSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Product.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(self.paginate_values(queryset, get_reader(serializer_class)))
 
     @swagger_auto_schema(request_body=ProductSerializer)
     def post(self, request):
@@ -289,50 +389,99 @@ class BulkProductCreateDeleteView(APIView):
     # Bulk Product Creation
     @swagger_auto_schema(request_body=ProductSerializer(many=True))
     def post(self, request):
-        # Get the shopkeeper linked to the user
-        try:
-            shopkeeper = Shopkeeper.objects.get(user=request.user)
-        except Shopkeeper.DoesNotExist:
+        # The shopkeeper linked to the user, from the token claims
+        shopkeeper_id = user_claims(request.user)['shopkeeper_id']
+        if shopkeeper_id is None:
             return Response({'error': 'Shopkeeper not found'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Prepare products data
         products_data = request.data
+        if not isinstance(products_data, list) or not products_data:
+            return Response({"error": "Expected a non-empty list of products"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Pass the request context to the serializer to access the current user
-        serializer = ProductSerializer(data=products_data, many=True, context={'request': request})
-
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Validate in batches and insert with bulk_create; invalid rows are reported, not fatal
+        with transaction.atomic():
+            result = ProductImporter(shopkeeper_id).run(products_data)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not result['created']:
+            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_201_CREATED)
 
-    # Bulk Product Deletion
+    # Bulk Product Deletion: queued as a job (cascades make it slow); poll the Location for the outcome
+    @swagger_auto_schema(request_body=BulkDeleteSerializer)
     def delete(self, request):
-        product_ids = request.data('ids', [])
-        if not product_ids:
+        serializer = BulkDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response({"error": "No IDs provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Delete products by their IDs
-        Product.objects.filter(id__in=product_ids).delete()
-        return Response({"message": "Products deleted successfully"},status=status.HTTP_204_NO_CONTENT)
+        # A retried request with the same Idempotency-Key gets the original job back
+        key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        job = enqueue('products.bulk_delete', {'ids': serializer.validated_data['ids']},
+                      idempotency_key='bulk-delete:%s:%s' % (request.user.pk, key) if key else None,
+                      created_by=request.user.pk)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': reverse('job-detail', args=[job.pk])})
+
+
+class ProductImportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_batch_size = 5000
+    # Takes a streamed upload and streams progress back, so it cannot run inside /batch/
+    batchable = False
+
+    # Streaming catalog upload: NDJSON or CSV body, optionally gzip-compressed
+    def post(self, request):
+        shopkeeper_id = user_claims(request.user)['shopkeeper_id']
+        if shopkeeper_id is None:
+            return Response({'error': 'Shopkeeper not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in ('application/x-ndjson', 'application/jsonl', 'text/csv', 'application/csv',
+                                'application/gzip', 'application/x-gzip'):
+            return Response({"error": "Expected an NDJSON or CSV body"}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if request.stream is None:
+            return Response({"error": "Empty upload"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch_size = min(int(request.query_params.get('batch_size', 1000)), self.max_batch_size)
+        except ValueError:
+            return Response({"error": "batch_size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Rows are parsed, validated and committed one batch at a time while progress streams back
+        rows = iter_upload(request.stream, content_type, request.META.get('HTTP_CONTENT_ENCODING', ''))
+        importer = ProductImporter(shopkeeper_id, batch_size=max(batch_size, 1))
+        return StreamingHttpResponse(importer.progress(rows), content_type='application/x-ndjson')
 
 
-class ProductDetailView(APIView):
+class ProductDetailView(ConditionalGetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=ProductSerializer):
         try:
-            return Product.objects.get(pk=pk)
+            return optimize_queryset(Product.objects.all(), serializer_class).get(pk=pk)
         except Product.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        product = self.get_object(pk)
-        if product is None:
+        serializer_class = sparse_serializer_class(ProductSerializer, request)
+        if serializer_class is ProductSerializer:
+            # Cached together with its validators, so a revalidation costs no query at all
+            payload = detail_cache.get_or_build(Product, pk, lambda: self.build_payload(pk))
+        else:
+            # Only the full representation is cached; a sparse one is a smaller query
+            payload = self.build_payload(pk, serializer_class)
+        if payload is None:
             return Response({"error": "Product not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
+        not_modified = self.conditional_response(payload['etag'], payload['last_modified'])
+        if not_modified:
+            return not_modified
+        return Response(payload['data'])
+
+    def build_payload(self, pk, serializer_class=ProductSerializer):
+        product = self.get_object(pk, serializer_class)
+        if product is None:
+            return None
+        etag, last_modified = object_validators(product, serializer_class)
+        return {'data': serializer_class(product).data, 'etag': etag, 'last_modified': last_modified}
 
     @swagger_auto_schema(request_body=ProductSerializer)
     def put(self, request, pk):
@@ -352,36 +501,63 @@ class ProductDetailView(APIView):
         product.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ReviewListCreateView(APIView):
+class ReviewListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        reviews = Review.objects.all()
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(ReviewSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Review.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(self.paginate_values(queryset, get_reader(serializer_class)))
 
     @swagger_auto_schema(request_body=ReviewSerializer)
     def post(self, request):
+        customer_id = user_claims(request.user)['customer_id']
+        if customer_id is None:
+            return Response({'error': 'Customer not found'}, status=status.HTTP_400_BAD_REQUEST)
+
         serializer = ReviewSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            # The review and its product's rating aggregates commit together
+            with transaction.atomic():
+                serializer.save(customer_id=customer_id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class ReviewDetailView(APIView):
+class ProductReviewListView(ConditionalGetMixin, KeysetPaginationMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Reviews of one product, paged along the (product, id) index
+    def get(self, request, pk):
+        serializer_class = sparse_serializer_class(ReviewSerializer, request)
+        if not Product.objects.filter(pk=pk).exists():
+            return Response({"error": "Product not found"},status=status.HTTP_404_NOT_FOUND)
+        queryset = optimize_queryset(Review.objects.filter(product_id=pk), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(self.paginate_values(queryset, get_reader(serializer_class)))
+
+class ReviewDetailView(ConditionalGetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=ReviewSerializer):
         try:
-            return Review.objects.get(pk=pk)
+            return optimize_queryset(Review.objects.all(), serializer_class).get(pk=pk)
         except Review.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        review = self.get_object(pk)
+        serializer_class = sparse_serializer_class(ReviewSerializer, request)
+        review = self.get_object(pk, serializer_class)
         if review is None:
             return Response({"error": "Review not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = ReviewSerializer(review)
+        not_modified = self.conditional_object(review, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(review)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=ReviewSerializer)
@@ -391,7 +567,8 @@ class ReviewDetailView(APIView):
             return Response({"error": "Review not found"},status=status.HTTP_404_NOT_FOUND)
         serializer = ReviewSerializer(review, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -399,16 +576,20 @@ class ReviewDetailView(APIView):
         review = self.get_object(pk)
         if review is None:
             return Response({"error": "Review not found"},status=status.HTTP_404_NOT_FOUND)
-        review.delete()
+        with transaction.atomic():
+            review.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class OrderListCreateView(APIView):
+class OrderListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        orders = Order.objects.all()
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        serializer_class = sparse_serializer_class(OrderSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(Order.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(self.paginate_values(queryset, get_reader(serializer_class)))
 
     @swagger_auto_schema(request_body=OrderSerializer)
     def post(self, request):
@@ -418,20 +599,43 @@ class OrderListCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderDetailView(APIView):
+class CheckoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    # Places an order with all its items in one transaction; prices and totals are computed server-side
+    @swagger_auto_schema(request_body=CheckoutSerializer)
+    def post(self, request):
+        customer_id = user_claims(request.user)['customer_id']
+        if customer_id is None:
+            return Response({'error': 'Customer not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = place_order(customer_id, serializer.validated_data['shop'], serializer.validated_data['items'])
+
+        items = order.orderitem_set.order_by('id').values('id', 'product', 'quantity', 'price')
+        data = dict(OrderSerializer(order).data)
+        data['items'] = [dict(item, price=str(item['price'])) for item in items]
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class OrderDetailView(ConditionalGetMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self, pk, serializer_class=OrderSerializer):
         try:
-            return Order.objects.get(pk=pk)
+            return optimize_queryset(Order.objects.all(), serializer_class).get(pk=pk)
         except Order.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        order = self.get_object(pk)
+        serializer_class = sparse_serializer_class(OrderSerializer, request)
+        order = self.get_object(pk, serializer_class)
         if order is None:
             return Response({"error": "Order not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = OrderSerializer(order)
+        not_modified = self.conditional_object(order, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(order)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=OrderSerializer)
@@ -452,36 +656,43 @@ class OrderDetailView(APIView):
         order.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class OrderItemListCreateView(APIView):
+class OrderItemListCreateView(ConditionalGetMixin, FilterMixin, KeysetPaginationMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get(self, request, pk):
-        order_items = OrderItem.objects.all()
-        serializer = OrderItemSerializer(order_items, many=True)
-        return Response(serializer.data)
+    def get(self, request):
+        serializer_class = sparse_serializer_class(OrderItemSerializer, request)
+        queryset = optimize_queryset(self.filter_queryset(OrderItem.objects.all()), serializer_class)
+        not_modified = self.conditional_list(queryset, serializer_class)
+        if not_modified:
+            return not_modified
+        return self.get_paginated_response(self.paginate_values(queryset, get_reader(serializer_class)))
 
     @swagger_auto_schema(request_body=OrderItemSerializer)
-    def post(self, request, pk):
+    def post(self, request):
         serializer = OrderItemSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OrderItemDetailView(APIView):
+class OrderItemDetailView(ConditionalGetMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_object(self, pk):
+    def get_object(self, pk, serializer_class=OrderItemSerializer):
         try:
-            return OrderItem.objects.get(pk=pk)
+            return optimize_queryset(OrderItem.objects.all(), serializer_class).get(pk=pk)
         except OrderItem.DoesNotExist:
             return None
 
     def get(self, request, pk):
-        order_item = self.get_object(pk)
+        serializer_class = sparse_serializer_class(OrderItemSerializer, request)
+        order_item = self.get_object(pk, serializer_class)
         if order_item is None:
             return Response({"error": "Order not found"},status=status.HTTP_404_NOT_FOUND)
-        serializer = OrderItemSerializer(order_item)
+        not_modified = self.conditional_object(order_item, serializer_class)
+        if not_modified:
+            return not_modified
+        serializer = serializer_class(order_item)
         return Response(serializer.data)
 
     @swagger_auto_schema(request_body=OrderItemSerializer)
@@ -501,3 +712,72 @@ class OrderItemDetailView(APIView):
             return Response({"error": "Order not found"},status=status.HTTP_404_NOT_FOUND)
         order_item.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    batchable = False
+    model = None
+    fields = None
+    chunk_size = 2000
+
+    # Streams the whole table as flat rows (?output=ndjson or ?output=csv) with constant memory
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        queryset = self.model.objects.all()
+        name = self.model._meta.model_name
+        if output == 'csv':
+            response = StreamingHttpResponse(iter_csv_export(queryset, self.fields, self.chunk_size),
+                                             content_type='text/csv')
+        elif output == 'ndjson':
+            response = StreamingHttpResponse(iter_ndjson_export(queryset, self.fields, self.chunk_size),
+                                             content_type='application/x-ndjson')
+        else:
+            return Response({"error": "output must be 'ndjson' or 'csv'"}, status=status.HTTP_400_BAD_REQUEST)
+        response['Content-Disposition'] = 'attachment; filename="%ss.%s"' % (name, output)
+        return response
+
+
+class ProductExportView(ExportView):
+    model = Product
+    fields = ['id', 'name', 'description', 'price', 'stock_quantity', 'shop_id', 'added_by_id']
+
+
+class OrderExportView(ExportView):
+    model = Order
+    fields = ['id', 'customer_id', 'shop_id', 'total_price', 'status']
+
+
+class OrderItemExportView(ExportView):
+    model = OrderItem
+    fields = ['id', 'order_id', 'product_id', 'quantity', 'price']
+
+
+class JobDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    # Status of a background job; users see their own jobs, staff see all
+    def get(self, request, pk):
+        serializer_class = sparse_serializer_class(JobSerializer, request)
+        jobs = Job.objects.all()
+        if not request.user.is_staff:
+            jobs = jobs.filter(created_by_id=request.user.pk)
+        job = jobs.filter(pk=pk).first()
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(serializer_class(job).data)
+
+
+class BatchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    batchable = False
+
+    # Many API calls in one round trip, authenticated once; with "atomic" in one transaction
+    @swagger_auto_schema(request_body=BatchSerializer)
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        responses = execute_batch(request, serializer.validated_data['requests'],
+                                  atomic=serializer.validated_data['atomic'])
+        return Response({"responses": responses}, status=status.HTTP_200_OK)
+
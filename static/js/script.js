@@ -186,8 +186,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 }
             });
             if (!response.ok) throw new Error('Network response was not ok');
-            const users = await response.json();
-            users.forEach(user => {
+            const data = await response.json();
+            data.results.forEach(user => {
                 const li = document.createElement('li');
                 li.textContent = `${user.name} || ${user.email} || ${user.role}`;
                 usersList.appendChild(li);